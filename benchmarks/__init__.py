@@ -0,0 +1,3 @@
+"""
+Benchmarks for FileShare Pro storage and indexing (run with ``python -m``).
+"""
@@ -0,0 +1,129 @@
+"""
+Dedup ratio and reassembly throughput of the chunked storage mode.
+
+Stores a series of slightly edited versions of a file (as repeated uploads
+of an edited spreadsheet would produce) in the plain layout, the whole-file
+blob store and the chunk store, then reads every version back.
+
+    python -m benchmarks.bench_chunking --size-mb 4 --versions 10
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from blob_store import BlobStore, hash_file
+from chunk_store import ChunkStore
+from state_store import JsonFileStore, SharedDict
+
+
+def make_versions(size, versions, edits, seed=0):
+    """Yield ``versions`` file contents, each a few small edits from the last"""
+    rng = random.Random(seed)
+    # Half random, half repetitive, like a document with tables
+    data = bytearray(rng.randbytes(size // 2) + b"row,value,total\n" * (size // 32))
+    for _ in range(versions):
+        yield bytes(data)
+        for _ in range(edits):
+            position = rng.randrange(len(data))
+            if rng.random() < 0.5:
+                data[position:position] = rng.randbytes(rng.randint(1, 200))
+            else:
+                data[position : position + 100] = rng.randbytes(100)
+
+
+def disk_usage(root):
+    """Bytes used by distinct files (hard links counted once)"""
+    seen = set()
+    total = 0
+    for directory, _, filenames in os.walk(root):
+        for name in filenames:
+            stat = os.stat(os.path.join(directory, name))
+            if stat.st_ino not in seen:
+                seen.add(stat.st_ino)
+                total += stat.st_size
+    return total
+
+
+def read_all(paths, open_file):
+    start = time.perf_counter()
+    total = 0
+    for path in paths:
+        with open_file(path) as f:
+            while True:
+                data = f.read(1024 * 1024)
+                if not data:
+                    break
+                total += len(data)
+    return total, time.perf_counter() - start
+
+
+def run(size, versions, edits):
+    contents = list(make_versions(size, versions, edits))
+    logical = sum(len(content) for content in contents)
+    results = {}
+    root = tempfile.mkdtemp()
+    try:
+        for layout in ("plain", "blob", "chunked"):
+            files = os.path.join(root, layout, "files")
+            os.makedirs(files)
+            index = SharedDict(JsonFileStore({}), layout)
+            blobs = BlobStore(os.path.join(root, layout, "store"), index)
+            chunks = ChunkStore(os.path.join(root, layout, "store"), index)
+
+            paths = []
+            digests = {}
+            start = time.perf_counter()
+            for number, content in enumerate(contents):
+                path = os.path.join(files, f"report_{number}.xlsx")
+                with open(path, "wb") as f:
+                    f.write(content)
+                if layout == "blob":
+                    blobs.add(path, hash_file(path)[1])
+                elif layout == "chunked":
+                    digests[path] = chunks.put(path)[1]
+                paths.append(path)
+            store_time = time.perf_counter() - start
+
+            if layout == "chunked":
+                open_file = lambda path: chunks.open(digests[path])  # noqa: E731
+            else:
+                open_file = lambda path: open(path, "rb")  # noqa: E731
+            read, read_time = read_all(paths, open_file)
+            assert read == logical
+
+            stored = disk_usage(os.path.join(root, layout))
+            results[layout] = {
+                "stored_mb": stored / 2**20,
+                "dedup_ratio": logical / stored,
+                "store_mb_s": logical / 2**20 / store_time,
+                "read_mb_s": logical / 2**20 / read_time,
+            }
+    finally:
+        shutil.rmtree(root)
+    return logical, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size-mb", type=float, default=4)
+    parser.add_argument("--versions", type=int, default=10)
+    parser.add_argument("--edits", type=int, default=3, help="edits per version")
+    args = parser.parse_args()
+
+    logical, results = run(int(args.size_mb * 2**20), args.versions, args.edits)
+    print(f"{args.versions} versions, {logical / 2**20:.1f} MB logical")
+    print(
+        f"{'layout':<10}{'stored MB':>12}{'dedup':>10}{'store MB/s':>14}{'read MB/s':>12}"
+    )
+    for layout, result in results.items():
+        print(
+            f"{layout:<10}{result['stored_mb']:>12.2f}{result['dedup_ratio']:>9.2f}x"
+            f"{result['store_mb_s']:>14.1f}{result['read_mb_s']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
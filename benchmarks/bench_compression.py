@@ -0,0 +1,141 @@
+"""
+Space saved and throughput of at-rest compression per file type.
+
+Generates sample contents typical of uploads (logs, CSV exports, JSON,
+legacy office documents, and already compressed images and archives),
+compresses each with every available codec in the framed format and
+reads it back in full and with random range reads. Also shows whether
+``choose_codec`` would compress the file at all.
+
+    python -m benchmarks.bench_compression --size-mb 8
+"""
+import argparse
+import io
+import json
+import mimetypes
+import os
+import random
+import tempfile
+import time
+import zipfile
+
+from compression import CODECS, choose_codec, compress_stream, open_framed
+
+
+def make_samples(size, seed=0):
+    """Yield ``(file name, content)`` of about ``size`` bytes per file type"""
+    rng = random.Random(seed)
+    words = [rng.randbytes(rng.randint(2, 8)).hex() for _ in range(2000)]
+
+    lines = []
+    while sum(map(len, lines)) < size:
+        lines.append(
+            f"2024-05-{rng.randint(1, 28):02d} INFO worker-{rng.randint(1, 8)} "
+            f"{' '.join(rng.choices(words, k=6))}\n"
+        )
+    yield "server.log", "".join(lines).encode()[:size]
+
+    rows = ["date,region,product,units,amount\n"]
+    while sum(map(len, rows)) < size:
+        rows.append(
+            f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d},"
+            f"{rng.choice(['north', 'south', 'east', 'west'])},"
+            f"{rng.choice(words)},{rng.randint(1, 500)},{rng.random() * 1000:.2f}\n"
+        )
+    yield "export.csv", "".join(rows).encode()[:size]
+
+    records = []
+    while len(records) * 120 < size:
+        records.append(
+            {
+                "id": len(records),
+                "name": rng.choice(words),
+                "tags": rng.sample(words, 3),
+            }
+        )
+    yield "records.json", json.dumps(records, indent=2).encode()[:size]
+
+    # Legacy binary spreadsheet: cell records with padding, some noise
+    cells = bytearray()
+    while len(cells) < size:
+        cells += (
+            rng.randint(0, 65535).to_bytes(2, "little")
+            + b"\x00" * 14
+            + rng.choice(words).encode()
+        )
+    yield "report.xls", bytes(cells[:size])
+
+    # JPEG-like: compressed image data is close to random
+    yield "photo.jpg", rng.randbytes(size)
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("word/document.xml", "".join(lines).encode()[: size * 4])
+    yield "letter.docx", buffer.getvalue()
+
+
+def measure(content, codec, reads):
+    """Stored size and throughput of one content with one codec"""
+    packed = io.BytesIO()
+    start = time.perf_counter()
+    compress_stream(io.BytesIO(content), packed, codec)
+    compress_time = time.perf_counter() - start
+    packed = packed.getvalue()
+
+    start = time.perf_counter()
+    with open_framed(io.BytesIO(packed)) as f:
+        assert f.read() == content
+    read_time = time.perf_counter() - start
+
+    rng = random.Random(1)
+    start = time.perf_counter()
+    for _ in range(reads):
+        offset = rng.randrange(len(content))
+        with open_framed(io.BytesIO(packed)) as f:
+            f.seek(offset)
+            assert f.read(4096) == content[offset : offset + 4096]
+    range_time = time.perf_counter() - start
+
+    megabytes = len(content) / 2**20
+    return {
+        "ratio": len(content) / len(packed),
+        "compress_mb_s": megabytes / compress_time,
+        "read_mb_s": megabytes / read_time,
+        "range_ms": range_time / reads * 1000,
+    }
+
+
+def run(size, reads):
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        for name, content in make_samples(size):
+            path = os.path.join(root, name)
+            with open(path, "wb") as f:
+                f.write(content)
+            chosen = choose_codec(mimetypes.guess_type(name)[0], path)
+            for codec in sorted(CODECS):
+                results.append((name, codec, chosen, measure(content, codec, reads)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--reads", type=int, default=50, help="range reads per file")
+    args = parser.parse_args()
+
+    results = run(int(args.size_mb * 2**20), args.reads)
+    print(
+        f"{'file':<14}{'codec':<7}{'chosen':<8}{'ratio':>8}"
+        f"{'compress MB/s':>15}{'read MB/s':>11}{'range ms':>10}"
+    )
+    for name, codec, chosen, result in results:
+        print(
+            f"{name:<14}{codec:<7}{chosen or '-':<8}{result['ratio']:>7.2f}x"
+            f"{result['compress_mb_s']:>15.1f}{result['read_mb_s']:>11.1f}"
+            f"{result['range_ms']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
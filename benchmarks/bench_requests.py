@@ -0,0 +1,355 @@
+"""
+Latency of the request hot paths on synthetic stores of increasing size.
+
+Seeds a store of N files, each with a share link (1k, 10k and 100k files
+by default), and measures through the Flask test client:
+
+- ``/api/files``, ``/api/v1/files`` and ``/api/stats``
+- share link resolution (``/share/<token>``)
+- uploads of 1 MB and 100 MB (``/api/upload``)
+
+and, once per run, thumbnail generation and the fan-out of a
+``files_changed`` broadcast to N in-process Socket.IO clients. Contents
+and names are generated from a fixed seed, so two runs measure the same
+work.
+
+Results are written as JSON; ``--compare`` reads an earlier result file
+and reports the cases whose median got slower than ``--threshold``
+(exiting with status 1 if any did), for use as a regression check. Cases
+whose run time, extrapolated from the smaller stores, would exceed
+``--budget`` seconds are recorded as skipped.
+
+    python -m benchmarks.bench_requests --output results.json
+    python -m benchmarks.bench_requests --sizes 1000 --compare results.json
+"""
+import argparse
+import gc
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from PIL import Image
+
+import app as fileshare
+
+API_KEY = "benchmark-key"
+LARGE_UPLOAD = "upload_100mb"
+
+
+def seed_store(data_dir, upload_dir, count, seed=0):
+    """Write ``count`` small files with metadata and a share link each"""
+    rng = random.Random(seed)
+    now = datetime(2024, 1, 1)
+    metadata = {}
+    links = {}
+    for i in range(count):
+        filename = f"file-{i:06d}.txt"
+        content = f"{filename} {rng.randbytes(16).hex()}\n".encode()
+        with open(os.path.join(upload_dir, filename), "wb") as f:
+            f.write(content)
+        uploaded = now - timedelta(minutes=rng.randrange(60 * 24 * 30))
+        metadata[filename] = {
+            "original_name": filename,
+            "folder_path": "",
+            "size": len(content),
+            "md5": rng.randbytes(16).hex(),
+            "upload_date": uploaded.isoformat(),
+            "downloads": rng.randrange(100),
+        }
+        links[rng.randbytes(24).hex()] = {
+            "filename": filename,
+            "folder_path": "",
+            "created_at": uploaded.isoformat(),
+            "expires_at": (uploaded + timedelta(days=3650)).isoformat(),
+            "download_count": 0,
+            "max_downloads": None,
+            "version": None,
+        }
+    for name, data in (
+        (fileshare.METADATA_FILE, metadata),
+        (fileshare.SHARE_LINKS_FILE, links),
+    ):
+        with open(os.path.join(data_dir, name), "w") as f:
+            json.dump(data, f)
+    return sorted(links)
+
+
+def create_app(root, max_upload):
+    """Configure the app for a store seeded under ``root``"""
+    flask_app = fileshare.create_app(
+        {
+            "TESTING": True,
+            "UPLOAD_FOLDER": os.path.join(root, "uploads"),
+            "DATA_DIR": os.path.join(root, "data"),
+            "MAX_CONTENT_LENGTH": max_upload + 2**20,
+            "STATE_BACKEND": "json",
+            "LOAD_STATE": True,
+            "BACKGROUND_TASKS": False,
+            "STORAGE_MODE": "blob",
+            "OBJECT_STORE": None,
+            "OBJECT_STORE_FALLBACK": None,
+            "TIERING": False,
+            "COLD_STORE": None,
+            "COMPRESSION": False,
+            "FILE_VERSIONING": False,
+            "RETENTION_POLICIES": {"default": {"ttl_days": None}},
+            "STORAGE_QUOTAS": {},
+            "SOCKETIO_COALESCE_WINDOW": 0,
+        }
+    )
+    fileshare.api_keys[API_KEY] = {
+        "name": "benchmark",
+        "created_at": datetime(2024, 1, 1).isoformat(),
+        "usage_count": 0,
+    }
+    client = flask_app.test_client()
+    client.post("/login", data={"username": "admin", "password": "admin"})
+    return flask_app, client
+
+
+def summarize(times):
+    times_ms = [t * 1000 for t in times]
+    return {
+        "runs": len(times_ms),
+        "min_ms": min(times_ms),
+        "median_ms": statistics.median(times_ms),
+        "mean_ms": statistics.fmean(times_ms),
+        "max_ms": max(times_ms),
+    }
+
+
+def measure(run, repeat):
+    """Time ``repeat`` calls of ``run(i)``"""
+    gc.collect()
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        run(i)
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+def estimate(history, size):
+    """Seconds per run of a case at ``size`` files, extrapolated from the
+    medians measured on smaller stores (None: no measurement yet)"""
+    points = [(n, result["median_ms"] / 1000) for n, result in history]
+    if not points:
+        return None
+    exponent = 1.0
+    if len(points) >= 2:
+        (n1, t1), (n2, t2) = points[-2:]
+        if t1 > 0 and t2 > 0 and n2 != n1:
+            exponent = max(1.0, math.log(t2 / t1) / math.log(n2 / n1))
+    n, t = points[-1]
+    return t * (size / n) ** exponent
+
+
+def checked(response, status=200):
+    assert response.status_code == status, (response.status_code, response.data)
+    return response
+
+
+def store_cases(client, tokens, contents):
+    """Cases that depend on the number of files, by name"""
+    rng = random.Random(1)
+
+    def upload(name, content):
+        def run(i):
+            checked(
+                client.post(
+                    "/api/upload",
+                    data={"file": (io.BytesIO(content), f"{name}-{i}.txt")},
+                    content_type="multipart/form-data",
+                )
+            )
+
+        return run
+
+    cases = {
+        "api_files": lambda i: checked(client.get("/api/files")),
+        "v1_files": lambda i: checked(
+            client.get("/api/v1/files", headers={"X-API-Key": API_KEY})
+        ),
+        "stats": lambda i: checked(client.get("/api/stats")),
+        "share_link": lambda i: checked(
+            client.get(f"/share/{rng.choice(tokens)}")
+        ).close(),
+        "upload_1mb": upload("upload-1mb", contents["upload_1mb"]),
+    }
+    if LARGE_UPLOAD in contents:
+        cases[LARGE_UPLOAD] = upload("upload-100mb", contents[LARGE_UPLOAD])
+    return cases
+
+
+def bench_thumbnail(root, repeat):
+    """Thumbnail generation for a 12 megapixel photo"""
+    rng = random.Random(2)
+    image = Image.frombytes("RGB", (400, 300), rng.randbytes(400 * 300 * 3))
+    image = image.resize((4000, 3000), Image.Resampling.BICUBIC)
+    path = os.path.join(root, "photo.jpg")
+    image.save(path, "JPEG", quality=90)
+
+    def run(i):
+        assert fileshare.create_thumbnail(path, f"photo-{i}.jpg")
+
+    return measure(run, repeat)
+
+
+def bench_fanout(flask_app, clients, repeat):
+    """Broadcast of one file change to ``clients`` Socket.IO clients"""
+    sio_clients = [fileshare.socketio.test_client(flask_app) for _ in range(clients)]
+    for sio_client in sio_clients:
+        sio_client.get_received()
+
+    def run(i):
+        change = {"action": "uploaded", "path": f"fanout-{i}.txt"}
+        fileshare.file_events.publish(change)
+        for sio_client in sio_clients:
+            assert sio_client.get_received()
+
+    try:
+        return measure(run, repeat)
+    finally:
+        for sio_client in sio_clients:
+            sio_client.disconnect()
+
+
+def run(sizes, repeat, clients, budget, large_upload=True, seed=0):
+    rng = random.Random(seed)
+    contents = {"upload_1mb": rng.randbytes(2**20)}
+    if large_upload:
+        contents[LARGE_UPLOAD] = rng.randbytes(100 * 2**20)
+    max_upload = max(map(len, contents.values()))
+
+    results = {}
+    history = {}
+    thumbnails_folder = fileshare.THUMBNAILS_FOLDER
+    root = tempfile.mkdtemp(prefix="fileshare-bench-")
+    try:
+        fileshare.THUMBNAILS_FOLDER = os.path.join(root, "thumbnails")
+        for size in sorted(sizes):
+            store = os.path.join(root, f"store-{size}")
+            for name in ("uploads", "data"):
+                os.makedirs(os.path.join(store, name))
+            start = time.perf_counter()
+            tokens = seed_store(
+                os.path.join(store, "data"), os.path.join(store, "uploads"), size
+            )
+            flask_app, client = create_app(store, max_upload)
+            print(
+                f"seeded {size} files in {time.perf_counter() - start:.1f}s",
+                file=sys.stderr,
+            )
+            for case, call in store_cases(client, tokens, contents).items():
+                key = f"{case}/{size}"
+                expected = estimate(history.get(case, []), size)
+                if expected is not None and expected * repeat > budget:
+                    results[key] = {"skipped": f"estimated {expected:.1f}s per run"}
+                    continue
+                results[key] = measure(call, repeat)
+                history.setdefault(case, []).append((size, results[key]))
+                print(f"{key}: {results[key]['median_ms']:.1f} ms", file=sys.stderr)
+            fileshare.shutdown(timeout=5)
+            shutil.rmtree(store)
+
+        os.makedirs(fileshare.THUMBNAILS_FOLDER, exist_ok=True)
+        results["thumbnail"] = bench_thumbnail(root, repeat)
+        store = os.path.join(root, "store-fanout")
+        for name in ("uploads", "data"):
+            os.makedirs(os.path.join(store, name))
+        flask_app, _ = create_app(store, max_upload)
+        for count in clients:
+            results[f"socketio_fanout/{count}"] = bench_fanout(flask_app, count, repeat)
+        fileshare.shutdown(timeout=5)
+    finally:
+        fileshare.THUMBNAILS_FOLDER = thumbnails_folder
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change of every case's median; returns the regressed cases"""
+    regressions = []
+    print(f"{'case':<28}{'baseline ms':>13}{'now ms':>11}{'change':>9}")
+    for key, result in results.items():
+        before = baseline.get(key)
+        if not before or "median_ms" not in before or "median_ms" not in result:
+            continue
+        change = result["median_ms"] / before["median_ms"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(key)
+            flag = "  slower"
+        print(
+            f"{key:<28}{before['median_ms']:>13.2f}{result['median_ms']:>11.2f}"
+            f"{change:>+9.0%}{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="store sizes")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case")
+    parser.add_argument(
+        "--clients", default="1,10,100", help="Socket.IO clients for the fan-out"
+    )
+    parser.add_argument(
+        "--budget", type=float, default=60, help="seconds allowed per case"
+    )
+    parser.add_argument(
+        "--no-large-upload", action="store_true", help="skip the 100 MB upload"
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="slowdown reported as regression"
+    )
+    args = parser.parse_args()
+
+    results = run(
+        [int(size) for size in args.sizes.split(",")],
+        args.repeat,
+        [int(count) for count in args.clients.split(",")],
+        args.budget,
+        large_upload=not args.no_large_upload,
+    )
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+    else:
+        print(f"{'case':<28}{'median ms':>11}{'min ms':>10}{'max ms':>10}")
+        for key, result in results.items():
+            if "skipped" in result:
+                print(f"{key:<28}  skipped ({result['skipped']})")
+                continue
+            print(
+                f"{key:<28}{result['median_ms']:>11.2f}{result['min_ms']:>10.2f}"
+                f"{result['max_ms']:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
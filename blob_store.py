@@ -0,0 +1,319 @@
+"""
+Content-addressed blob storage for FileShare Pro.
+
+Every distinct file content is stored once, as a blob named by its SHA-256
+digest under ``<root>/<aa>/<bb>/<digest>``. The files in the upload folder
+are hard links to their blob: directory entries pointing at the stored
+content, so every existing code path keeps serving files by their logical
+path while identical uploads share one copy on disk.
+
+Blobs are reference counted in the ``blobs`` state namespace (digest ->
+size, refs, created_at); file metadata records the digest of each file.
+Uploading known content replaces the new file with a link to the existing
+blob, deleting a file decrements the count, and ``gc()`` removes blobs
+that are no longer referenced. An unreferenced entry records when its
+count dropped to zero (``zero_since``) and is only reclaimed once it has
+stayed at zero for a grace period: an upload references its blob before
+its file metadata is written, so a recount from the metadata can briefly
+miss it.
+
+Where hard links are not supported (e.g. the blob root is on another file
+system) uploads are stored as plain files without deduplication.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+
+CHUNK_SIZE = 1024 * 1024
+# Size of the leading and trailing samples clients may send with a pre-check
+SAMPLE_SIZE = 64 * 1024
+
+
+def hash_file(path, tree=None):
+    """Return the ``(md5, sha256)`` hex digests of a file in one pass
+
+    ``tree`` (a ``tree_hash.TreeHasher``) is fed the content in the same
+    pass.
+    """
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            md5.update(chunk)
+            sha256.update(chunk)
+            if tree is not None:
+                tree.update(chunk)
+    return md5.hexdigest(), sha256.hexdigest()
+
+
+def sample_digests(path, size=SAMPLE_SIZE, open_file=open):
+    """Return the MD5 hex digests of the first and last ``size`` bytes"""
+    with open_file(path, "rb") as f:
+        head = hashlib.md5(f.read(size)).hexdigest()
+        f.seek(max(f.seek(0, os.SEEK_END) - size, 0))
+        tail = hashlib.md5(f.read(size)).hexdigest()
+    return head, tail
+
+
+def with_refs(entry, refs):
+    """Copy of a reference-counted index entry with ``refs`` references
+
+    Keeps ``zero_since`` (when the count dropped to zero) up to date.
+    """
+    entry = dict(entry, refs=refs)
+    if refs > 0:
+        entry.pop("zero_since", None)
+    else:
+        entry.setdefault("zero_since", time.time())
+    return entry
+
+
+def recount(index, key, refs=None):
+    """Correct the reference count of ``index[key]`` to ``refs``
+
+    Without ``refs`` the count is kept. Entries at zero without
+    ``zero_since`` (stored before it was tracked) get one, so they wait for
+    a grace period like the others.
+    """
+    entry = index.get(key)
+    if entry is None:
+        return
+    current = entry.get("refs", 0)
+    target = current if refs is None else refs
+    if current == target and (target > 0) != ("zero_since" in entry):
+        return
+
+    def correct(entry):
+        if entry is None:
+            return None
+        return with_refs(entry, entry.get("refs", 0) if refs is None else refs)
+
+    index.update_item(key, correct)
+
+
+def reclaim(index, key, cutoff):
+    """Delete ``index[key]`` if it has been unreferenced since before ``cutoff``
+
+    Checked and deleted atomically, so a reference added in the meantime
+    keeps the entry. Returns the deleted entry, or None.
+    """
+    entry = index.get(key)
+    if entry is None or not expired(entry, cutoff):
+        return None
+
+    def drop(current):
+        if current is None or not expired(current, cutoff):
+            return current
+        return None
+
+    if index.update_item(key, drop) is not None:
+        return None
+    return entry
+
+
+def expired(entry, cutoff):
+    return entry.get("refs", 0) <= 0 and entry.get("zero_since", cutoff) < cutoff
+
+
+class HashIndex:
+    """Content hash -> file keys, kept in sync with the file metadata.
+
+    Answers "is this content already stored?" from memory, by the
+    ``sha256`` field of the metadata together with the file size. MD5
+    collisions are cheap to produce, so a file is found by its ``md5`` only
+    when no SHA-256 was recorded for it (files stored before it was).
+    """
+
+    def __init__(self):
+        self._docs = {}
+        self._keys = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, file_key, metadata):
+        doc = (metadata.get("size"), metadata.get("md5"), metadata.get("sha256"))
+        with self._lock:
+            if self._docs.get(file_key) == doc:
+                return
+            self.remove(file_key)
+            self._docs[file_key] = doc
+            digest = self._digest(doc)
+            if digest:
+                self._keys.setdefault((doc[0], digest), set()).add(file_key)
+
+    def remove(self, file_key):
+        with self._lock:
+            doc = self._docs.pop(file_key, None)
+            if doc is None:
+                return
+            key = (doc[0], self._digest(doc))
+            keys = self._keys.get(key)
+            if keys is not None:
+                keys.discard(file_key)
+                if not keys:
+                    del self._keys[key]
+
+    @staticmethod
+    def _digest(doc):
+        """The digest a file is found by: its SHA-256, else its MD5"""
+        return doc[2] or doc[1]
+
+    def rebuild(self, files):
+        with self._lock:
+            self._docs = {}
+            self._keys = {}
+            for file_key, metadata in files.items():
+                self.add(file_key, metadata)
+
+    def apply(self, changes, reset=False):
+        """``SharedDict`` listener keeping the index in sync with metadata"""
+        with self._lock:
+            if reset:
+                self.rebuild(changes)
+                return
+            for file_key, metadata in changes.items():
+                if metadata is None:
+                    self.remove(file_key)
+                else:
+                    self.add(file_key, metadata)
+
+    def lookup(self, size, digest):
+        """Sorted keys of the files with this size and SHA-256 digest (or MD5
+        digest, for files without a recorded SHA-256)"""
+        with self._lock:
+            return sorted(self._keys.get((size, digest.lower()), ()))
+
+
+class BlobStore:
+    """Reference-counted blobs keyed by SHA-256, linked into place."""
+
+    def __init__(self, root, index):
+        self.root = root
+        self.index = index
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def find(self, size, digest):
+        """Return the blob entry for known content, or None
+
+        Both the size and the digest must match, so a client cannot claim
+        content by its hash alone.
+        """
+        entry = self.index.get(digest)
+        if entry is None or entry["size"] != size:
+            return None
+        if not os.path.exists(self.path(digest)):
+            return None
+        return entry
+
+    def _reference(self, digest, size):
+        def increment(entry):
+            entry = dict(entry or {"created_at": datetime.now().isoformat()})
+            entry["size"] = size
+            return with_refs(entry, entry.get("refs", 0) + 1)
+
+        self.index.update_item(digest, increment)
+
+    def add(self, file_path, digest, copy=False):
+        """Store the content of an uploaded file and reference it
+
+        ``file_path`` becomes a link to the blob. Returns True when the
+        content was already stored (the upload took no extra space), False
+        when a new blob was created and None if linking is unsupported.
+        With ``copy`` the content is copied into the store instead when it
+        cannot be linked.
+        """
+        blob_path = self.path(digest)
+        size = os.path.getsize(file_path)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        try:
+            os.link(file_path, blob_path)
+            duplicate = False
+        except FileExistsError:
+            self.link(digest, file_path)
+            duplicate = True
+        except OSError:
+            if not copy:
+                return None
+            tmp_path = f"{blob_path}.{uuid.uuid4().hex}.tmp"
+            shutil.copyfile(file_path, tmp_path)
+            os.replace(tmp_path, blob_path)
+            duplicate = False
+        self._reference(digest, size)
+        return duplicate
+
+    def link(self, digest, file_path):
+        """Atomically point ``file_path`` at an existing blob"""
+        tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        os.link(self.path(digest), tmp_path)
+        os.replace(tmp_path, file_path)
+
+    def add_reference(self, digest, file_path):
+        """Create ``file_path`` as a new reference to a stored blob"""
+        self.link(digest, file_path)
+        self._reference(digest, self.index[digest]["size"])
+
+    def release(self, digest):
+        """Drop one reference; the blob is reclaimed by the next ``gc()``"""
+        if not digest or digest not in self.index:
+            return
+
+        def decrement(entry):
+            if entry is None:
+                return None
+            return with_refs(entry, max(entry.get("refs", 0) - 1, 0))
+
+        self.index.update_item(digest, decrement)
+
+    def gc(self, references=None, grace=3600):
+        """Delete unreferenced blobs and return ``(blobs, bytes)`` reclaimed
+
+        ``references`` (digest -> number of files using it), when given,
+        corrects the stored reference counts first. A blob is only deleted
+        once it has been unreferenced for ``grace`` seconds, and blob files
+        that are not in the index at all (left behind by a crash) once they
+        are older than that.
+        """
+        for digest in list(self.index.keys()):
+            recount(
+                self.index,
+                digest,
+                None if references is None else references.get(digest, 0),
+            )
+
+        cutoff = time.time() - grace
+        removed = reclaimed = 0
+        for digest in list(self.index.keys()):
+            if reclaim(self.index, digest, cutoff) is None:
+                continue
+            reclaimed += self._remove(self.path(digest))
+            removed += 1
+
+        for directory, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(directory, name)
+                if name not in self.index and os.path.getmtime(path) < cutoff:
+                    reclaimed += self._remove(path)
+                    removed += 1
+        return removed, reclaimed
+
+    @staticmethod
+    def _remove(path):
+        """Remove a blob file; return the bytes freed on disk"""
+        try:
+            stat = os.stat(path)
+            os.remove(path)
+        except OSError:
+            return 0
+        # Space is only freed when no other link points at the content
+        return stat.st_size if stat.st_nlink == 1 else 0
+
+    def stored_size(self):
+        return sum(entry["size"] for entry in self.index.values())
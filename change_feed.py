@@ -0,0 +1,86 @@
+"""
+Sequence-numbered change feed for FileShare Pro.
+
+Every change to the file list or to share links is recorded in a log kept
+by the state store and gets a monotonically increasing sequence number.
+Clients remember the last number they applied and ask for the changes after
+it (``GET /api/changes?since=N`` or the ``sync_changes`` Socket.IO event)
+instead of refetching the full listing when they reconnect.
+
+The log is compacted by key: every entry carries the full current state of
+its file or share link, so only the newest entry per key is kept. The log
+is also bounded; when old entries are trimmed the floor rises, and a client
+whose cursor falls below it is told to resync with a full listing.
+"""
+import time
+
+# Check the size bound every this many appends instead of on every write
+TRIM_INTERVAL = 100
+
+
+class ChangeFeed:
+    """Record and read changes through a state store log."""
+
+    def __init__(self, store, log="changes", max_entries=10000):
+        self.store = store
+        self.log = log
+        self.max_entries = max_entries
+        self._appends = 0
+
+    def record(self, entry_type, key, path, action, data=None):
+        """Record a change and return the feed entry including its ``seq``
+
+        ``entry_type`` is "file" or "share_link", ``key`` identifies the
+        object (file path or share token) and ``data`` is its new state, or
+        None when it was deleted.
+        """
+        entry = {
+            "type": entry_type,
+            "key": key,
+            "path": path,
+            "action": action,
+            "data": data,
+            "timestamp": time.time(),
+        }
+        seq = self.store.log_append(self.log, f"{entry_type}:{key}", entry)
+        self._appends += 1
+        if self._appends % TRIM_INTERVAL == 0:
+            self.trim()
+        return dict(entry, seq=seq)
+
+    def trim(self):
+        self.store.log_trim(self.log, self.max_entries)
+
+    def head(self):
+        """Sequence number of the newest change"""
+        return self.store.log_bounds(self.log)[1]
+
+    def read(self, since, limit=500, folder_path=None):
+        """Return the changes after ``since``
+
+        The result holds ``changes``, ``last_seq`` (the cursor to pass next
+        time) and ``has_more``. When ``since`` is older than the retained
+        log, or newer than anything recorded (e.g. the log was reset), the
+        result is ``{"resync_required": True, "last_seq": head}`` and the
+        client must reload the full listing.
+
+        ``folder_path`` limits the changes to files in that folder and its
+        subfolders; the cursor still advances past the skipped entries.
+        """
+        floor, head = self.store.log_bounds(self.log)
+        if since < floor or since > head:
+            return {"resync_required": True, "last_seq": head}
+
+        entries = self.store.log_read(self.log, since, limit)
+        has_more = len(entries) >= limit
+        if has_more:
+            last_seq = entries[-1]["seq"]
+        else:
+            last_seq = max([head] + [entry["seq"] for entry in entries])
+
+        if folder_path:
+            prefix = folder_path.strip("/") + "/"
+            entries = [
+                entry for entry in entries if (entry["path"] or "").startswith(prefix)
+            ]
+        return {"changes": entries, "last_seq": last_seq, "has_more": has_more}
@@ -0,0 +1,79 @@
+"""
+Persistent chat history for FileShare Pro.
+
+Messages are appended to a journal in the state store (an append-only JSON
+lines file for the default ``json`` backend, a table or sorted set for the
+shared backends), which assigns monotonic message IDs. The newest messages
+are also kept in a fixed-size ring buffer, so sending recent history to a
+connecting client does not touch the disk, and older pages are read from
+the journal with ``before(before_id)``.
+"""
+import threading
+from collections import deque
+
+
+class ChatHistory:
+    """Chat messages in a state store journal with an in-memory tail."""
+
+    def __init__(self, store, journal="chat", cache_size=100):
+        self.store = store
+        self.journal = journal
+        self.cache_size = cache_size
+        self._recent = deque(maxlen=cache_size)
+        # True when the ring buffer holds every message ever written
+        self._complete = False
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def bind(self, store):
+        """Switch to another store and forget the cached messages"""
+        with self._lock:
+            self.store = store
+            self._recent = deque(maxlen=self.cache_size)
+            self._loaded = False
+
+    def _load(self):
+        if not self._loaded:
+            messages = self.store.journal_read(self.journal, limit=self.cache_size)
+            self._recent.extend(messages)
+            self._complete = len(messages) < self.cache_size
+            self._loaded = True
+
+    def append(self, message):
+        """Store a message and return it with its new ``id``"""
+        with self._lock:
+            self._load()
+            message = dict(message)
+            message.pop("id", None)
+            message["id"] = self.store.journal_append(self.journal, message)
+            if self._complete and len(self._recent) == self.cache_size:
+                self._complete = False
+            self._recent.append(message)
+            return message
+
+    def before(self, before_id=None, limit=20):
+        """Return up to ``limit`` messages older than ``before_id``
+
+        Messages are returned oldest first, with ``has_more`` telling
+        whether even older messages exist: ``(messages, has_more)``.
+        """
+        with self._lock:
+            self._load()
+            # Other workers write to shared stores, so the local tail is
+            # only authoritative for single-process backends
+            if not self.store.shared:
+                cached = [
+                    message
+                    for message in self._recent
+                    if before_id is None or message["id"] < before_id
+                ]
+                if len(cached) > limit:
+                    return cached[-limit:], True
+                if self._complete:
+                    return cached, False
+
+        messages = self.store.journal_read(self.journal, before_id, limit + 1)
+        return messages[-limit:], len(messages) > limit
+
+    def recent(self, limit=20):
+        return self.before(None, limit)
@@ -0,0 +1,326 @@
+"""
+Content-defined chunk storage for FileShare Pro.
+
+In the ``chunked`` storage mode uploads are split into variable-size chunks
+with a FastCDC-style rolling hash (a gear hash with normalized chunking).
+Chunk boundaries depend on the content around them, so an edit only
+changes the chunks it touches and slightly different versions of a file
+share most of their chunks.
+
+Chunks are stored once under ``<root>/chunks/<aa>/<bb>/<digest>``. The
+manifest of a file (the digests and sizes of its chunks) is stored under
+``<root>/manifests/<aa>/<bb>/<sha256>.json``, named by the SHA-256 of the
+whole content, and the logical file in the upload folder is a small pointer
+to it. Manifests and chunks are reference counted in the ``chunks`` state
+namespace (``file:<sha256>`` and ``chunk:<digest>`` keys); ``gc()`` removes
+what has been unreferenced for a grace period (see blob_store.py).
+
+``ChunkedFile`` reads a file back as a seekable stream, so downloads are
+reassembled chunk by chunk and range requests only read the chunks they
+need.
+"""
+import hashlib
+import io
+import json
+import os
+import time
+import uuid
+from bisect import bisect_right
+from datetime import datetime
+
+from blob_store import reclaim, recount, with_refs
+
+MIN_SIZE = 2 * 1024
+AVG_SIZE = 8 * 1024
+MAX_SIZE = 64 * 1024
+READ_SIZE = 1024 * 1024
+POINTER_PREFIX = "chunked:"
+
+_MASK64 = (1 << 64) - 1
+
+
+def _gear_table():
+    """256 pseudo-random 64-bit values (fixed, so boundaries are stable)"""
+    return [
+        int.from_bytes(hashlib.md5(bytes([i])).digest()[:8], "big") for i in range(256)
+    ]
+
+
+GEAR = _gear_table()
+
+
+def _mask(bits):
+    # The gear hash shifts left, so the high bits depend on the last 64
+    # bytes while the low bits only see the last few
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+class Chunker:
+    """FastCDC-style content-defined chunker."""
+
+    def __init__(self, min_size=MIN_SIZE, avg_size=AVG_SIZE, max_size=MAX_SIZE):
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        bits = avg_size.bit_length() - 1
+        # Harder to match before the average size, easier after it, which
+        # keeps chunk sizes close to the average (normalized chunking)
+        self.mask_small = _mask(bits + 2)
+        self.mask_large = _mask(bits - 2)
+
+    def cut_point(self, data, start, end):
+        """Length of the chunk starting at ``data[start]`` (up to ``end``)"""
+        length = end - start
+        if length <= self.min_size:
+            return length
+        limit = min(length, self.max_size)
+        normal = min(limit, self.avg_size)
+        gear = GEAR
+        mask64 = _MASK64
+        fingerprint = 0
+        position = self.min_size
+        for mask, stop in ((self.mask_small, normal), (self.mask_large, limit)):
+            for byte in data[start + position : start + stop]:
+                fingerprint = ((fingerprint << 1) + gear[byte]) & mask64
+                position += 1
+                if not fingerprint & mask:
+                    return position
+        return limit
+
+    def chunks(self, stream):
+        """Yield the chunks (bytes) of a binary stream"""
+        buffer = b""
+        position = 0
+        eof = False
+        while True:
+            if not eof and len(buffer) - position < self.max_size:
+                data = stream.read(READ_SIZE)
+                if data:
+                    buffer = buffer[position:] + data
+                    position = 0
+                    continue
+                eof = True
+            if position >= len(buffer):
+                return
+            length = self.cut_point(buffer, position, len(buffer))
+            yield buffer[position : position + length]
+            position += length
+
+
+class ChunkedFile(io.RawIOBase):
+    """Read-only, seekable view of a chunked file."""
+
+    def __init__(self, store, manifest):
+        self._store = store
+        self._chunks = manifest["chunks"]
+        self._offsets = []
+        offset = 0
+        for _, size in self._chunks:
+            self._offsets.append(offset)
+            offset += size
+        self.size = offset
+        self._position = 0
+        self._current = (None, b"")
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._position = offset
+        return offset
+
+    def _chunk(self, index):
+        if self._current[0] != index:
+            with open(self._store.chunk_path(self._chunks[index][0]), "rb") as f:
+                self._current = (index, f.read())
+        return self._current[1]
+
+    def readinto(self, buffer):
+        if self._position >= self.size:
+            return 0
+        index = bisect_right(self._offsets, self._position) - 1
+        data = self._chunk(index)
+        start = self._position - self._offsets[index]
+        count = min(len(buffer), len(data) - start)
+        buffer[:count] = data[start : start + count]
+        self._position += count
+        return count
+
+
+class ChunkStore:
+    """Reference-counted chunks and manifests keyed by SHA-256."""
+
+    def __init__(self, root, index, chunker=None):
+        self.root = root
+        self.index = index
+        self.chunker = chunker or Chunker()
+
+    def chunk_path(self, digest):
+        return os.path.join(self.root, "chunks", digest[:2], digest[2:4], digest)
+
+    def manifest_path(self, digest):
+        return os.path.join(
+            self.root, "manifests", digest[:2], digest[2:4], digest + ".json"
+        )
+
+    @staticmethod
+    def _write(path, data):
+        """Write a file atomically (readers never see a partial file)"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _reference(self, key, size):
+        def increment(entry):
+            entry = dict(entry or {"created_at": datetime.now().isoformat()})
+            entry["size"] = size
+            return with_refs(entry, entry.get("refs", 0) + 1)
+
+        self.index.update_item(key, increment)
+
+    def put(self, file_path, tree=None):
+        """Chunk a file into the store and replace it with a pointer
+
+        Returns ``(md5, sha256)`` of the content. Only chunks that are not
+        stored yet are written. ``tree`` (a ``tree_hash.TreeHasher``) is
+        fed the content in the same pass.
+        """
+        md5 = hashlib.md5()
+        sha256 = hashlib.sha256()
+        chunks = []
+        with open(file_path, "rb") as f:
+            for data in self.chunker.chunks(f):
+                md5.update(data)
+                sha256.update(data)
+                if tree is not None:
+                    tree.update(data)
+                digest = hashlib.sha256(data).hexdigest()
+                if f"chunk:{digest}" not in self.index or not os.path.exists(
+                    self.chunk_path(digest)
+                ):
+                    self._write(self.chunk_path(digest), data)
+                chunks.append([digest, len(data)])
+
+        digest = sha256.hexdigest()
+        size = sum(chunk_size for _, chunk_size in chunks)
+        if f"file:{digest}" not in self.index:
+            self._write(
+                self.manifest_path(digest),
+                json.dumps({"size": size, "chunks": chunks}).encode(),
+            )
+            for chunk_digest, chunk_size in chunks:
+                self._reference(f"chunk:{chunk_digest}", chunk_size)
+        self._reference(f"file:{digest}", size)
+        self._write_pointer(file_path, digest)
+        return md5.hexdigest(), digest
+
+    @staticmethod
+    def _write_pointer(file_path, digest):
+        ChunkStore._write(file_path, (POINTER_PREFIX + digest).encode())
+
+    def find(self, size, digest):
+        """Return the manifest entry for known content, or None"""
+        entry = self.index.get(f"file:{digest}")
+        if entry is None or entry["size"] != size or entry.get("refs", 0) <= 0:
+            return None
+        return entry
+
+    def add_reference(self, digest, file_path):
+        """Create ``file_path`` as a new pointer to stored content"""
+        self._write_pointer(file_path, digest)
+        self._reference(f"file:{digest}", self.index[f"file:{digest}"]["size"])
+
+    def open(self, digest):
+        """Open stored content as a seekable binary stream"""
+        with open(self.manifest_path(digest), "r") as f:
+            return io.BufferedReader(ChunkedFile(self, json.load(f)), READ_SIZE)
+
+    def release(self, digest):
+        """Drop one reference; content is reclaimed by ``gc()``"""
+        key = f"file:{digest}"
+        if not digest or key not in self.index:
+            return
+        self.index.update_item(key, self._decrement)
+
+    @staticmethod
+    def _decrement(entry):
+        if entry is None:
+            return None
+        return with_refs(entry, max(entry.get("refs", 0) - 1, 0))
+
+    def gc(self, references=None, grace=3600):
+        """Delete unreferenced manifests and chunks
+
+        Returns ``(files, bytes)`` reclaimed. ``references`` (sha256 ->
+        number of files using it) corrects the file reference counts first.
+        Manifests and chunks are deleted once they have been unreferenced
+        for ``grace`` seconds, and chunk files missing from the index (left
+        by an interrupted upload) once they are older than that.
+        """
+        for key in list(self.index.keys()):
+            if references is not None and key.startswith("file:"):
+                recount(self.index, key, references.get(key[5:], 0))
+            else:
+                recount(self.index, key)
+
+        cutoff = time.time() - grace
+        removed = reclaimed = 0
+        for key in list(self.index.keys()):
+            if not key.startswith("file:") or reclaim(self.index, key, cutoff) is None:
+                continue
+            digest = key[5:]
+            try:
+                with open(self.manifest_path(digest), "r") as f:
+                    chunks = json.load(f)["chunks"]
+            except (OSError, ValueError):
+                chunks = []
+            for chunk_digest, _ in chunks:
+                self.index.update_item(f"chunk:{chunk_digest}", self._decrement)
+            self._remove(self.manifest_path(digest))
+            removed += 1
+
+        for key in list(self.index.keys()):
+            if key.startswith("chunk:") and reclaim(self.index, key, cutoff):
+                reclaimed += self._remove(self.chunk_path(key[6:]))
+
+        for directory, _, filenames in os.walk(os.path.join(self.root, "chunks")):
+            for name in filenames:
+                path = os.path.join(directory, name)
+                if f"chunk:{name}" not in self.index and (
+                    os.path.getmtime(path) < cutoff
+                ):
+                    reclaimed += self._remove(path)
+        return removed, reclaimed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return 0
+        return size
+
+    def stats(self):
+        """Logical bytes referenced by files and bytes stored in chunks"""
+        logical = stored = 0
+        for key, entry in self.index.items():
+            if key.startswith("file:"):
+                logical += entry["size"] * entry.get("refs", 0)
+            else:
+                stored += entry["size"]
+        return {"logical_bytes": logical, "stored_bytes": stored}
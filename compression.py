@@ -0,0 +1,231 @@
+"""
+At-rest compression for FileShare Pro.
+
+Text, CSV exports and legacy office documents compress several times,
+while images, videos, archives and the zip-based office formats are
+already compressed. ``choose_codec`` picks a codec from the MIME type of an
+upload and samples the file's byte entropy, so incompressible content is
+stored as is without spending time on it.
+
+Compressed content is stored as independently compressed frames of
+``FRAME_SIZE`` bytes, followed by an index of the frames:
+
+    MAGIC | codec | frame | frame | ... | index (JSON) | index length | MAGIC
+
+``FramedFile`` reads it as a seekable stream: a read decompresses only the
+frames it covers, so range requests and resumed downloads do not
+decompress the file from the start. Frames that do not shrink are stored
+uncompressed.
+
+The ``zstd`` codec requires the ``zstandard`` package; without it ``zlib``
+is used instead.
+"""
+import io
+import json
+import math
+import os
+import zlib
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+MAGIC = b"FSPZ"
+FRAME_SIZE = 256 * 1024
+# Files smaller than this are not worth compressing
+MIN_SIZE = 4096
+# Samples above this many bits per byte are treated as incompressible
+MAX_ENTROPY = 7.2
+SAMPLE_COUNT = 4
+SAMPLE_SIZE = 16 * 1024
+
+CODECS = {
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+}
+if zstandard is not None:
+    CODECS["zstd"] = (
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+
+# Preferred codec per MIME type (or type prefix ending in "/"); other types
+# are stored uncompressed
+TYPE_CODECS = {
+    "text/": "zstd",
+    "application/json": "zstd",
+    "application/xml": "zstd",
+    "application/javascript": "zstd",
+    "image/svg+xml": "zstd",
+    "application/rtf": "zlib",
+    "application/msword": "zlib",
+    "application/vnd.ms-excel": "zlib",
+    "application/vnd.ms-powerpoint": "zlib",
+    "application/pdf": "zlib",
+}
+
+
+def codec_for_type(mime_type):
+    """Preferred codec for a MIME type (None: do not compress)"""
+    if not mime_type:
+        return None
+    codec = TYPE_CODECS.get(mime_type) or TYPE_CODECS.get(mime_type.split("/")[0] + "/")
+    if codec is not None and codec not in CODECS:
+        codec = "zlib"
+    return codec
+
+
+def sample_entropy(file_path, samples=SAMPLE_COUNT, sample_size=SAMPLE_SIZE):
+    """Shannon entropy (bits per byte) of blocks spread over a file"""
+    size = os.path.getsize(file_path)
+    counts = Counter()
+    total = 0
+    with open(file_path, "rb") as f:
+        for number in range(samples):
+            f.seek(max(size - sample_size, 0) * number // max(samples - 1, 1))
+            data = f.read(sample_size)
+            counts.update(data)
+            total += len(data)
+    if not total:
+        return 0.0
+    return -sum(count / total * math.log2(count / total) for count in counts.values())
+
+
+def choose_codec(mime_type, file_path):
+    """Codec to store a file with, or None to store it as is"""
+    codec = codec_for_type(mime_type)
+    if codec is None:
+        return None
+    try:
+        if os.path.getsize(file_path) < MIN_SIZE:
+            return None
+        if sample_entropy(file_path) > MAX_ENTROPY:
+            return None
+    except OSError:
+        return None
+    return codec
+
+
+def _read_full(stream, size):
+    data = stream.read(size)
+    while data and len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def compress_stream(source, target, codec="zlib", frame_size=FRAME_SIZE):
+    """Write ``source`` to ``target`` as compressed frames
+
+    Returns ``(size, stored size)``.
+    """
+    compress = CODECS[codec][0]
+    header = MAGIC + bytes([len(codec)]) + codec.encode()
+    target.write(header)
+    offset = len(header)
+    frames = []
+    size = 0
+    while True:
+        data = _read_full(source, frame_size)
+        if not data:
+            break
+        packed = compress(data)
+        compressed = len(packed) < len(data)
+        if not compressed:
+            packed = data
+        target.write(packed)
+        frames.append([offset, len(packed), int(compressed)])
+        offset += len(packed)
+        size += len(data)
+
+    index = json.dumps(
+        {"codec": codec, "frame_size": frame_size, "size": size, "frames": frames},
+        separators=(",", ":"),
+    ).encode()
+    target.write(index + len(index).to_bytes(8, "little") + MAGIC)
+    return size, offset + len(index) + 8 + len(MAGIC)
+
+
+def compress_file(source_path, target_path, codec="zlib"):
+    """Compress a file into the framed format; returns ``(size, stored size)``"""
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        return compress_stream(source, target, codec)
+
+
+def read_index(raw):
+    """Frame index of framed content in a seekable binary stream"""
+    trailer_size = 8 + len(MAGIC)
+    raw.seek(-trailer_size, io.SEEK_END)
+    trailer = raw.read(trailer_size)
+    if len(trailer) != trailer_size or trailer[8:] != MAGIC:
+        raise ValueError("Not compressed content")
+    length = int.from_bytes(trailer[:8], "little")
+    raw.seek(-(trailer_size + length), io.SEEK_END)
+    return json.loads(raw.read(length))
+
+
+class FramedFile(io.RawIOBase):
+    """Read-only, seekable view of framed compressed content."""
+
+    def __init__(self, raw):
+        self._raw = raw
+        index = read_index(raw)
+        if index["codec"] not in CODECS:
+            raise ValueError(f"Codec not available: {index['codec']}")
+        self._decompress = CODECS[index["codec"]][1]
+        self._frame_size = index["frame_size"]
+        self._frames = index["frames"]
+        self.size = index["size"]
+        self._position = 0
+        self._current = (None, b"")
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._position = offset
+        return offset
+
+    def _frame(self, number):
+        if self._current[0] != number:
+            offset, length, compressed = self._frames[number]
+            self._raw.seek(offset)
+            data = _read_full(self._raw, length)
+            self._current = (number, self._decompress(data) if compressed else data)
+        return self._current[1]
+
+    def readinto(self, buffer):
+        if self._position >= self.size:
+            return 0
+        number = self._position // self._frame_size
+        data = self._frame(number)
+        start = self._position - number * self._frame_size
+        count = min(len(buffer), len(data) - start)
+        buffer[:count] = data[start : start + count]
+        self._position += count
+        return count
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+        super().close()
+
+
+def open_framed(raw):
+    """Open framed content (a seekable binary stream) for reading"""
+    return io.BufferedReader(FramedFile(raw), FRAME_SIZE)
@@ -0,0 +1,729 @@
+"""
+Full-text content index for FileShare Pro.
+
+Text is extracted from uploads (plain text directly, the XML parts of
+``docx``/``xlsx`` documents through ``zipfile``) and added to an inverted
+index that is queried with BM25 ranking.
+
+The index lives in a directory of immutable segment files plus a
+``manifest.json`` naming the live segments and the deleted documents:
+
+- Ingest runs in the background, off the upload path. It follows the change
+  feed: new and changed files are indexed in batches, each batch becomes a
+  new small segment, and deleted files are marked in the manifest. The
+  manifest records the feed position, so ingest resumes after a restart.
+- When there are too many segments the smallest ones are merged into one,
+  dropping deleted documents; segments that are mostly deleted are merged
+  away as well.
+- Queries memory-map the segment files and binary-search their sorted term
+  tables, so only the pages touched by a query are read and query memory
+  does not grow with the size of the index. Any worker process can query;
+  it picks up new segments when the manifest changes.
+
+Segment file layout (integers little-endian):
+
+    header      b"FSCI", version u32, term count u32, document count u32
+    term table  per term: term offset u64, postings offset u64, doc freq u32
+    terms       per term: length u16, UTF-8 bytes (sorted by bytes)
+    postings    per term: (doc id delta, term frequency) as varints
+
+Document keys, lengths and checksums of a segment are kept next to it in
+``<segment>.docs.json``, and the start of each document's text (for result
+snippets, so queries never re-read the files) in ``<segment>.text``:
+
+    offsets     per document plus one: offset u64 into the text
+    text        UTF-8, whitespace collapsed, ``SNIPPET_TEXT_CHARS`` at most
+"""
+import heapq
+import html
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from collections import Counter
+
+MAGIC = b"FSCI"
+VERSION = 1
+HEADER = struct.Struct("<4sIII")
+TERM_ENTRY = struct.Struct("<QQI")
+TERM_LENGTH = struct.Struct("<H")
+TEXT_OFFSET = struct.Struct("<Q")
+
+# Extraction limits: text beyond this is not indexed, larger XML parts are
+# skipped (protects against zip bombs)
+MAX_TEXT_CHARS = 2_000_000
+MAX_XML_BYTES = 64 * 1024 * 1024
+MAX_TERM_LENGTH = 64
+# Text kept per document for snippets; matches beyond it show the start
+SNIPPET_TEXT_CHARS = 100_000
+
+TEXT_EXTENSIONS = {"txt"}
+OFFICE_EXTENSIONS = {"docx", "xlsx"}
+
+TOKEN_RE = re.compile(r"\w+")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def indexable(filename):
+    return filename.rsplit(".", 1)[-1].lower() in TEXT_EXTENSIONS | OFFICE_EXTENSIONS
+
+
+def _office_parts(zf, extension):
+    names = zf.namelist()
+    if extension == "docx":
+        return [name for name in names if name == "word/document.xml"]
+    parts = [name for name in names if name == "xl/sharedStrings.xml"]
+    # Inline strings are stored in the sheets themselves
+    parts += sorted(
+        name
+        for name in names
+        if name.startswith("xl/worksheets/sheet") and name.endswith(".xml")
+    )
+    return parts
+
+
+def _xml_text(stream, budget):
+    """Text of ``<t>`` elements, one line per paragraph or cell"""
+    chunks = []
+    for _, element in ET.iterparse(stream, events=("end",)):
+        tag = element.tag.rsplit("}", 1)[-1]
+        if tag == "t" and element.text:
+            chunks.append(element.text)
+            budget -= len(element.text)
+        elif tag in ("p", "si", "c"):
+            chunks.append("\n")
+        element.clear()
+        if budget <= 0:
+            break
+    return "".join(chunks)
+
+
+def extract_text(path, open_file=open):
+    """Extract the indexable text of a file ("" when unsupported)"""
+    extension = path.rsplit(".", 1)[-1].lower()
+    try:
+        if extension in TEXT_EXTENSIONS:
+            with open_file(path, "rb") as f:
+                return f.read(MAX_TEXT_CHARS).decode("utf-8", errors="replace")
+        if extension in OFFICE_EXTENSIONS:
+            texts = []
+            budget = MAX_TEXT_CHARS
+            with open_file(path, "rb") as f, zipfile.ZipFile(f) as zf:
+                for name in _office_parts(zf, extension):
+                    if zf.getinfo(name).file_size > MAX_XML_BYTES or budget <= 0:
+                        continue
+                    with zf.open(name) as stream:
+                        text = _xml_text(stream, budget)
+                    texts.append(text)
+                    budget -= len(text)
+            return "\n".join(texts)
+    except (OSError, zipfile.BadZipFile, ET.ParseError, KeyError):
+        pass
+    return ""
+
+
+def tokenize(text):
+    return [
+        token
+        for token in TOKEN_RE.findall(text.lower())
+        if len(token) <= MAX_TERM_LENGTH
+    ]
+
+
+def snippet_text(text):
+    """The part of a document's text stored for snippets"""
+    return " ".join(text[: SNIPPET_TEXT_CHARS * 2].split())[:SNIPPET_TEXT_CHARS]
+
+
+def highlight(text, query, width=160):
+    """HTML snippet of text around the first query term, terms in <mark>"""
+    terms = sorted(set(tokenize(query)), key=len, reverse=True)
+    if not terms or not text:
+        return ""
+    pattern = re.compile(
+        r"\b(" + "|".join(re.escape(term) for term in terms) + r")\b",
+        re.IGNORECASE,
+    )
+    match = pattern.search(text)
+    start = max((match.start() if match else 0) - width // 3, 0)
+    window = " ".join(text[start : start + width].split())
+
+    parts = []
+    position = 0
+    for found in pattern.finditer(window):
+        parts.append(html.escape(window[position : found.start()]))
+        parts.append(f"<mark>{html.escape(found.group(0))}</mark>")
+        position = found.end()
+    parts.append(html.escape(window[position:]))
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if start + width < len(text) else ""
+    return prefix + "".join(parts) + suffix
+
+
+def _encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_varint(buffer, pos):
+    result = shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_postings(postings):
+    """Encode ``[(doc id, term frequency), ...]`` sorted by doc id"""
+    out = bytearray()
+    previous = 0
+    for doc, tf in postings:
+        _encode_varint(doc - previous, out)
+        _encode_varint(tf, out)
+        previous = doc
+    return out
+
+
+def write_segment(path, docs, terms, texts):
+    """Write a segment file and its docs and text sidecars
+
+    ``docs`` is a list of ``[file key, length, md5]`` (the position is the
+    doc id), ``terms`` an iterable of ``(term bytes, df, postings bytes)``
+    sorted by term bytes and ``texts`` the snippet text of each document.
+    """
+    table = []
+    term_blob = bytearray()
+    with tempfile.TemporaryFile() as postings_file:
+        postings_offset = 0
+        for term, df, postings in terms:
+            table.append((len(term_blob), postings_offset, df))
+            term_blob += TERM_LENGTH.pack(len(term)) + term
+            postings_file.write(postings)
+            postings_offset += len(postings)
+
+        terms_start = HEADER.size + TERM_ENTRY.size * len(table)
+        postings_start = terms_start + len(term_blob)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(table), len(docs)))
+            for term_offset, offset, df in table:
+                f.write(
+                    TERM_ENTRY.pack(
+                        terms_start + term_offset, postings_start + offset, df
+                    )
+                )
+            f.write(term_blob)
+            postings_file.seek(0)
+            while True:
+                chunk = postings_file.read(1024 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+        os.replace(tmp_path, path)
+
+    encoded = [text.encode() for text in texts]
+    with open(f"{path}.text.tmp", "wb") as f:
+        offset = TEXT_OFFSET.size * (len(encoded) + 1)
+        for data in encoded:
+            f.write(TEXT_OFFSET.pack(offset))
+            offset += len(data)
+        f.write(TEXT_OFFSET.pack(offset))
+        f.writelines(encoded)
+    os.replace(f"{path}.text.tmp", f"{path}.text")
+
+    with open(f"{path}.docs.json.tmp", "w") as f:
+        json.dump(docs, f)
+    os.replace(f"{path}.docs.json.tmp", f"{path}.docs.json")
+
+
+class Segment:
+    """Read-only view of a memory-mapped segment file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(f"{path}.docs.json") as f:
+            self.docs = json.load(f)
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.term_count, doc_count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or doc_count != len(self.docs):
+            self._map.close()
+            raise ValueError(f"Invalid index segment: {path}")
+        try:
+            with open(f"{path}.text", "rb") as f:
+                self._text_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Written before snippet text was stored (or empty)
+            self._text_map = None
+
+    def _entry(self, i):
+        return TERM_ENTRY.unpack_from(self._map, HEADER.size + TERM_ENTRY.size * i)
+
+    def _term_at(self, offset):
+        (length,) = TERM_LENGTH.unpack_from(self._map, offset)
+        start = offset + TERM_LENGTH.size
+        return self._map[start : start + length]
+
+    def lookup(self, term):
+        """``(df, postings offset)`` of a term (bytes), or None"""
+        low, high = 0, self.term_count
+        while low < high:
+            mid = (low + high) // 2
+            term_offset, postings_offset, df = self._entry(mid)
+            current = self._term_at(term_offset)
+            if current == term:
+                return df, postings_offset
+            if current < term:
+                low = mid + 1
+            else:
+                high = mid
+        return None
+
+    def postings(self, df, offset):
+        doc = 0
+        for _ in range(df):
+            delta, offset = _decode_varint(self._map, offset)
+            tf, offset = _decode_varint(self._map, offset)
+            doc += delta
+            yield doc, tf
+
+    def terms(self):
+        """All ``(term bytes, df, postings offset)`` in term order"""
+        for i in range(self.term_count):
+            term_offset, postings_offset, df = self._entry(i)
+            yield self._term_at(term_offset), df, postings_offset
+
+    def text(self, doc_id):
+        """Snippet text of a document ("" for segments without it)"""
+        if self._text_map is None:
+            return ""
+        start, end = struct.unpack_from(
+            "<QQ", self._text_map, TEXT_OFFSET.size * doc_id
+        )
+        return self._text_map[start:end].decode("utf-8", errors="replace")
+
+    def close(self):
+        self._map.close()
+        if self._text_map is not None:
+            self._text_map.close()
+
+
+class ContentIndex:
+    """Segmented full-text index over uploaded files.
+
+    ``feed`` is the ``ChangeFeed`` followed by ingest, ``resolve_path``
+    maps a file key to its path on disk, ``open_file`` opens that path (as
+    ``open()`` does) and ``list_files`` returns all file metadata (used to
+    rebuild when the feed was trimmed past our position).
+    """
+
+    def __init__(
+        self,
+        directory,
+        feed=None,
+        resolve_path=None,
+        list_files=None,
+        open_file=open,
+        batch_size=200,
+        max_segments=8,
+        merge_factor=4,
+    ):
+        self.directory = directory
+        self.feed = feed
+        self.resolve_path = resolve_path
+        self.list_files = list_files
+        self.open_file = open_file
+        self.batch_size = batch_size
+        self.max_segments = max_segments
+        self.merge_factor = merge_factor
+        os.makedirs(directory, exist_ok=True)
+        self._manifest_path = os.path.join(directory, "manifest.json")
+
+        # Reader state, swapped as a whole when the manifest changes
+        self._lock = threading.RLock()
+        self._version = None
+        self._segments = {}
+        self._manifest = self._empty_manifest()
+        self._stats = (0, 0.0)
+        self._documents = {}
+
+        # Writer state (ingest worker only): file key -> (segment, doc, md5)
+        self._write_lock = threading.Lock()
+        self._locations = None
+
+    @staticmethod
+    def _empty_manifest():
+        return {"last_seq": 0, "next_segment": 1, "segments": [], "deleted": {}}
+
+    # Reading
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return self._empty_manifest()
+
+    def _manifest_version(self):
+        try:
+            stat = os.stat(self._manifest_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def refresh(self):
+        """Pick up segments written by the ingest worker"""
+        version = self._manifest_version()
+        if version == self._version:
+            return
+        with self._lock:
+            manifest = self._read_manifest()
+            segments = {}
+            for name in manifest["segments"]:
+                segment = self._segments.get(name)
+                if segment is None:
+                    try:
+                        segment = Segment(os.path.join(self.directory, name))
+                    except (OSError, ValueError):
+                        # Merged away in the meantime; the next manifest
+                        # no longer lists it
+                        continue
+                segments[name] = segment
+            for name, segment in self._segments.items():
+                if name not in segments:
+                    segment.close()
+
+            deleted = {
+                name: set(ids) for name, ids in manifest.get("deleted", {}).items()
+            }
+            docs = length = 0
+            documents = {}
+            for name, segment in segments.items():
+                dead = deleted.get(name, set())
+                for doc_id, (file_key, doc_length, _) in enumerate(segment.docs):
+                    if doc_id not in dead:
+                        docs += 1
+                        length += doc_length
+                        documents[file_key] = (name, doc_id)
+
+            self._segments = segments
+            self._manifest = dict(manifest, deleted=deleted)
+            self._stats = (docs, length / docs if docs else 0.0)
+            self._documents = documents
+            self._version = version
+
+    def __len__(self):
+        self.refresh()
+        return self._stats[0]
+
+    def backlog(self):
+        """Changes recorded in the feed that are not indexed yet"""
+        self.refresh()
+        return max(self.feed.head() - self._manifest["last_seq"], 0)
+
+    def search(self, query, limit=10, offset=0):
+        """Return ``(total, [(file key, score), ...])`` ranked by BM25"""
+        self.refresh()
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return 0, []
+
+        with self._lock:
+            segments = self._segments
+            deleted = self._manifest["deleted"]
+            doc_count, average_length = self._stats
+        if not doc_count:
+            return 0, []
+
+        # Document frequencies over all segments
+        lookups = {}
+        for term in terms:
+            encoded = term.encode()
+            for name, segment in segments.items():
+                found = segment.lookup(encoded)
+                if found is not None:
+                    lookups.setdefault(term, []).append((name, found))
+
+        scores = {}
+        for term, found in lookups.items():
+            df = sum(df for _, (df, _) in found)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for name, (term_df, postings_offset) in found:
+                segment = segments[name]
+                dead = deleted.get(name, ())
+                for doc_id, tf in segment.postings(term_df, postings_offset):
+                    if doc_id in dead:
+                        continue
+                    file_key, length, _ = segment.docs[doc_id]
+                    norm = K1 * (1 - B + B * length / (average_length or 1))
+                    scores[file_key] = scores.get(file_key, 0.0) + idf * tf * (
+                        K1 + 1
+                    ) / (tf + norm)
+
+        ranked = heapq.nlargest(
+            offset + limit, scores.items(), key=lambda item: (item[1], item[0])
+        )
+        return len(scores), ranked[offset:]
+
+    def snippet(self, file_key, query, width=160):
+        """HTML snippet of an indexed file around the first query term
+
+        Built from the text stored at ingest; the file itself is not read.
+        """
+        self.refresh()
+        with self._lock:
+            location = self._documents.get(file_key)
+            segments = self._segments
+        if location is None or location[0] not in segments:
+            return ""
+        return highlight(segments[location[0]].text(location[1]), query, width)
+
+    # Writing (ingest worker only)
+
+    def _segment_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load_writer(self):
+        if self._locations is not None:
+            return
+        manifest = self._read_manifest()
+        manifest["deleted"] = {
+            name: set(ids) for name, ids in manifest.get("deleted", {}).items()
+        }
+        self._doc_counts = {}
+        self._locations = {}
+        for name in manifest["segments"]:
+            with open(f"{self._segment_path(name)}.docs.json") as f:
+                docs = json.load(f)
+            self._doc_counts[name] = len(docs)
+            dead = manifest["deleted"].get(name, set())
+            for doc_id, (file_key, _, md5) in enumerate(docs):
+                if doc_id not in dead:
+                    self._locations[file_key] = (name, doc_id, md5)
+        self._writer_manifest = manifest
+
+    def _save_manifest(self, manifest):
+        data = dict(
+            manifest,
+            deleted={
+                name: sorted(ids) for name, ids in manifest["deleted"].items() if ids
+            },
+        )
+        tmp_path = f"{self._manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def sync(self):
+        """Index the changes recorded in the feed since the last sync
+
+        Returns the number of files added, updated or removed.
+        """
+        with self._write_lock:
+            self._load_writer()
+            manifest = self._writer_manifest
+            applied = 0
+            while True:
+                result = self.feed.read(manifest["last_seq"], limit=self.batch_size)
+                if result.get("resync_required"):
+                    applied += self._rebuild(result["last_seq"])
+                    continue
+
+                batch = {}
+                for entry in result["changes"]:
+                    if entry["type"] == "file":
+                        batch[entry["path"]] = entry["data"]
+                applied += self._apply(batch, result["last_seq"])
+                if not result["has_more"]:
+                    return applied
+
+    def _rebuild(self, last_seq):
+        """Reindex every file, e.g. after the feed was trimmed past us"""
+        manifest = self._writer_manifest
+        for name in manifest["segments"]:
+            manifest["deleted"][name] = set(range(self._doc_counts[name]))
+        self._locations = {}
+
+        applied = 0
+        files = list(self.list_files().items())
+        for start in range(0, len(files), self.batch_size):
+            applied += self._apply(
+                dict(files[start : start + self.batch_size]), last_seq
+            )
+        if not files:
+            self._apply({}, last_seq)
+        return applied
+
+    def _apply(self, batch, last_seq):
+        """Index a batch of ``{file key: file data or None}`` as a new segment"""
+        manifest = self._writer_manifest
+        docs = []
+        texts = []
+        postings = {}
+        applied = 0
+        for file_key, data in batch.items():
+            md5 = (data or {}).get("md5")
+            location = self._locations.get(file_key)
+            if data is not None and location is not None and md5 and location[2] == md5:
+                continue  # Content unchanged (e.g. only downloaded)
+
+            if location is not None:
+                manifest["deleted"].setdefault(location[0], set()).add(location[1])
+                del self._locations[file_key]
+                applied += 1
+            if data is None or not indexable(file_key):
+                continue
+
+            text = extract_text(self.resolve_path(file_key), self.open_file)
+            tokens = tokenize(text)
+            if tokens:
+                doc_id = len(docs)
+                docs.append([file_key, len(tokens), md5])
+                texts.append(snippet_text(text))
+                for term, tf in Counter(tokens).items():
+                    postings.setdefault(term, []).append((doc_id, tf))
+                applied += 1
+            time.sleep(0)  # Let request handlers run between documents
+
+        if docs:
+            name = f"seg_{manifest['next_segment']:06d}"
+            manifest["next_segment"] += 1
+            write_segment(
+                self._segment_path(name),
+                docs,
+                sorted(
+                    (term.encode(), len(entries), encode_postings(entries))
+                    for term, entries in postings.items()
+                ),
+                texts,
+            )
+            manifest["segments"].append(name)
+            self._doc_counts[name] = len(docs)
+            for doc_id, (file_key, _, md5) in enumerate(docs):
+                self._locations[file_key] = (name, doc_id, md5)
+
+        manifest["last_seq"] = last_seq
+        obsolete = self._merge_if_needed()
+        self._save_manifest(manifest)
+        for name in obsolete:
+            for path in (
+                self._segment_path(name),
+                f"{self._segment_path(name)}.docs.json",
+                f"{self._segment_path(name)}.text",
+            ):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return applied
+
+    def _live_count(self, name):
+        deleted = self._writer_manifest["deleted"].get(name, ())
+        return self._doc_counts[name] - len(deleted)
+
+    def _merge_if_needed(self):
+        """Merge small and mostly deleted segments; return obsolete segments"""
+        manifest = self._writer_manifest
+        obsolete = []
+        for name in list(manifest["segments"]):
+            if self._live_count(name) <= 0:
+                manifest["segments"].remove(name)
+                manifest["deleted"].pop(name, None)
+                obsolete.append(name)
+
+        candidates = [
+            name
+            for name in manifest["segments"]
+            if self._live_count(name) * 2 < self._doc_counts[name]
+        ]
+        if len(manifest["segments"]) > self.max_segments:
+            smallest = sorted(manifest["segments"], key=self._live_count)
+            for name in smallest[: self.merge_factor]:
+                if name not in candidates:
+                    candidates.append(name)
+
+        if candidates:
+            # Keep document order stable: merge in segment order
+            candidates.sort(key=manifest["segments"].index)
+            self._merge(candidates)
+            obsolete.extend(candidates)
+        return obsolete
+
+    def _merge(self, names):
+        manifest = self._writer_manifest
+        segments = [Segment(self._segment_path(name)) for name in names]
+        try:
+            docs = []
+            texts = []
+            remaps = []
+            for name, segment in zip(names, segments):
+                dead = manifest["deleted"].get(name, set())
+                remap = {}
+                for doc_id, doc in enumerate(segment.docs):
+                    if doc_id not in dead:
+                        remap[doc_id] = len(docs)
+                        docs.append(doc)
+                        texts.append(segment.text(doc_id))
+                remaps.append(remap)
+
+            def tagged_terms(index, segment):
+                for term, df, offset in segment.terms():
+                    yield term, index, df, offset
+
+            def merged_terms():
+                current, entries = None, []
+                streams = [tagged_terms(i, seg) for i, seg in enumerate(segments)]
+                for term, index, df, offset in heapq.merge(*streams):
+                    if term != current:
+                        if entries:
+                            yield current, len(entries), encode_postings(entries)
+                        current, entries = term, []
+                    remap = remaps[index]
+                    for doc_id, tf in segments[index].postings(df, offset):
+                        if doc_id in remap:
+                            entries.append((remap[doc_id], tf))
+                if entries:
+                    yield current, len(entries), encode_postings(entries)
+
+            name = f"seg_{manifest['next_segment']:06d}"
+            manifest["next_segment"] += 1
+            if docs:
+                write_segment(self._segment_path(name), docs, merged_terms(), texts)
+        finally:
+            for segment in segments:
+                segment.close()
+
+        position = manifest["segments"].index(names[0])
+        for old in names:
+            manifest["segments"].remove(old)
+            manifest["deleted"].pop(old, None)
+            self._doc_counts.pop(old, None)
+        if docs:
+            manifest["segments"].insert(position, name)
+            self._doc_counts[name] = len(docs)
+            for doc_id, (file_key, _, md5) in enumerate(docs):
+                self._locations[file_key] = (name, doc_id, md5)
+
+    def run(self, interval=1.0):
+        """Ingest loop for a background thread"""
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Content index ingest failed: {e}")
+            time.sleep(interval)
@@ -0,0 +1,83 @@
+"""
+File versions for FileShare Pro.
+
+In versioning mode an upload to an existing path replaces the file and the
+previous content is kept as an earlier version instead of being stored
+under a new ``name_N.ext`` name. Versions live in the ``versions`` state
+namespace, one record per file key:
+
+    {"version": <current version number>, "archived": [<earlier versions>]}
+
+Each earlier version keeps the fields needed to serve it (size, hashes,
+storage kind) while its content stays in the blob or chunk store, where
+identical and (in chunked mode) similar versions share storage. Files that
+were never replaced have no record and are at version 1.
+"""
+
+VERSION_FIELDS = ("size", "md5", "sha256", "storage", "upload_date", "uploaded_by")
+
+
+class FileVersions:
+    """Earlier versions of files, by file key."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def current_version(self, file_key):
+        record = self.index.get(file_key)
+        return record["version"] if record else 1
+
+    def archived(self, file_key):
+        """Earlier versions of a file, oldest first"""
+        record = self.index.get(file_key)
+        return list(record["archived"]) if record else []
+
+    def get(self, file_key, version):
+        for entry in self.archived(file_key):
+            if entry["version"] == version:
+                return entry
+        return None
+
+    def archive(self, file_key, metadata, keep):
+        """Record the current content of a file as an earlier version
+
+        The file moves on to the next version number. At most ``keep``
+        earlier versions are kept; the ones dropped are returned so their
+        content can be released.
+        """
+        dropped = []
+
+        def append(record):
+            # Called again when a shared store retries the update
+            record = record or {"version": 1, "archived": []}
+            entry = {field: metadata.get(field) for field in VERSION_FIELDS}
+            entry["version"] = record["version"]
+            archived = record["archived"] + [entry]
+            cut = max(len(archived) - keep, 0)
+            dropped[:] = archived[:cut]
+            return {"version": record["version"] + 1, "archived": archived[cut:]}
+
+        self.index.update_item(file_key, append)
+        return dropped
+
+    def remove(self, file_key):
+        """Forget all versions of a deleted file and return the earlier ones"""
+        archived = self.archived(file_key)
+        if file_key in self.index:
+            del self.index[file_key]
+        return archived
+
+    def listing(self, file_key, metadata):
+        """All versions of a file, newest (the current file) first"""
+        current = {field: metadata.get(field) for field in VERSION_FIELDS}
+        current.update(version=self.current_version(file_key), current=True)
+        earlier = [
+            dict(entry, current=False) for entry in reversed(self.archived(file_key))
+        ]
+        return [current] + earlier
+
+    def references(self):
+        """Content digests held by earlier versions, with their storage kind"""
+        for record in self.index.values():
+            for entry in record["archived"]:
+                yield entry.get("sha256"), entry.get("storage")
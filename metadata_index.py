@@ -0,0 +1,403 @@
+"""
+Structured queries over file metadata for FileShare Pro.
+
+``MetadataIndex`` keeps secondary indexes over the file metadata so that
+filtered listings do not scan every file:
+
+- sorted indexes (``bisect`` over ``(value, file key)`` lists) for upload
+  date, size and download count, answering range filters and ordered
+  listings directly
+- hash indexes (value -> set of file keys) for mime type, uploader, upload
+  source (web, api or chat) and folder
+
+A query starts from the most selective filter (estimated from the index
+sizes) and checks the remaining filters per candidate. Facet counts are
+computed over the matching files.
+
+``FileTotals`` keeps the totals shown by the stats endpoints and
+``ShareTokenIndex`` maps each file to its share links, so neither has to
+scan all files or links on every change.
+"""
+import mimetypes
+import os
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from datetime import datetime
+
+SORTED_FIELDS = ("upload_date", "size", "downloads")
+HASHED_FIELDS = ("mime_type", "uploader", "source", "folder")
+SORT_FIELDS = SORTED_FIELDS + ("name",)
+MAX_PER_PAGE = 500
+
+
+class _Last:
+    """Sorts after every file key, to bisect past all entries of a value"""
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+_LAST = _Last()
+
+
+def upload_source(metadata):
+    if metadata.get("chat_upload"):
+        return "chat"
+    if metadata.get("api_upload"):
+        return "api"
+    return "web"
+
+
+def document(file_key, metadata):
+    """Indexed values of one file"""
+    return {
+        "upload_date": metadata.get("upload_date", ""),
+        "size": metadata.get("size", 0),
+        "downloads": metadata.get("downloads", 0),
+        "mime_type": mimetypes.guess_type(file_key)[0] or "application/octet-stream",
+        "uploader": metadata.get("uploaded_by"),
+        "source": upload_source(metadata),
+        "folder": os.path.dirname(file_key),
+        "name": os.path.basename(file_key).lower(),
+    }
+
+
+def _split(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _int_arg(args, name):
+    value = args.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+
+def _date_arg(args, name):
+    value = args.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 date")
+
+
+def parse_query(args):
+    """Build query keyword arguments from request parameters
+
+    Raises ``ValueError`` with a message for the client on invalid input.
+    """
+    query = {
+        "folder_path": (args.get("folder_path") or "").strip("/"),
+        "recursive": args.get("recursive", "true").lower() != "false",
+        "mime_types": _split(args.get("mime", "")),
+        "uploaders": _split(args.get("uploader", "")),
+        "sources": _split(args.get("source", "")),
+        "size": (_int_arg(args, "min_size"), _int_arg(args, "max_size")),
+        "upload_date": (
+            _date_arg(args, "uploaded_after"),
+            _date_arg(args, "uploaded_before"),
+        ),
+        "downloads": (_int_arg(args, "min_downloads"), _int_arg(args, "max_downloads")),
+        "sort": args.get("sort", "upload_date"),
+        "descending": args.get("order", "desc").lower() != "asc",
+        "facets": _split(args.get("facets", "")),
+    }
+    if query["sort"] not in SORT_FIELDS:
+        raise ValueError(f"sort must be one of: {', '.join(SORT_FIELDS)}")
+    unknown = set(query["facets"]) - set(HASHED_FIELDS)
+    if unknown:
+        raise ValueError(f"facets must be among: {', '.join(HASHED_FIELDS)}")
+
+    page = _int_arg(args, "page") or 1
+    per_page = _int_arg(args, "per_page") or 50
+    query["offset"] = (max(page, 1) - 1) * min(max(per_page, 1), MAX_PER_PAGE)
+    query["limit"] = min(max(per_page, 1), MAX_PER_PAGE)
+    return query
+
+
+class MetadataIndex:
+    """Secondary indexes over file metadata, maintained incrementally."""
+
+    def __init__(self):
+        self._docs = {}
+        self._sorted = {field: [] for field in SORTED_FIELDS}
+        self._hashed = {field: {} for field in HASHED_FIELDS}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, file_key, metadata):
+        doc = document(file_key, metadata)
+        with self._lock:
+            if self._docs.get(file_key) == doc:
+                return
+            self.remove(file_key)
+            self._docs[file_key] = doc
+            for field in SORTED_FIELDS:
+                insort(self._sorted[field], (doc[field], file_key))
+            for field in HASHED_FIELDS:
+                self._hashed[field].setdefault(doc[field], set()).add(file_key)
+
+    def remove(self, file_key):
+        with self._lock:
+            doc = self._docs.pop(file_key, None)
+            if doc is None:
+                return
+            for field in SORTED_FIELDS:
+                entries = self._sorted[field]
+                del entries[bisect_left(entries, (doc[field], file_key))]
+            for field in HASHED_FIELDS:
+                keys = self._hashed[field][doc[field]]
+                keys.discard(file_key)
+                if not keys:
+                    del self._hashed[field][doc[field]]
+
+    def rebuild(self, files):
+        with self._lock:
+            self._docs = {}
+            self._sorted = {field: [] for field in SORTED_FIELDS}
+            self._hashed = {field: {} for field in HASHED_FIELDS}
+            for file_key, metadata in files.items():
+                self.add(file_key, metadata)
+
+    def apply(self, changes, reset=False):
+        """``SharedDict`` listener keeping the index in sync with metadata"""
+        with self._lock:
+            if reset:
+                self.rebuild(changes)
+                return
+            for file_key, metadata in changes.items():
+                if metadata is None:
+                    self.remove(file_key)
+                else:
+                    self.add(file_key, metadata)
+
+    def _range(self, field, low, high):
+        """Slice bounds of ``low <= value <= high`` in a sorted index"""
+        entries = self._sorted[field]
+        start = 0 if low is None else bisect_left(entries, (low,))
+        end = len(entries) if high is None else bisect_right(entries, (high, _LAST))
+        return start, end
+
+    def _folder_keys(self, folder_path, recursive):
+        folders = self._hashed["folder"]
+        if not folder_path:
+            return None if recursive else set(folders.get("", ()))
+        keys = set(folders.get(folder_path, ()))
+        if recursive:
+            prefix = folder_path + "/"
+            for folder, folder_keys in folders.items():
+                if folder.startswith(prefix):
+                    keys |= folder_keys
+        return keys
+
+    def _hash_keys(self, field, values):
+        index = self._hashed[field]
+        keys = set()
+        for value in values:
+            if field == "mime_type" and value.endswith("/*"):
+                prefix = value[:-1]
+                for mime_type, mime_keys in index.items():
+                    if mime_type.startswith(prefix):
+                        keys |= mime_keys
+            else:
+                keys |= index.get(value, set())
+        return keys
+
+    def query(
+        self,
+        folder_path="",
+        recursive=True,
+        mime_types=(),
+        uploaders=(),
+        sources=(),
+        size=(None, None),
+        upload_date=(None, None),
+        downloads=(None, None),
+        sort="upload_date",
+        descending=True,
+        offset=0,
+        limit=50,
+        facets=(),
+    ):
+        """Return ``{"total", "file_keys", "facets"}`` for one page"""
+        ranges = {"size": size, "upload_date": upload_date, "downloads": downloads}
+        with self._lock:
+            # Candidate sets of the filters, and how selective they are
+            sets = []
+            folder_keys = self._folder_keys(folder_path, recursive)
+            if folder_keys is not None:
+                sets.append(folder_keys)
+            for field, values in (
+                ("mime_type", mime_types),
+                ("uploader", uploaders),
+                ("source", sources),
+            ):
+                if values:
+                    sets.append(self._hash_keys(field, values))
+            bounds = {
+                field: self._range(field, low, high)
+                for field, (low, high) in ranges.items()
+                if low is not None or high is not None
+            }
+
+            # Drive the query from the smallest candidate set or range
+            driver = None
+            if sets:
+                driver = min(sets, key=len)
+            for field, (start, end) in bounds.items():
+                if driver is None or end - start < len(driver):
+                    driver = [key for _, key in self._sorted[field][start:end]]
+
+            def matches(file_key):
+                doc = self._docs[file_key]
+                for field, (low, high) in ranges.items():
+                    if low is not None and doc[field] < low:
+                        return False
+                    if high is not None and doc[field] > high:
+                        return False
+                return all(file_key in keys for keys in sets)
+
+            if driver is None:
+                # No filters: page straight through the sort index
+                if sort in SORTED_FIELDS:
+                    entries = self._sorted[sort]
+                    ordered = reversed(entries) if descending else iter(entries)
+                    page = []
+                    for position, (_, file_key) in enumerate(ordered):
+                        if position >= offset + limit:
+                            break
+                        if position >= offset:
+                            page.append(file_key)
+                    result_keys = self._docs.keys()
+                    return {
+                        "total": len(self._docs),
+                        "file_keys": page,
+                        "facets": self._facets(result_keys, facets),
+                    }
+                selected = list(self._docs)
+            else:
+                selected = [key for key in driver if matches(key)]
+
+            selected.sort(
+                key=lambda key: (self._docs[key][sort], key), reverse=descending
+            )
+            return {
+                "total": len(selected),
+                "file_keys": selected[offset : offset + limit],
+                "facets": self._facets(selected, facets),
+            }
+
+    def _facets(self, file_keys, fields):
+        counts = {field: Counter() for field in fields}
+        if counts:
+            for file_key in file_keys:
+                doc = self._docs[file_key]
+                for field, counter in counts.items():
+                    if doc[field] is not None:
+                        counter[doc[field]] += 1
+        return {field: dict(counter.most_common()) for field, counter in counts.items()}
+
+
+class FileTotals:
+    """File count, total size and total downloads, maintained incrementally."""
+
+    def __init__(self):
+        self._docs = {}
+        self.files = 0
+        self.bytes = 0
+        self.downloads = 0
+        self._lock = threading.RLock()
+
+    def _add(self, doc, sign):
+        self.files += sign
+        self.bytes += sign * doc[0]
+        self.downloads += sign * doc[1]
+
+    def apply(self, changes, reset=False):
+        """``SharedDict`` listener keeping the totals in sync with metadata"""
+        with self._lock:
+            if reset:
+                self._docs = {}
+                self.files = self.bytes = self.downloads = 0
+            for file_key, metadata in changes.items():
+                previous = self._docs.pop(file_key, None)
+                if previous is not None:
+                    self._add(previous, -1)
+                if metadata is not None:
+                    doc = (metadata.get("size", 0), metadata.get("downloads", 0))
+                    self._docs[file_key] = doc
+                    self._add(doc, 1)
+
+    def totals(self):
+        with self._lock:
+            return {
+                "files": self.files,
+                "bytes": self.bytes,
+                "downloads": self.downloads,
+            }
+
+
+class ShareTokenIndex:
+    """Share tokens by folder and name: those of the latest version of each
+    file, and all tokens of each file (for removing them with the file)."""
+
+    def __init__(self):
+        self._links = {}
+        self._tokens = {}
+        self._file_of = {}
+        self._files = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _discard(links, tokens, token):
+        key = links.pop(token, None)
+        if key is None:
+            return
+        entries = tokens[key]
+        del entries[token]
+        if not entries:
+            del tokens[key]
+
+    def apply(self, changes, reset=False):
+        """``SharedDict`` listener keeping the index in sync with share links"""
+        with self._lock:
+            if reset:
+                self._links = {}
+                self._tokens = {}
+                self._file_of = {}
+                self._files = {}
+            for token, link_data in changes.items():
+                self._discard(self._links, self._tokens, token)
+                self._discard(self._file_of, self._files, token)
+                if link_data is None:
+                    continue
+                key = (link_data["folder_path"], link_data["filename"])
+                self._file_of[token] = key
+                self._files.setdefault(key, {})[token] = None
+                if link_data.get("version") is not None:
+                    continue
+                self._links[token] = key
+                # A dict keeps the tokens of a file in creation order
+                self._tokens.setdefault(key, {})[token] = None
+
+    def lookup(self, filename, folder_path):
+        """The oldest share token of the file, or None"""
+        with self._lock:
+            tokens = self._tokens.get((folder_path, filename))
+            return next(iter(tokens)) if tokens else None
+
+    def file_tokens(self, filename, folder_path):
+        """All share tokens of the file, including those pinned to a version"""
+        with self._lock:
+            return list(self._files.get((folder_path, filename), ()))
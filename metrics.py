@@ -0,0 +1,174 @@
+"""
+Metrics for FileShare Pro, in the Prometheus text exposition format.
+
+Instrumented code calls ``inc()`` (counters and up/down gauges) and
+``observe()`` (histograms). Both only append an event to a deque, which is
+atomic and takes no lock; events are folded into the totals when metrics
+are collected, or by the recording thread once ``fold_at`` events have
+piled up. Recording therefore stays off the critical path. ``timed()``
+measures a block or function into a histogram.
+
+Gauges that reflect current state (metadata entries, pending jobs) are
+registered with a callback and read when metrics are collected.
+
+Every worker process has its own registry. ``snapshot()`` returns its
+counters and histograms as JSON-serializable data, and ``render()`` adds
+up the snapshots of the other workers, so ``/metrics`` reports the totals
+of the whole deployment whichever worker serves it.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Counters, gauges and histograms of one process."""
+
+    def __init__(self, fold_at=10000):
+        self.fold_at = fold_at
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._metrics = {}  # name -> (type, help, buckets or callback)
+        self._values = {}  # (name, labels) -> number, or histogram counts
+
+    def counter(self, name, help):
+        self._metrics[name] = ("counter", help, None)
+
+    def gauge(self, name, help, callback=None, label=None):
+        """Register a gauge, changed with ``inc()`` or read from ``callback``
+
+        ``callback()`` returns a number, or {value of ``label``: number}
+        when a ``label`` is given.
+        """
+        self._metrics[name] = ("gauge", help, (callback, label) if callback else None)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        self._metrics[name] = ("histogram", help, tuple(buckets))
+
+    def inc(self, name, value=1, **labels):
+        self._events.append((name, _labels(labels), value))
+        if len(self._events) > self.fold_at:
+            self._fold()
+
+    def observe(self, name, value, **labels):
+        self.inc(name, value, **labels)
+
+    @contextmanager
+    def timed(self, name, **labels):
+        """Time a block into a histogram (also usable as a decorator)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _fold(self):
+        with self._lock:
+            while True:
+                try:
+                    name, labels, value = self._events.popleft()
+                except IndexError:
+                    return
+                kind, _, buckets = self._metrics[name]
+                key = (name, labels)
+                if kind != "histogram":
+                    self._values[key] = self._values.get(key, 0) + value
+                    continue
+                counts = self._values.get(key)
+                if counts is None:
+                    counts = self._values[key] = [0] * (len(buckets) + 3)
+                # Buckets, then +Inf, sum and count
+                counts[bisect_left(buckets, value)] += 1
+                counts[-2] += value
+                counts[-1] += 1
+
+    def snapshot(self):
+        """Counters, up/down gauges and histograms, as JSON-serializable data"""
+        self._fold()
+        with self._lock:
+            return [
+                [
+                    name,
+                    [list(pair) for pair in labels],
+                    list(value) if isinstance(value, list) else value,
+                ]
+                for (name, labels), value in self._values.items()
+            ]
+
+    def render(self, snapshots=()):
+        """Metrics in the Prometheus text format
+
+        ``snapshots`` of other worker processes are added to this one's.
+        """
+        values = {}
+        for snapshot in [self.snapshot(), *snapshots]:
+            for name, labels, value in snapshot:
+                if name not in self._metrics:
+                    continue
+                key = (name, tuple(tuple(pair) for pair in labels))
+                if isinstance(value, list):
+                    total = values.setdefault(key, [0] * len(value))
+                    for i, count in enumerate(value):
+                        total[i] += count
+                else:
+                    values[key] = values.get(key, 0) + value
+
+        lines = []
+        for name, (kind, help, extra) in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "gauge" and extra is not None:
+                callback, label = extra
+                result = callback()
+                series = result.items() if label else [(None, result)]
+                for label_value, value in series:
+                    labels = _labels({label: label_value} if label else {})
+                    lines.append(
+                        f"{name}{_format_labels(labels)} {_format_value(value)}"
+                    )
+                continue
+            for (metric, labels), value in sorted(values.items()):
+                if metric != name:
+                    continue
+                if kind != "histogram":
+                    lines.append(
+                        f"{name}{_format_labels(labels)} {_format_value(value)}"
+                    )
+                    continue
+                cumulative = 0
+                for bound, count in zip(extra + (float("inf"),), value):
+                    cumulative += count
+                    le = (("le", _format_value(bound)),)
+                    lines.append(
+                        f"{name}_bucket{_format_labels(labels, le)} {cumulative}"
+                    )
+                lines.append(
+                    f"{name}_sum{_format_labels(labels)} {_format_value(value[-2])}"
+                )
+                lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,562 @@
+"""
+Object storage backends for FileShare Pro.
+
+In the ``object`` storage mode file contents are kept in a storage backend
+instead of the upload folder. A backend stores immutable objects by key and
+supports ``put``/``put_stream``, ``open`` (a seekable binary stream, so
+range requests only read what they need), ``read_range``, ``stat``,
+``delete`` and ``keys``. Backends are named by URL:
+
+- ``sharded:///path/to/objects`` (or a plain path): local files under
+  hash-prefix directories, ``<root>/<aa>/<bb>/<key>``, so no directory
+  holds more than a few hundred entries however many files are stored
+- ``legacy:///path/to/uploads``: local files at ``<root>/<key>``, the
+  layout of the upload folder, where keys are relative paths
+- ``compressed:///path/to/archive``: sharded local files in the framed
+  compressed format of compression.py, a cheap tier for contents that are
+  rarely read (see tiering.py)
+- ``s3://bucket/prefix?endpoint_url=http://localhost:9000``: an
+  S3-compatible service such as AWS S3 or MinIO (requires ``boto3``;
+  query parameters are passed to ``boto3.client``)
+
+``ObjectStore`` keeps one object per distinct content, keyed by SHA-256 and
+reference counted in the ``objects`` state namespace. Logical files are
+only entries in the file metadata, which records the digest of their
+content: nothing is left in the upload folder, so a folder with tens of
+thousands of files (e.g. ``chat/``) costs no directory entries. An object
+is in the primary backend or, when tiering is enabled, in the cold backend
+(its ``tier`` in the index); ``move()`` moves it between the two. Objects
+put with a ``codec`` are stored compressed (see compression.py) and
+decompressed as they are read; the index keeps their logical ``size`` and
+the ``stored_size`` in the backend.
+
+``migrate()`` moves objects from one backend to another while the server
+keeps running: objects are immutable, so each one is copied, verified and
+only then deleted from the source, and an ``ObjectStore`` with the source
+as its ``fallback`` serves objects from whichever backend has them.
+Objects of a ``legacy`` backend are keyed by their path; they are re-keyed
+by the SHA-256 of their content on the way, so the target holds them as
+the object store expects, and are never deleted from the source: the
+server keeps serving them from the upload folder until ``flask --app app
+adopt-objects`` has pointed the file metadata at the copies, and adopt
+removes each local copy once its metadata has moved.
+
+    python -m object_store sharded:///srv/objects s3://fileshare/objects
+"""
+import argparse
+import hashlib
+import io
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import parse_qsl, urlparse
+
+from blob_store import hash_file, reclaim, recount, with_refs
+from compression import compress_stream, open_framed, read_index
+
+READ_SIZE = 1024 * 1024
+
+
+def _call(func, *args):
+    return func(*args)
+
+
+class LocalBackend:
+    """Objects stored as files under a local directory."""
+
+    def __init__(self, root, sharded=True):
+        self.root = root
+        self.sharded = sharded
+
+    def path(self, key):
+        if self.sharded:
+            return os.path.join(self.root, key[:2], key[2:4], key)
+        return os.path.join(self.root, *key.split("/"))
+
+    def _tmp_path(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{uuid.uuid4().hex}.tmp"
+
+    def put(self, key, file_path):
+        path = self.path(key)
+        tmp_path = self._tmp_path(path)
+        try:
+            os.link(file_path, tmp_path)
+        except OSError:
+            shutil.copyfile(file_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def put_stream(self, key, stream):
+        path = self.path(key)
+        tmp_path = self._tmp_path(path)
+        with open(tmp_path, "wb") as f:
+            shutil.copyfileobj(stream, f, READ_SIZE)
+        os.replace(tmp_path, path)
+
+    def open(self, key):
+        return open(self.path(key), "rb")
+
+    def read_range(self, key, start, end):
+        with open(self.path(key), "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def stat(self, key):
+        try:
+            return {"size": os.path.getsize(self.path(key))}
+        except OSError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self):
+        for directory, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                if self.sharded:
+                    yield name
+                else:
+                    relative = os.path.relpath(os.path.join(directory, name), self.root)
+                    yield relative.replace(os.sep, "/")
+
+
+class CompressedBackend(LocalBackend):
+    """Objects stored compressed under a local directory.
+
+    Objects are written in the framed format of compression.py, so reads
+    decompress on the fly and a seek only decompresses the frame it lands
+    in.
+    """
+
+    def path(self, key):
+        return super().path(key) + ".fz"
+
+    def put(self, key, file_path):
+        with open(file_path, "rb") as f:
+            self.put_stream(key, f)
+
+    def put_stream(self, key, stream):
+        path = self.path(key)
+        tmp_path = self._tmp_path(path)
+        with open(tmp_path, "wb") as f:
+            compress_stream(stream, f)
+        os.replace(tmp_path, path)
+
+    def open(self, key):
+        return open_framed(open(self.path(key), "rb"))
+
+    def read_range(self, key, start, end):
+        with self.open(key) as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def stat(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                return {"size": read_index(f)["size"]}
+        except (OSError, ValueError):
+            return None
+
+    def keys(self):
+        for name in super().keys():
+            if name.endswith(".fz"):
+                yield name[:-3]
+
+
+class S3Object(io.RawIOBase):
+    """Seekable stream over an S3 object, read with ranged GETs."""
+
+    def __init__(self, backend, key, size):
+        self._backend = backend
+        self._key = key
+        self.size = size
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer):
+        if self._position >= self.size:
+            return 0
+        end = min(self._position + len(buffer), self.size)
+        data = self._backend.read_range(self._key, self._position, end)
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class S3Backend:
+    """Objects stored in an S3-compatible bucket."""
+
+    def __init__(self, bucket, prefix="", client=None, **client_args):
+        import boto3
+        from botocore.exceptions import ClientError
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or boto3.client("s3", **client_args)
+        self._client_error = ClientError
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def put(self, key, file_path):
+        self.client.upload_file(file_path, self.bucket, self._key(key))
+
+    def put_stream(self, key, stream):
+        self.client.upload_fileobj(stream, self.bucket, self._key(key))
+
+    def open(self, key):
+        info = self.stat(key)
+        if info is None:
+            raise FileNotFoundError(key)
+        return io.BufferedReader(S3Object(self, key, info["size"]), READ_SIZE)
+
+    def read_range(self, key, start, end):
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self._key(key), Range=f"bytes={start}-{end - 1}"
+        )
+        return response["Body"].read()
+
+    def stat(self, key):
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return None
+            raise
+        return {"size": response["ContentLength"]}
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def keys(self):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                yield item["Key"][len(self.prefix) :]
+
+
+def create_backend(url):
+    """Create a storage backend from its URL (or a local path)"""
+    parsed = urlparse(url)
+    if parsed.scheme in ("", "sharded"):
+        return LocalBackend(parsed.path if parsed.scheme else url)
+    if parsed.scheme == "legacy":
+        return LocalBackend(parsed.path, sharded=False)
+    if parsed.scheme == "compressed":
+        return CompressedBackend(parsed.path)
+    if parsed.scheme == "s3":
+        prefix = parsed.path.lstrip("/")
+        if prefix and not prefix.endswith("/"):
+            prefix += "/"
+        return S3Backend(parsed.netloc, prefix, **dict(parse_qsl(parsed.query)))
+    raise ValueError(f"Unsupported storage backend: {url}")
+
+
+class ObjectStore:
+    """Reference-counted contents keyed by SHA-256 in a storage backend."""
+
+    def __init__(self, backend, index, fallback=None, cold=None):
+        self.backend = backend
+        self.index = index
+        self.fallback = fallback
+        self.cold = cold
+
+    def tier(self, digest):
+        """ "hot" (primary backend) or "cold" (cold backend)"""
+        return (self.index.get(digest) or {}).get("tier", "hot")
+
+    def _tier_backend(self, tier):
+        return self.cold if tier == "cold" else self.backend
+
+    def _reference(self, digest, size, tier="hot", stored=None):
+        def increment(entry):
+            entry = dict(entry or {"created_at": datetime.now().isoformat()})
+            if tier == "cold" and "refs" not in entry:
+                entry["tier"] = "cold"
+            if stored is not None:
+                entry.update(stored)
+            entry["size"] = size
+            return with_refs(entry, entry.get("refs", 0) + 1)
+
+        self.index.update_item(digest, increment)
+
+    def _upload(self, backend, digest, file_path, codec, reader=None):
+        """Put a file into a backend, compressed with ``codec`` if given
+
+        ``reader`` wraps the file as it is read. Returns the index fields
+        describing the stored object.
+        """
+        if codec is None and reader is None:
+            backend.put(digest, file_path)
+            return {}
+        with open(file_path, "rb") as source:
+            stream = reader(source) if reader else source
+            if codec is None:
+                backend.put_stream(digest, stream)
+                return {}
+            tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(tmp_path, "wb") as target:
+                    _, stored_size = compress_stream(stream, target, codec)
+                backend.put(digest, tmp_path)
+            finally:
+                os.remove(tmp_path)
+        return {"codec": codec, "stored_size": stored_size}
+
+    def put(
+        self, file_path, tier="hot", codec=None, hashes=None, reader=None, run=_call
+    ):
+        """Store a saved upload and reference its content
+
+        Returns ``(md5, sha256)`` of the content, hashing the file unless
+        the caller passes them as ``hashes``. Content already in the store
+        is not uploaded again. New content goes to the ``tier`` backend,
+        compressed with ``codec`` if given. The file is left in place; the
+        caller removes it once the file metadata records the digest.
+
+        ``run(func, *args)`` runs the reads and writes (e.g. on a worker
+        thread) and ``reader`` wraps the file as it is read (e.g. in a
+        ``scrubber.ThrottledReader``); the index is updated by the caller's
+        thread.
+        """
+        md5, digest = hashes or run(hash_file, file_path)
+        size = os.path.getsize(file_path)
+        stored = None
+        if digest not in self.index:
+            stored = run(
+                self._upload,
+                self._tier_backend(tier),
+                digest,
+                file_path,
+                codec,
+                reader,
+            )
+        elif self.stat(digest) is None:
+            stored = run(
+                self._upload,
+                self._tier_backend(self.tier(digest)),
+                digest,
+                file_path,
+                self.index[digest].get("codec"),
+                reader,
+            )
+        self._reference(digest, size, tier, stored)
+        return md5, digest
+
+    def find(self, size, digest):
+        """Return the entry for known content, or None"""
+        entry = self.index.get(digest)
+        if entry is None or entry["size"] != size or entry.get("refs", 0) <= 0:
+            return None
+        return entry
+
+    def add_reference(self, digest):
+        """Reference stored content for one more file"""
+        self._reference(digest, self.index[digest]["size"])
+
+    def adopt(self, digest, size):
+        """Reference content already stored under its digest
+
+        Used for contents a ``migrate()`` re-keyed into the primary backend
+        before the index knew them. Returns False, referencing nothing, when
+        no object of ``size`` bytes is stored under ``digest``.
+        """
+        if digest not in self.index:
+            info = self.backend.stat(digest)
+            if info is None or info["size"] != size:
+                return False
+        self._reference(digest, size)
+        return True
+
+    def stat(self, digest):
+        info = self._tier_backend(self.tier(digest)).stat(digest)
+        if info is None and self.fallback is not None:
+            info = self.fallback.stat(digest)
+        return info
+
+    def open(self, digest):
+        """Open stored content as a seekable binary stream"""
+        try:
+            stream = self._tier_backend(self.tier(digest)).open(digest)
+        except FileNotFoundError:
+            if self.fallback is None:
+                raise
+            stream = self.fallback.open(digest)
+        if (self.index.get(digest) or {}).get("codec"):
+            return open_framed(stream)
+        return stream
+
+    @staticmethod
+    def _copy(source, target, digest, size, reader=None):
+        with source.open(digest) as stream:
+            target.put_stream(digest, reader(stream) if reader else stream)
+        copied = target.stat(digest)
+        if copied is None or copied["size"] != size:
+            target.delete(digest)
+            raise OSError(f"Size mismatch after moving {digest}")
+
+    def move(self, digest, tier, reader=None, run=_call):
+        """Move content to the "hot" or "cold" tier; returns the bytes moved
+
+        The copy is verified before the index points at it, and the old
+        copy is deleted last, so readers always find the content. ``run``
+        and ``reader`` are used for the copy as in ``put()``.
+        """
+        current = self.tier(digest)
+        if current == tier or digest not in self.index:
+            return 0
+        source = self._tier_backend(current)
+        target = self._tier_backend(tier)
+        entry = self.index[digest]
+        size = entry.get("stored_size", entry["size"])
+        run(self._copy, source, target, digest, size, reader)
+
+        def set_tier(entry):
+            if entry is None:
+                return None
+            entry = dict(entry, tier=tier)
+            if tier == "hot":
+                del entry["tier"]
+            return entry
+
+        self.index.update_item(digest, set_tier)
+        run(source.delete, digest)
+        return size
+
+    def release(self, digest):
+        """Drop one reference; content is reclaimed by ``gc()``"""
+        if not digest or digest not in self.index:
+            return
+
+        def decrement(entry):
+            if entry is None:
+                return None
+            return with_refs(entry, max(entry.get("refs", 0) - 1, 0))
+
+        self.index.update_item(digest, decrement)
+
+    def gc(self, references=None, grace=3600):
+        """Delete unreferenced objects and return ``(objects, bytes)``
+
+        ``references`` (digest -> number of files using it), when given,
+        corrects the stored reference counts first. An object is deleted
+        from every backend once it has been unreferenced for ``grace``
+        seconds (see blob_store.py).
+        """
+        for digest in list(self.index.keys()):
+            recount(
+                self.index,
+                digest,
+                None if references is None else references.get(digest, 0),
+            )
+
+        cutoff = time.time() - grace
+        removed = reclaimed = 0
+        for digest in list(self.index.keys()):
+            entry = reclaim(self.index, digest, cutoff)
+            if entry is None:
+                continue
+            for backend in (self.backend, self.cold, self.fallback):
+                if backend is not None:
+                    backend.delete(digest)
+            removed += 1
+            reclaimed += entry.get("stored_size", entry.get("size", 0))
+        return removed, reclaimed
+
+
+def content_digest(backend, key):
+    """SHA-256 hex digest of an object's content"""
+    sha256 = hashlib.sha256()
+    with backend.open(key) as stream:
+        for chunk in iter(lambda: stream.read(READ_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def migrate(source, target, keys=None, delete_source=True, progress=None):
+    """Move objects from one backend to another; returns ``(objects, bytes)``
+
+    Each object is copied, its size checked on the target and only then
+    deleted from the source (unless ``delete_source`` is false), so the
+    migration can be interrupted and resumed at any point. Objects of a
+    ``legacy`` source (keyed by path) are stored on the target under the
+    SHA-256 of their content and kept in the source, which still serves
+    them until they are adopted; ``progress`` is called with the source
+    key.
+    """
+    rekey = not getattr(source, "sharded", True)
+    delete_source = delete_source and not rekey
+    moved = moved_bytes = 0
+    for key in list(source.keys() if keys is None else keys):
+        info = source.stat(key)
+        if info is None:
+            continue
+        target_key = content_digest(source, key) if rekey else key
+        existing = target.stat(target_key)
+        if existing is None or existing["size"] != info["size"]:
+            with source.open(key) as stream:
+                target.put_stream(target_key, stream)
+            copied = target.stat(target_key)
+            if copied is None or copied["size"] != info["size"]:
+                raise OSError(f"Size mismatch after copying {key}")
+        if delete_source:
+            source.delete(key)
+        moved += 1
+        moved_bytes += info["size"]
+        if progress:
+            progress(key, moved, moved_bytes)
+    return moved, moved_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move stored objects between storage backends"
+    )
+    parser.add_argument("source", help="backend URL to move objects from")
+    parser.add_argument("target", help="backend URL to move objects to")
+    parser.add_argument(
+        "--keep-source", action="store_true", help="copy without deleting"
+    )
+    args = parser.parse_args()
+    if args.source.startswith("legacy:"):
+        print(
+            "Note: legacy objects are re-keyed by content and kept in place; run "
+            "'flask --app app adopt-objects' to point the file metadata at them"
+        )
+
+    moved, moved_bytes = migrate(
+        create_backend(args.source),
+        create_backend(args.target),
+        delete_source=not args.keep_source,
+        progress=lambda key, count, _: count % 1000 or print(f"{count} objects"),
+    )
+    print(f"Moved {moved} objects ({moved_bytes / 1024 / 1024:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+On-demand profiling for FileShare Pro.
+
+Two profilers, both off unless turned on at run time:
+
+- ``RequestProfiler`` runs cProfile around single requests, chosen by the
+  caller (an ``X-Profile`` header) or at random with ``sample_rate``, and
+  writes each profile as a pstats file (``python -m pstats <file>``,
+  snakeviz...). Only one request is profiled at a time: the profiler hooks
+  the OS thread, and under eventlet (serve.py) all green threads of a
+  worker share one, so the profile of a request that waits on I/O also
+  holds whatever ran in the meantime.
+- ``StackSampler`` reads the stack of every thread ``1 / interval`` times
+  per second from a separate OS thread and counts identical stacks, in the
+  collapsed format read by flamegraph.pl and speedscope
+  (``frame;frame;frame count`` per line). Its overhead is one stack walk
+  per thread per sample, so it can run continuously.
+
+When neither is on, the request hooks cost one attribute and one header
+lookup and no thread is running.
+"""
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from threads import native_threading
+
+
+class RequestProfiler:
+    """cProfile of sampled requests, kept as pstats files in ``directory``."""
+
+    def __init__(self, directory=None, sample_rate=0.0, keep=100):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self._active = False
+        self._lock = threading.Lock()
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        """Start profiling the calling thread; returns None when another
+        request is being profiled"""
+        with self._lock:
+            if self._active:
+                return None
+            self._active = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiling tool is active on this thread
+            self._release()
+            return None
+        return profile
+
+    def _release(self):
+        with self._lock:
+            self._active = False
+
+    def finish(self, profile, label):
+        """Stop ``profile`` and save it; returns the profile's file name"""
+        profile.disable()
+        self._release()
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", label).strip("-")[:80]
+        name = f"request-{time.time():.6f}-{slug}.pstats"
+        os.makedirs(self.directory, exist_ok=True)
+        profile.dump_stats(os.path.join(self.directory, name))
+        self.prune()
+        return name
+
+    def profiles(self):
+        """Saved profiles, newest first: ``[{"name", "size", "created_at"}]``"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        profiles = []
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            profiles.append(
+                {"name": name, "size": stat.st_size, "created_at": stat.st_mtime}
+            )
+        return sorted(profiles, key=lambda entry: entry["created_at"], reverse=True)
+
+    def prune(self):
+        """Delete all but the ``keep`` newest profiles"""
+        for entry in self.profiles()[self.keep :]:
+            try:
+                os.remove(os.path.join(self.directory, entry["name"]))
+            except OSError:
+                pass
+
+
+def _frame_label(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}".replace(";", ":")
+
+
+def collapse(frame):
+    """Collapsed stack of ``frame``, outermost frame first"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """Counts the stacks of all threads, sampled at a fixed interval."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.started_at = None
+        self.samples = 0
+        self._stacks = Counter()
+        # Shared with the sampling OS thread, so not a green lock (as a green
+        # thread the sampler would only ever see itself running)
+        self._lock = native_threading().Lock()
+        self._stop = None
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None, duration=None):
+        """Start sampling (for ``duration`` seconds, or until ``stop()``)"""
+        if self.running:
+            return False
+        if interval:
+            self.interval = interval
+        native = native_threading()
+        self._stop = native.Event()
+        self.started_at = time.time()
+        self._thread = native.Thread(
+            target=self._run, args=(self._stop, duration), daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self._stop.set()
+        self._thread.join()
+        return True
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def _run(self, stop, duration):
+        own = native_threading().get_ident()
+        deadline = time.monotonic() + duration if duration else None
+        while not stop.wait(self.interval):
+            self.sample(ignore=own)
+            if deadline and time.monotonic() >= deadline:
+                break
+
+    def sample(self, ignore=None):
+        """Record the current stack of every thread but ``ignore``"""
+        stacks = [
+            collapse(frame)
+            for ident, frame in sys._current_frames().items()
+            if ident != ignore
+        ]
+        with self._lock:
+            self._stacks.update(stacks)
+            self.samples += 1
+
+    def collapsed(self):
+        """Stacks counted so far, one ``frame;frame;frame count`` per line"""
+        with self._lock:
+            stacks = sorted(self._stacks.items())
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def status(self):
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "started_at": self.started_at,
+            "samples": self.samples,
+            "stacks": len(self._stacks),
+        }
@@ -0,0 +1,120 @@
+"""
+Storage quotas for FileShare Pro.
+
+``QuotaLedger`` keeps the storage used by every user and API key (bytes
+and number of files) as a ``SharedDict`` listener on the file metadata, so
+uploads, deletes and retention all update it without extra calls and a
+usage lookup is a dictionary access instead of a scan of all files.
+
+A file belongs to the API key that uploaded it, otherwise to the user in
+its ``uploaded_by`` field. Usage counts the logical size of current files;
+deduplicated content counts for every file using it, and earlier versions
+(versioning mode) are not counted.
+
+Limits are configured as
+
+    {
+        "users": {"default": {"max_mb": 1024}, "admin": {"max_mb": None}},
+        "api_keys": {"default": {"max_mb": 500, "max_files": 10000}},
+    }
+
+where ``None`` (or a missing entry) means unlimited.
+"""
+import threading
+
+
+def owner_of(metadata):
+    """The ``(kind, name)`` a file is accounted to, or None"""
+    if metadata.get("api_key"):
+        return ("api_key", metadata["api_key"])
+    if metadata.get("uploaded_by"):
+        return ("user", metadata["uploaded_by"])
+    return None
+
+
+class QuotaLedger:
+    """Per-owner storage usage, kept in sync with the file metadata."""
+
+    def __init__(self, limits=None):
+        self.limits = limits or {}
+        self._files = {}
+        self._usage = {}
+        self._lock = threading.RLock()
+
+    def configure(self, limits):
+        self.limits = limits or {}
+
+    def _add(self, owner, size, count):
+        usage = self._usage.setdefault(owner, {"bytes": 0, "files": 0})
+        usage["bytes"] += size
+        usage["files"] += count
+        if not usage["files"]:
+            del self._usage[owner]
+
+    def apply(self, changes, reset=False):
+        """``SharedDict`` listener keeping usage in sync with metadata"""
+        with self._lock:
+            if reset:
+                self._files = {}
+                self._usage = {}
+            for file_key, metadata in changes.items():
+                previous = self._files.pop(file_key, None)
+                if previous is not None:
+                    self._add(previous[0], -previous[1], -1)
+                owner = owner_of(metadata) if metadata is not None else None
+                if owner is not None:
+                    size = metadata.get("size", 0)
+                    self._files[file_key] = (owner, size)
+                    self._add(owner, size, 1)
+
+    def usage(self, owner):
+        with self._lock:
+            return dict(self._usage.get(owner, {"bytes": 0, "files": 0}))
+
+    def limit(self, owner):
+        """``{"max_bytes", "max_files"}`` of an owner (None: unlimited)"""
+        kind, name = owner
+        scope = self.limits.get("users" if kind == "user" else "api_keys", {})
+        config = dict(scope.get("default") or {}, **(scope.get(name) or {}))
+        max_mb = config.get("max_mb")
+        return {
+            "max_bytes": int(max_mb * 1024 * 1024) if max_mb is not None else None,
+            "max_files": config.get("max_files"),
+        }
+
+    def report(self, owner):
+        """Usage and limits of an owner, as returned by the API"""
+        usage = self.usage(owner)
+        limit = self.limit(owner)
+        return {
+            "bytes": usage["bytes"],
+            "files": usage["files"],
+            "max_bytes": limit["max_bytes"],
+            "max_files": limit["max_files"],
+            "remaining_bytes": None
+            if limit["max_bytes"] is None
+            else max(limit["max_bytes"] - usage["bytes"], 0),
+        }
+
+    def check(self, owner, size, files=1):
+        """Return an error message if adding ``size`` bytes exceeds the quota"""
+        if owner is None:
+            return None
+        usage = self.usage(owner)
+        limit = self.limit(owner)
+        if (
+            limit["max_bytes"] is not None
+            and usage["bytes"] + size > limit["max_bytes"]
+        ):
+            return (
+                f"Storage quota exceeded: {usage['bytes']} of {limit['max_bytes']} "
+                f"bytes used, upload needs {size}"
+            )
+        if (
+            limit["max_files"] is not None
+            and usage["files"] + files > limit["max_files"]
+        ):
+            return (
+                f"File quota exceeded: {usage['files']} of {limit['max_files']} files"
+            )
+        return None
@@ -0,0 +1,123 @@
+"""
+Real-time change notifications for FileShare Pro.
+
+File uploads, downloads and deletions are published to an
+``EventCoalescer`` instead of being broadcast one by one. Changes that
+arrive within a short window are merged per file and sent to clients as a
+single ``files_changed`` event carrying the deltas, so a bulk import of
+thousands of files results in a handful of broadcasts that clients apply
+directly instead of refetching the file list after every event.
+
+Clients subscribe to the folder they are viewing and join its room. Events
+for a file are delivered to the rooms of its folder and of every ancestor
+folder, so a client watching ``docs`` sees changes in ``docs/2024`` while a
+client watching ``images`` receives nothing.
+"""
+import threading
+
+FOLDER_ROOM_PREFIX = "folder:"
+
+
+def normalize_folder_path(folder_path):
+    return "/".join(part for part in (folder_path or "").split("/") if part)
+
+
+def folder_room(folder_path):
+    """Socket.IO room of a single folder (the root folder is "")"""
+    return FOLDER_ROOM_PREFIX + normalize_folder_path(folder_path)
+
+
+def folder_rooms(folder_path):
+    """Rooms to notify about a change in a folder: the folder and its ancestors"""
+    parts = normalize_folder_path(folder_path).split("/")
+    rooms = [folder_room("")]
+    for depth in range(1, len(parts) + 1):
+        if parts[depth - 1]:
+            rooms.append(folder_room("/".join(parts[:depth])))
+    return rooms
+
+
+def merge_changes(previous, change):
+    """Merge two pending changes for the same file into one"""
+    if previous is None:
+        return change
+    merged = change
+    if change["action"] == "downloaded" and previous["action"] == "uploaded":
+        # The client has not seen the upload yet; send it with the new count
+        previous["file"]["downloads"] = change["downloads"]
+        merged = previous
+        if "seq" in change:
+            merged["seq"] = change["seq"]
+    if previous.get("rooms") is None or change.get("rooms") is None:
+        merged["rooms"] = None
+    else:
+        merged["rooms"] = sorted(set(previous["rooms"]) | set(change["rooms"]))
+    return merged
+
+
+class EventCoalescer:
+    """Batch file change events into periodic ``files_changed`` broadcasts.
+
+    A batch is sent ``window`` seconds after its first change, so clients
+    see updates with bounded latency while busy periods cost one broadcast
+    per window. A batch that reaches ``max_batch`` files is sent at once.
+    """
+
+    def __init__(self, socketio, event="files_changed", window=0.25, max_batch=500):
+        self.socketio = socketio
+        self.event = event
+        self.window = window
+        self.max_batch = max_batch
+        # Optional callable returning extra payload fields (e.g. totals)
+        self.summary = None
+        self._pending = {}
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def publish(self, change, rooms=None):
+        """Queue a change: ``{"action": ..., "path": file_key, ...}``
+
+        With ``rooms`` the change is only sent to those rooms; every room
+        receives one batch holding all of its changes.
+        """
+        change = dict(change, rooms=rooms)
+        with self._lock:
+            previous = self._pending.pop(change["path"], None)
+            self._pending[change["path"]] = merge_changes(previous, change)
+            flush_now = self.window <= 0 or len(self._pending) >= self.max_batch
+            schedule = not flush_now and not self._scheduled
+            if schedule:
+                self._scheduled = True
+
+        if flush_now:
+            self.flush()
+        elif schedule:
+            self.socketio.start_background_task(self._flush_later)
+
+    def _flush_later(self):
+        self.socketio.sleep(self.window)
+        self.flush()
+
+    def flush(self):
+        """Broadcast all pending changes now"""
+        with self._lock:
+            changes = list(self._pending.values())
+            self._pending = {}
+            self._scheduled = False
+        if not changes:
+            return
+
+        # Group changes by destination; None means broadcast to everyone
+        batches = {}
+        for change in changes:
+            rooms = change.pop("rooms")
+            for room in rooms if rooms is not None else [None]:
+                batches.setdefault(room, []).append(change)
+
+        summary = self.summary() if self.summary is not None else {}
+        for room, room_changes in batches.items():
+            payload = dict(summary, changes=room_changes)
+            if room is None:
+                self.socketio.emit(self.event, payload)
+            else:
+                self.socketio.emit(self.event, payload, to=room)
@@ -0,0 +1,206 @@
+"""
+Reconciliation of the upload folder with the file metadata for FileShare Pro.
+
+Files can end up on disk without metadata (orphans, e.g. after a crash
+between writing an upload and recording it), metadata can point at files
+that are gone (missing files), and thumbnails can outlive their image
+(stale thumbnails). ``Reconciler`` finds all three and can fix them.
+
+Scanning every file on every start would make startup grow with the store,
+so ``DirectoryScanner`` keeps a checkpoint of each directory: its mtime and
+the names of its files and subdirectories. A directory's mtime changes
+whenever an entry is added, removed or renamed in it, so a directory whose
+mtime matches the checkpoint is not listed again; its contents are taken
+from the checkpoint. An incremental pass therefore costs one ``stat`` per
+directory plus a listing of the directories that changed. A full pass
+ignores the checkpoint and lists everything; it runs in the background.
+
+Directories modified within ``RACY_WINDOW`` seconds of being listed are
+listed again next time, since an entry added in the same mtime tick would
+not change the mtime.
+"""
+import os
+import threading
+import time
+
+# Seconds within which a directory mtime is too close to the listing to
+# trust (file systems with coarse timestamps)
+RACY_WINDOW = 2.0
+# Files younger than this are not reported as orphans (uploads in flight)
+ORPHAN_GRACE = 3600
+
+FIX_ACTIONS = ("remove_missing", "delete_orphans", "delete_stale_thumbnails")
+
+
+class DirectoryScanner:
+    """Lists the files under a directory, reusing a per-directory checkpoint."""
+
+    def __init__(self, root, checkpoint, prefix=""):
+        self.root = root
+        self.checkpoint = checkpoint
+        self.prefix = prefix
+
+    def _list(self, path):
+        files, dirs = [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+        return sorted(files), sorted(dirs)
+
+    def scan(self, full=False):
+        """Return ``(relative file paths, directories listed, directories)``"""
+        found = set()
+        listed = total = 0
+        seen = set()
+        pending = [""]
+        while pending:
+            relative = pending.pop()
+            path = os.path.join(self.root, relative) if relative else self.root
+            key = self.prefix + relative
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            total += 1
+            seen.add(key)
+            entry = self.checkpoint.get(key)
+            if full or entry is None or entry["mtime_ns"] != mtime:
+                listed_at = time.time_ns()
+                try:
+                    files, dirs = self._list(path)
+                except OSError:
+                    continue
+                listed += 1
+                entry = {"mtime_ns": mtime, "files": files, "dirs": dirs}
+                if listed_at - mtime < RACY_WINDOW * 1e9:
+                    entry["mtime_ns"] = -1  # list again next time
+                if self.checkpoint.get(key) != entry:
+                    self.checkpoint[key] = entry
+            for name in entry["files"]:
+                found.add(os.path.join(relative, name) if relative else name)
+            for name in entry["dirs"]:
+                pending.append(os.path.join(relative, name) if relative else name)
+
+        # Forget directories that no longer exist
+        for key in list(self.checkpoint.keys()):
+            if key.startswith(self.prefix) and key not in seen:
+                del self.checkpoint[key]
+        return found, listed, total
+
+
+class Reconciler:
+    """Compares the upload and thumbnail folders with the file metadata.
+
+    ``expected`` returns the files the metadata expects on disk, as
+    {path relative to the upload folder: file key}, and ``remove`` deletes
+    the metadata of a missing file (the ``remove_missing`` fix).
+    ``stored_elsewhere`` returns the files kept outside the upload folder
+    (in the object store) in the same form: they are neither expected on
+    disk nor missing, but keep their thumbnails.
+    """
+
+    def __init__(
+        self,
+        upload_folder,
+        thumbnails_folder,
+        checkpoint,
+        expected=None,
+        remove=None,
+        grace=ORPHAN_GRACE,
+        stored_elsewhere=None,
+    ):
+        self.upload_folder = upload_folder
+        self.thumbnails_folder = thumbnails_folder
+        self.checkpoint = checkpoint
+        self.expected = expected
+        self.remove = remove
+        self.grace = grace
+        self.stored_elsewhere = stored_elsewhere
+        self.report = None
+        self._lock = threading.Lock()
+
+    def _orphans(self, paths, now):
+        orphans = []
+        for relative in sorted(paths):
+            try:
+                mtime = os.path.getmtime(os.path.join(self.upload_folder, relative))
+            except OSError:
+                continue
+            if now - mtime >= self.grace:
+                orphans.append(relative)
+        return orphans
+
+    def run(self, full=False):
+        """Scan (incrementally unless ``full``) and return the report"""
+        with self._lock:
+            started = time.time()
+            uploads = DirectoryScanner(self.upload_folder, self.checkpoint, "uploads:")
+            thumbnails = DirectoryScanner(
+                self.thumbnails_folder, self.checkpoint, "thumbnails:"
+            )
+            on_disk, listed, total = uploads.scan(full)
+            thumbs, thumbs_listed, thumbs_total = thumbnails.scan(full)
+
+            expected = self.expected()
+            elsewhere = self.stored_elsewhere() if self.stored_elsewhere else {}
+            wanted_thumbs = {
+                f"thumb_{os.path.basename(path)}.jpg"
+                for path in list(expected) + list(elsewhere)
+            }
+            self.report = {
+                "orphans": self._orphans(on_disk.difference(expected), started),
+                "missing": sorted(
+                    file_key
+                    for path, file_key in expected.items()
+                    if path not in on_disk
+                ),
+                "stale_thumbnails": sorted(
+                    name
+                    for name in thumbs.difference(wanted_thumbs)
+                    if name.startswith("thumb_")
+                ),
+                "files_on_disk": len(on_disk),
+                "files_in_metadata": len(expected) + len(elsewhere),
+                "directories": total + thumbs_total,
+                "directories_listed": listed + thumbs_listed,
+                "full": full,
+                "scanned_at": started,
+                "duration": time.time() - started,
+            }
+            return self.report
+
+    def fix(self, actions):
+        """Apply fix actions to the latest report; returns counts per action"""
+        unknown = set(actions) - set(FIX_ACTIONS)
+        if unknown:
+            raise ValueError(f"Unknown fix actions: {', '.join(sorted(unknown))}")
+        report = self.run()
+        fixed = {}
+        if "remove_missing" in actions:
+            fixed["remove_missing"] = self.remove(report["missing"])
+            report["missing"] = []
+        if "delete_orphans" in actions:
+            fixed["delete_orphans"] = self._delete(
+                self.upload_folder, report["orphans"]
+            )
+            report["orphans"] = []
+        if "delete_stale_thumbnails" in actions:
+            fixed["delete_stale_thumbnails"] = self._delete(
+                self.thumbnails_folder, report["stale_thumbnails"]
+            )
+            report["stale_thumbnails"] = []
+        return fixed
+
+    @staticmethod
+    def _delete(folder, paths):
+        removed = 0
+        for relative in paths:
+            try:
+                os.remove(os.path.join(folder, relative))
+                removed += 1
+            except OSError:
+                pass
+        return removed
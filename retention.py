@@ -0,0 +1,251 @@
+"""
+Retention policies for FileShare Pro.
+
+``RetentionEngine`` decides when files and share links are deleted. Every
+file and share link with a deadline is kept in a min-heap ordered by that
+deadline, maintained incrementally as ``SharedDict`` listeners, so a tick
+only pops what has actually expired instead of scanning all metadata.
+Entries whose deadline changed are skipped when popped (lazy deletion).
+Files under a size cap are kept in a second min-heap per scope, ordered by
+upload date, so evicting the oldest files works the same way.
+
+Policies are configured as
+
+    {
+        "default": {"ttl_days": 7},
+        "folders": {"chat": {"ttl_days": 1}, "archive": {"ttl_days": None}},
+        "api_keys": {"<api key>": {"max_downloads": 1, "max_total_mb": 500}},
+    }
+
+A file gets the default policy, overridden by the policy of its deepest
+configured folder and then by the policy of the API key that uploaded it.
+``ttl_days`` expires files that long after upload (None keeps them),
+``max_downloads`` deletes a file once downloaded that often and
+``max_total_mb`` caps the total size of the files under the folder or API
+key that sets it, deleting the oldest files first. Share links expire at
+their ``expires_at`` or when their ``max_downloads`` is reached.
+
+Deletions are handed to the ``delete`` callback in batches of at most
+``batch_size`` files and share links.
+"""
+import heapq
+import os
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_POLICY = {"ttl_days": 7, "max_downloads": None, "max_total_mb": None}
+# Files that could not be deleted are retried after this many seconds
+RETRY_DELAY = 300
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value).timestamp()
+
+
+def resolve_policy(policies, file_key, metadata):
+    """Effective policy of a file and the scope of its ``max_total_mb``
+
+    The scope is ``("folder", prefix)`` or ``("api_key", key)`` for the
+    most specific policy that sets a size cap, or None.
+    """
+    policy = dict(DEFAULT_POLICY, **policies.get("default", {}))
+    scope = ("default", "") if policy["max_total_mb"] is not None else None
+
+    folder = os.path.dirname(file_key)
+    matches = [
+        prefix
+        for prefix in policies.get("folders", {})
+        if folder == prefix or folder.startswith(prefix.rstrip("/") + "/")
+    ]
+    if matches:
+        prefix = max(matches, key=len)
+        policy.update(policies["folders"][prefix])
+        if policies["folders"][prefix].get("max_total_mb") is not None:
+            scope = ("folder", prefix)
+
+    api_key = metadata.get("api_key")
+    if api_key and api_key in policies.get("api_keys", {}):
+        policy.update(policies["api_keys"][api_key])
+        if policies["api_keys"][api_key].get("max_total_mb") is not None:
+            scope = ("api_key", api_key)
+    return policy, scope
+
+
+class RetentionEngine:
+    """Expiry deadlines of files and share links, in a min-heap."""
+
+    def __init__(self, policies=None, delete=None, batch_size=100):
+        self.policies = policies or {}
+        self.delete = delete
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._heap = []
+        self._deadlines = {}
+        # Size caps: scope -> {file key: (upload time, size)}, and totals
+        self._caps = {}
+        self._scoped = {}
+        self._file_scopes = {}
+        self._totals = {}
+        self._over = set()
+        # Per scope: heap of (upload time, file key), and the files handed
+        # out for eviction that still exist (file key -> size)
+        self._ages = {}
+        self._claimed = {}
+
+    def configure(self, policies, batch_size):
+        with self._lock:
+            self.policies = policies or {}
+            self.batch_size = batch_size
+
+    def _schedule(self, kind, key, deadline):
+        if deadline is None:
+            self._deadlines.pop((kind, key), None)
+        elif self._deadlines.get((kind, key)) != deadline:
+            self._deadlines[(kind, key)] = deadline
+            heapq.heappush(self._heap, (deadline, kind, key))
+
+    def _file_deadline(self, policy, metadata):
+        if (
+            policy["max_downloads"] is not None
+            and metadata.get("downloads", 0) >= policy["max_downloads"]
+        ):
+            return 0
+        if policy["ttl_days"] is None or "upload_date" not in metadata:
+            return None
+        return _timestamp(metadata["upload_date"]) + policy["ttl_days"] * 86400
+
+    def _unscope(self, file_key):
+        """Take a file out of its size cap scope; returns its entry or None"""
+        scope = self._file_scopes.pop(file_key, None)
+        if scope is None:
+            return None
+        entry = self._scoped[scope].pop(file_key)
+        self._totals[scope] -= entry[1]
+        self._claimed.get(scope, {}).pop(file_key, None)
+        if self._totals[scope] <= self._caps[scope]:
+            self._over.discard(scope)
+        return scope, entry
+
+    def _update_file(self, file_key, metadata):
+        claimed = file_key in self._claimed.get(self._file_scopes.get(file_key), {})
+        previous = self._unscope(file_key)
+        if metadata is None:
+            self._deadlines.pop(("file", file_key), None)
+            return
+        policy, scope = resolve_policy(self.policies, file_key, metadata)
+        self._schedule("file", file_key, self._file_deadline(policy, metadata))
+        if scope is not None:
+            entry = (metadata.get("upload_date", ""), metadata.get("size", 0))
+            self._caps[scope] = policy["max_total_mb"] * 1024 * 1024
+            self._scoped.setdefault(scope, {})[file_key] = entry
+            self._file_scopes[file_key] = scope
+            self._totals[scope] = self._totals.get(scope, 0) + entry[1]
+            # Pushed again only when the age changed or it was handed out
+            # (a stale or duplicate heap entry is skipped when popped)
+            if previous != (scope, entry) or claimed:
+                heapq.heappush(self._ages.setdefault(scope, []), (entry[0], file_key))
+            if self._totals[scope] > self._caps[scope]:
+                self._over.add(scope)
+
+    def _update_link(self, token, link_data):
+        if link_data is None:
+            self._deadlines.pop(("link", token), None)
+            return
+        max_downloads = link_data.get("max_downloads")
+        if max_downloads and link_data.get("download_count", 0) >= max_downloads:
+            deadline = 0
+        elif link_data.get("expires_at"):
+            deadline = _timestamp(link_data["expires_at"])
+        else:
+            deadline = None
+        self._schedule("link", token, deadline)
+
+    def apply_files(self, changes, reset=False):
+        """``SharedDict`` listener for the file metadata"""
+        with self._lock:
+            if reset:
+                self._heap = [entry for entry in self._heap if entry[1] != "file"]
+                heapq.heapify(self._heap)
+                for key in [key for key in self._deadlines if key[0] == "file"]:
+                    del self._deadlines[key]
+                self._caps, self._scoped, self._file_scopes = {}, {}, {}
+                self._totals, self._over = {}, set()
+                self._ages, self._claimed = {}, {}
+            for file_key, metadata in changes.items():
+                self._update_file(file_key, metadata)
+
+    def apply_links(self, changes, reset=False):
+        """``SharedDict`` listener for the share links"""
+        with self._lock:
+            if reset:
+                self._heap = [entry for entry in self._heap if entry[1] != "link"]
+                heapq.heapify(self._heap)
+                for key in [key for key in self._deadlines if key[0] == "link"]:
+                    del self._deadlines[key]
+            for token, link_data in changes.items():
+                self._update_link(token, link_data)
+
+    def _due(self, now, limit):
+        """Pop up to ``limit`` expired entries; returns (file keys, tokens)"""
+        due = {"file": [], "link": []}
+        count = 0
+        while self._heap and self._heap[0][0] <= now and count < limit:
+            deadline, kind, key = heapq.heappop(self._heap)
+            if self._deadlines.get((kind, key)) != deadline:
+                continue  # Rescheduled or removed since it was pushed
+            del self._deadlines[(kind, key)]
+            due[kind].append(key)
+            count += 1
+        return due["file"], due["link"]
+
+    def _over_cap(self, limit, exclude):
+        """Oldest files of the scopes over their size cap
+
+        Files handed out are claimed until their deletion reaches
+        ``apply_files()``; one that fails is retried through its deadline
+        (see ``retry()``), so it is not handed out again meanwhile. A scope
+        stays over its cap until its total drops to the cap.
+        """
+        selected = []
+        for scope in list(self._over):
+            heap = self._ages.get(scope, [])
+            files = self._scoped.get(scope, {})
+            claimed = self._claimed.setdefault(scope, {})
+            excess = self._totals[scope] - self._caps[scope] - sum(claimed.values())
+            while heap and excess > 0 and len(selected) < limit:
+                upload_date, file_key = heapq.heappop(heap)
+                entry = files.get(file_key)
+                if entry is None or entry[0] != upload_date or file_key in claimed:
+                    continue  # Removed, changed or already handed out
+                claimed[file_key] = entry[1]
+                excess -= entry[1]
+                if file_key not in exclude:
+                    selected.append(file_key)
+        return selected
+
+    def tick(self, now=None):
+        """Delete one batch of expired files and share links
+
+        Returns the number of files and share links in the batch.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            file_keys, tokens = self._due(now, self.batch_size)
+            limit = self.batch_size - len(file_keys) - len(tokens)
+            file_keys += self._over_cap(limit, set(file_keys))
+        if not file_keys and not tokens:
+            return 0
+        self.delete(file_keys, tokens)
+        return len(file_keys) + len(tokens)
+
+    def retry(self, file_keys, now=None):
+        """Schedule files whose deletion failed to be tried again later"""
+        now = time.time() if now is None else now
+        with self._lock:
+            for file_key in file_keys:
+                self._schedule("file", file_key, now + RETRY_DELAY)
+
+    def pending(self):
+        """Number of scheduled deadlines"""
+        return len(self._deadlines)
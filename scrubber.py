@@ -0,0 +1,207 @@
+"""
+Background integrity scrubbing for FileShare Pro.
+
+Stored contents are hashed once at upload; disk errors, truncated copies or
+a damaged backend would otherwise only show when someone downloads the
+file. ``Scrubber`` re-reads every stored content in the background and
+compares it with its tree hash (or the MD5 recorded at upload for contents
+without one), recording when each content was last verified and what was
+wrong with the ones that failed.
+
+The walk is incremental: each ``step()`` verifies a small batch of
+contents in digest order and saves a cursor, so a pass resumes where it
+stopped after a restart. Reads go through ``ThrottledReader`` to stay
+within a bandwidth budget, and run on an OS thread of their own that
+lowers its CPU and I/O priority (``lower_priority``) so downloads are
+served first. Under eventlet the scrubbing task itself is a green thread
+of the worker process, so lowering its priority would slow down every
+request the worker serves.
+
+State is kept in the ``scrub`` namespace: the cursor under ``"cursor"``
+and one entry per content digest, ``{"verified_at", "ok"}`` plus
+``"error"``, ``"bad_leaves"`` and ``"file_keys"`` for failed contents.
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+from bisect import bisect_right
+
+CURSOR_KEY = "cursor"
+
+
+def lower_priority():
+    """Give the calling OS thread the lowest CPU and I/O priority
+
+    On Linux the nice value of a thread also sets its I/O priority within
+    the best-effort class, so this has the effect of ``ionice -c2 -n7``
+    for the thread. Does nothing where thread priorities are not supported.
+    Call it on a thread of the unpatched ``threading`` module only (see
+    threads.py): on a green thread it would lower the whole process.
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+
+
+def drop_cache(stream):
+    """Tell the kernel the pages of a scrubbed file will not be reused, so
+    scrubbing does not evict the page cache of frequently downloaded files"""
+    try:
+        os.posix_fadvise(stream.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        pass
+
+
+class ThrottledReader(io.RawIOBase):
+    """Seekable stream that charges every read to a throttle."""
+
+    def __init__(self, stream, throttle):
+        self._stream = stream
+        self._throttle = throttle
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._stream.tell()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._stream.seek(offset, whence)
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[: len(data)] = data
+        self._throttle(len(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            drop_cache(self._stream)
+            self._stream.close()
+        super().close()
+
+
+def md5_stream(stream, read_size=1024 * 1024):
+    md5 = hashlib.md5()
+    for data in iter(lambda: stream.read(read_size), b""):
+        md5.update(data)
+    return md5.hexdigest()
+
+
+class Scrubber:
+    """Walks the stored contents in digest order, verifying each one.
+
+    ``contents()`` returns {digest: info} for every stored content;
+    ``verify(digest, info)`` checks one and returns None when it is intact
+    or ``{"error", "bad_leaves"}``; ``on_mismatch(digest, entry)`` is
+    called for every content that fails.
+    """
+
+    def __init__(self, state, contents=None, verify=None, on_mismatch=None):
+        self.state = state
+        self.contents = contents
+        self.verify = verify
+        self.on_mismatch = on_mismatch
+        self._pass = None
+        self._lock = threading.Lock()
+
+    def cursor(self):
+        return self.state.get(CURSOR_KEY) or {}
+
+    def reset(self):
+        """Forget the contents listed for the current pass (after the state
+        was reloaded); the next step lists them again"""
+        with self._lock:
+            self._pass = None
+
+    def _start_pass(self, now):
+        contents = self.contents()
+        cursor = self.cursor()
+        if not cursor.get("started_at"):
+            cursor = dict(cursor, started_at=now, digest="")
+            self.state[CURSOR_KEY] = cursor
+        self._pass = (sorted(contents), contents)
+
+    def _finish_pass(self, now):
+        digests = set(self._pass[0])
+        for digest in list(self.state.keys()):
+            if digest != CURSOR_KEY and digest not in digests:
+                del self.state[digest]
+        cursor = self.cursor()
+        self.state[CURSOR_KEY] = {
+            "passes": cursor.get("passes", 0) + 1,
+            "last_pass_started": cursor.get("started_at"),
+            "last_pass_completed": now,
+        }
+        self._pass = None
+
+    def step(self, batch=10, now=None):
+        """Verify the next ``batch`` contents; returns the number verified
+
+        Returns 0 once the pass is complete (the next call starts a new
+        pass).
+        """
+        with self._lock:
+            now = time.time() if now is None else now
+            if self._pass is None:
+                self._start_pass(now)
+            digests, contents = self._pass
+            cursor = self.cursor()
+            position = bisect_right(digests, cursor.get("digest", ""))
+            selected = digests[position : position + batch]
+            if not selected:
+                self._finish_pass(now)
+                return 0
+
+            for digest in selected:
+                info = contents[digest]
+                try:
+                    problem = self.verify(digest, info)
+                except FileNotFoundError:
+                    problem = {"error": "missing"}
+                except (OSError, ValueError) as e:
+                    problem = {"error": f"unreadable: {e}"}
+                entry = {"verified_at": now, "ok": problem is None}
+                if problem is not None:
+                    entry.update(problem, file_keys=sorted(info.get("file_keys", [])))
+                self.state[digest] = entry
+                if problem is not None and self.on_mismatch:
+                    self.on_mismatch(digest, entry)
+            self.state[CURSOR_KEY] = dict(cursor, digest=selected[-1])
+            return len(selected)
+
+    def report(self):
+        """Progress of the current pass and the contents that failed"""
+        cursor = self.cursor()
+        entries = [
+            (digest, entry)
+            for digest, entry in self.state.items()
+            if digest != CURSOR_KEY
+        ]
+        total = position = None
+        if self._pass is not None:
+            total = len(self._pass[0])
+            position = bisect_right(self._pass[0], cursor.get("digest", ""))
+        return {
+            "passes": cursor.get("passes", 0),
+            "pass_started": cursor.get("started_at"),
+            "last_pass_completed": cursor.get("last_pass_completed"),
+            "position": position,
+            "total": total,
+            "verified": len(entries),
+            "mismatches": sorted(
+                (
+                    dict(entry, sha256=digest)
+                    for digest, entry in entries
+                    if not entry["ok"]
+                ),
+                key=lambda entry: entry["verified_at"],
+                reverse=True,
+            ),
+        }
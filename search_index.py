@@ -0,0 +1,187 @@
+"""
+Filename search for FileShare Pro.
+
+``TrigramIndex`` keeps an inverted index from three-character substrings
+(trigrams) of every file's name, original name and folder path to the
+files containing them. It is updated incrementally as file metadata
+changes, so a query only looks at the files sharing its trigrams instead of
+scanning the whole tree:
+
+- substring: files holding every trigram of the query, then verified
+- prefix: names are padded with two leading spaces, so "  r" and " re"
+  only occur at the start of a name and a prefix query narrows quickly
+- fuzzy: files sharing enough trigrams with the query (typos, transposed
+  letters), scored by trigram similarity
+
+Queries shorter than three characters have no trigrams of their own and
+fall back to checking every file name.
+"""
+import os
+import threading
+from collections import Counter
+
+# Minimum trigram similarity (Dice coefficient) of a fuzzy match
+FUZZY_THRESHOLD = 0.4
+
+# Scores of the different match kinds; higher ranks first
+EXACT_SCORE = 100
+PREFIX_SCORE = 90
+WORD_PREFIX_SCORE = 80
+SUBSTRING_SCORE = 70
+ORIGINAL_NAME_SCORE = 60
+FOLDER_SCORE = 40
+FUZZY_SCORE = 30
+
+WORD_SEPARATORS = "_-. /"
+
+
+def trigrams(text):
+    """Trigrams of ``text``, padded to mark the start and end of the text"""
+    text = f"  {text} "
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def query_trigrams(query):
+    """Trigrams a matching text must contain (no padding: matches anywhere)"""
+    return {query[i : i + 3] for i in range(len(query) - 2)}
+
+
+class TrigramIndex:
+    """Incrementally maintained trigram index over file keys."""
+
+    def __init__(self):
+        self._docs = {}  # file key -> (name, original name, folder)
+        self._grams = {}  # file key -> trigrams of the file
+        self._name_grams = {}  # file key -> number of trigrams in the name
+        self._postings = {}  # trigram -> set of file keys
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, file_key):
+        return file_key in self._docs
+
+    def add(self, file_key, metadata):
+        """Index or re-index a file from its metadata"""
+        name = os.path.basename(file_key).lower()
+        original_name = (metadata.get("original_name") or name).lower()
+        folder = os.path.dirname(file_key).lower()
+        doc = (name, original_name, folder)
+
+        with self._lock:
+            # Most metadata writes (e.g. download counts) leave the text alone
+            if self._docs.get(file_key) == doc:
+                return
+            name_grams = trigrams(name)
+            grams = name_grams | trigrams(original_name) | trigrams(folder)
+            self.remove(file_key)
+            self._docs[file_key] = doc
+            self._grams[file_key] = grams
+            self._name_grams[file_key] = len(name_grams)
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(file_key)
+
+    def remove(self, file_key):
+        with self._lock:
+            if file_key not in self._docs:
+                return
+            del self._docs[file_key]
+            del self._name_grams[file_key]
+            for gram in self._grams.pop(file_key):
+                keys = self._postings[gram]
+                keys.discard(file_key)
+                if not keys:
+                    del self._postings[gram]
+
+    def rebuild(self, files):
+        """Replace the index contents with ``files`` (file key -> metadata)"""
+        with self._lock:
+            self._docs, self._grams, self._name_grams, self._postings = {}, {}, {}, {}
+            for file_key, metadata in files.items():
+                self.add(file_key, metadata)
+
+    def apply(self, changes, reset=False):
+        """Apply metadata changes (file key -> metadata, or None if deleted)
+
+        Matches the ``SharedDict`` listener signature, so the index follows
+        the file metadata of this and every other worker process.
+        """
+        with self._lock:
+            if reset:
+                self.rebuild(changes)
+                return
+            for file_key, metadata in changes.items():
+                if metadata is None:
+                    self.remove(file_key)
+                else:
+                    self.add(file_key, metadata)
+
+    @staticmethod
+    def _score(query, doc):
+        name, original_name, folder = doc
+        if name == query:
+            return EXACT_SCORE, "exact"
+        if name.startswith(query):
+            return PREFIX_SCORE, "prefix"
+        position = name.find(query)
+        if position > 0 and name[position - 1] in WORD_SEPARATORS:
+            return WORD_PREFIX_SCORE, "prefix"
+        if position >= 0:
+            return SUBSTRING_SCORE, "substring"
+        if query in original_name:
+            return ORIGINAL_NAME_SCORE, "original_name"
+        if query in folder:
+            return FOLDER_SCORE, "folder"
+        return None
+
+    def search(self, query, limit=20, offset=0, fuzzy=True, folder_path=None):
+        """Return ``(total, [(file_key, score, match), ...])`` for a page
+
+        Results are ordered by score, then by name. ``folder_path`` limits
+        the results to files in that folder and its subfolders.
+        """
+        query = query.strip().lower()
+        if not query:
+            return 0, []
+        prefix = folder_path.strip("/") + "/" if folder_path else None
+
+        with self._lock:
+            grams = query_trigrams(query)
+            if grams:
+                # Intersect the shortest posting lists first
+                postings = sorted(
+                    (self._postings.get(gram, set()) for gram in grams), key=len
+                )
+                candidates = set(postings[0]).intersection(*postings[1:])
+            else:
+                candidates = self._docs.keys()
+
+            matches = {}
+            for file_key in candidates:
+                scored = self._score(query, self._docs[file_key])
+                if scored is not None:
+                    matches[file_key] = scored
+
+            if fuzzy and len(query) >= 3:
+                query_grams = trigrams(query)
+                shared = Counter()
+                for gram in query_grams:
+                    shared.update(self._postings.get(gram, ()))
+                for file_key, count in shared.items():
+                    if file_key in matches:
+                        continue
+                    similarity = min(
+                        2.0 * count / (len(query_grams) + self._name_grams[file_key]),
+                        1.0,
+                    )
+                    if similarity >= FUZZY_THRESHOLD:
+                        matches[file_key] = (FUZZY_SCORE * similarity, "fuzzy")
+
+            results = [
+                (file_key, score, match)
+                for file_key, (score, match) in matches.items()
+                if prefix is None or file_key.startswith(prefix)
+            ]
+            results.sort(key=lambda r: (-r[1], self._docs[r[0]][0], r[0]))
+        return len(results), results[offset : offset + limit]
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Multi-process launcher for FileShare Pro.
+
+The master process binds the listening socket once and forks worker
+processes that each serve the application with eventlet on that socket.
+Workers share state through the configured state backend (STATE_BACKEND)
+and fan out Socket.IO events through the message queue
+(SOCKETIO_MESSAGE_QUEUE), e.g.:
+
+    STATE_BACKEND=sqlite:///data/state.db \\
+    SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0 \\
+    python serve.py --workers 4 --bind 0.0.0.0:8000 --preload
+
+More than one worker (--workers, TTIN) is refused unless both are set: the
+default json state backend and in-process Socket.IO only work in a single
+process.
+
+Concurrency is tuned per worker with --pool-size (green threads, i.e.
+concurrent connections), --keep-alive and --socket-timeout; --backlog sizes
+the shared listen queue. Run ``python serve.py --help`` for all options.
+
+Signals handled by the master:
+
+    HUP         graceful reload: start a new set of workers, then stop the old
+                ones once they finish their in-flight requests
+    TERM, INT   graceful shutdown: stop accepting, drain in-flight uploads,
+                flush pending metadata, then exit
+    QUIT        immediate shutdown
+    TTIN, TTOU  add / remove one worker
+
+With --preload the application is imported once in the master and shared
+by the forked workers (faster start, less memory). A reload then recycles
+the worker processes but keeps the preloaded code; without --preload every
+new worker imports the application again and picks up code changes.
+"""
+import eventlet
+
+eventlet.monkey_patch()
+
+import argparse  # noqa: E402
+import errno  # noqa: E402
+import signal  # noqa: E402
+import socket  # noqa: E402
+import sys  # noqa: E402
+
+import eventlet.wsgi  # noqa: E402
+
+# The master must not touch the eventlet hub before forking, so it uses the
+# original blocking modules
+_os = eventlet.patcher.original("os")
+_socket = eventlet.patcher.original("socket")
+_time = eventlet.patcher.original("time")
+
+
+def parse_bind(bind):
+    """Split a ``host:port`` bind address"""
+    host, _, port = bind.rpartition(":")
+    return host or "0.0.0.0", int(port)
+
+
+def multi_worker_problems(environ):
+    """Reasons the configuration cannot serve more than one worker"""
+    problems = []
+    if environ.get("STATE_BACKEND", "json") in ("", "json"):
+        problems.append(
+            "STATE_BACKEND is the json backend, which workers cannot share "
+            "(set sqlite:///<path> or redis://<host>)"
+        )
+    if not environ.get("SOCKETIO_MESSAGE_QUEUE"):
+        problems.append(
+            "SOCKETIO_MESSAGE_QUEUE is not set, so Socket.IO events would only "
+            "reach the clients of the worker that sent them"
+        )
+    return problems
+
+
+def load_application(worker_id):
+    """Import the application module and create the app in this process"""
+    _os.environ["FILESHARE_WORKER_ID"] = str(worker_id)
+    import app as fileshare
+
+    # Periodic maintenance must only run once per deployment
+    fileshare.create_app({"BACKGROUND_TASKS": worker_id == 0})
+    return fileshare
+
+
+class KeepAliveProtocol(eventlet.wsgi.HttpProtocol):
+    """HTTP protocol that closes keep-alive connections idle for longer than
+    ``idle_timeout`` seconds (eventlet only has keep-alive on or off)"""
+
+    idle_timeout = None
+
+    def _read_request_line(self):
+        requests = getattr(self, "requests_read", 0)
+        self.requests_read = requests + 1
+        if not requests or not self.idle_timeout:
+            return super()._read_request_line()
+        self.connection.settimeout(self.idle_timeout)
+        try:
+            return super()._read_request_line()
+        except socket.timeout:
+            return ""  # Closes the connection
+        finally:
+            self.connection.settimeout(self.server.socket_timeout)
+
+
+def run_worker(listener, options, worker_id, master_pid):
+    """Serve requests until asked to stop, then shut down gracefully"""
+    eventlet.hubs.use_hub()
+    state = {"alive": True}
+
+    def stop(signum, frame):
+        state["alive"] = False
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGQUIT, lambda signum, frame: _os._exit(0))
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTTIN, signal.SIG_IGN)
+    signal.signal(signal.SIGTTOU, signal.SIG_IGN)
+
+    fileshare = load_application(worker_id)
+    sock = eventlet.greenio.GreenSocket(listener)
+    server = eventlet.spawn(
+        eventlet.wsgi.server,
+        sock,
+        fileshare.app,
+        custom_pool=eventlet.GreenPool(options.pool_size),
+        keepalive=options.keep_alive > 0,
+        protocol=type(
+            "KeepAliveProtocol",
+            (KeepAliveProtocol,),
+            {"idle_timeout": options.keep_alive},
+        ),
+        socket_timeout=options.socket_timeout or None,
+        log_output=options.access_log,
+        debug=False,
+    )
+
+    while state["alive"] and not server.dead:
+        if _os.getppid() != master_pid:
+            break  # The master went away
+        eventlet.sleep(1.0)
+
+    # Stop accepting connections; idle keep-alive connections are closed and
+    # active requests keep running in the pool
+    deadline = _time.time() + options.graceful_timeout
+    server.kill(SystemExit)
+    fileshare.shutdown(timeout=options.graceful_timeout)
+    with eventlet.Timeout(max(deadline - _time.time(), 0), False):
+        server.wait()
+    _os._exit(0)
+
+
+class Master:
+    """Pre-forking process manager"""
+
+    def __init__(self, options):
+        self.options = options
+        self.workers = {}  # pid -> worker id
+        self.num_workers = options.workers
+        self.signals = []
+        self.listener = None
+
+    def start(self):
+        host, port = parse_bind(self.options.bind)
+        self.listener = _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM)
+        self.listener.setsockopt(_socket.SOL_SOCKET, _socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(self.options.backlog)
+
+        if self.options.preload:
+            import app  # noqa: F401
+
+        for sig in (
+            signal.SIGHUP,
+            signal.SIGTERM,
+            signal.SIGINT,
+            signal.SIGQUIT,
+            signal.SIGTTIN,
+            signal.SIGTTOU,
+        ):
+            signal.signal(sig, lambda signum, frame: self.signals.append(signum))
+
+        print(
+            f"FileShare Pro master {_os.getpid()} listening on "
+            f"http://{host}:{port} with {self.num_workers} workers"
+        )
+        self.spawn_workers()
+
+    def free_worker_id(self):
+        used = set(self.workers.values())
+        worker_id = 0
+        while worker_id in used:
+            worker_id += 1
+        return worker_id
+
+    def spawn_worker(self, worker_id):
+        master_pid = _os.getpid()
+        pid = _os.fork()
+        if pid == 0:
+            try:
+                run_worker(self.listener, self.options, worker_id, master_pid)
+            finally:
+                _os._exit(1)
+        self.workers[pid] = worker_id
+        return pid
+
+    def spawn_workers(self):
+        while len(self.workers) < self.num_workers:
+            self.spawn_worker(self.free_worker_id())
+
+    def kill_workers(self, sig, pids=None):
+        for pid in list(self.workers if pids is None else pids):
+            try:
+                _os.kill(pid, sig)
+            except OSError as e:
+                if e.errno == errno.ESRCH:
+                    self.workers.pop(pid, None)
+
+    def reap_workers(self):
+        while True:
+            try:
+                pid, _ = _os.waitpid(-1, _os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            self.workers.pop(pid, None)
+
+    def reload(self):
+        """Start a new generation of workers and retire the old one"""
+        old_workers = dict(self.workers)
+        self.workers = {}
+        self.spawn_workers()
+        self.kill_workers(signal.SIGTERM, old_workers)
+        # Keep the old pids around so they are reaped when they exit
+        retired = {pid: -1 for pid in old_workers}
+        retired.update(self.workers)
+        self.workers = retired
+
+    def active_workers(self):
+        return [pid for pid, worker_id in self.workers.items() if worker_id >= 0]
+
+    def stop(self, graceful=True):
+        self.kill_workers(signal.SIGTERM if graceful else signal.SIGKILL)
+        # Leave workers a moment beyond their own timeout to flush state
+        grace = self.options.graceful_timeout + 5.0 if graceful else 0
+        deadline = _time.time() + grace
+        while self.workers and _time.time() < deadline:
+            self.reap_workers()
+            _time.sleep(0.1)
+        self.kill_workers(signal.SIGKILL)
+        self.reap_workers()
+
+    def run(self):
+        self.start()
+        while True:
+            _time.sleep(0.5)
+            self.reap_workers()
+            while self.signals:
+                signum = self.signals.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    self.stop(graceful=True)
+                    return
+                if signum == signal.SIGQUIT:
+                    self.stop(graceful=False)
+                    return
+                if signum == signal.SIGHUP:
+                    print("Reloading workers...")
+                    self.reload()
+                elif signum == signal.SIGTTIN:
+                    problems = multi_worker_problems(_os.environ)
+                    if problems:
+                        for problem in problems:
+                            print(f"Not adding a worker: {problem}", file=sys.stderr)
+                    else:
+                        self.num_workers += 1
+                elif signum == signal.SIGTTOU and self.num_workers > 1:
+                    self.num_workers -= 1
+                    active = self.active_workers()
+                    self.kill_workers(signal.SIGTERM, active[-1:])
+                    self.workers[active[-1]] = -1
+            # Replace workers that died unexpectedly
+            while len(self.active_workers()) < self.num_workers:
+                self.spawn_worker(self.free_worker_id())
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run FileShare Pro workers")
+    parser.add_argument("--bind", default="0.0.0.0:8000", help="host:port to bind")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--preload",
+        action="store_true",
+        help="import the application in the master before forking",
+    )
+    parser.add_argument(
+        "--backlog", type=int, default=2048, help="listen socket backlog"
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=1000,
+        help="green threads (concurrent connections) per worker",
+    )
+    parser.add_argument(
+        "--keep-alive",
+        type=float,
+        default=5.0,
+        help="keep idle HTTP connections open for this many seconds (0 disables)",
+    )
+    parser.add_argument(
+        "--socket-timeout",
+        type=float,
+        default=120.0,
+        help="seconds a client socket may block on a read or write (0 disables)",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=30.0,
+        help="seconds to wait for in-flight requests and uploads on shutdown",
+    )
+    parser.add_argument(
+        "--access-log", action="store_true", help="log every request to stderr"
+    )
+    return parser
+
+
+def main(argv=None):
+    options = build_parser().parse_args(argv)
+    if options.workers < 1 or options.pool_size < 1:
+        print("--workers and --pool-size must be at least 1", file=sys.stderr)
+        return 2
+    problems = multi_worker_problems(_os.environ) if options.workers > 1 else []
+    if problems:
+        for problem in problems:
+            print(f"Cannot run {options.workers} workers: {problem}", file=sys.stderr)
+        return 2
+    Master(options).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,874 @@
+"""
+Shared state storage for FileShare Pro.
+
+Application state (file metadata, share links, API keys, users) is kept in
+named namespaces of a ``StateStore``. Each namespace is exposed to the
+application as a ``SharedDict``: a dict-like view with a local read cache
+that is kept in sync with the store, so request handlers keep reading plain
+dictionaries while several worker processes write to the same state.
+
+Backends are selected with a URL (see ``create_state_store``):
+
+- ``json`` (default): one JSON file per namespace, as before. Only safe for a
+  single worker process.
+- ``sqlite:///path/to/state.db``: one SQLite database shared by all workers
+  on a host.
+- ``redis://host:6379/0``: a Redis server shared by workers on any host
+  (requires the ``redis`` package).
+
+Values must be reassigned after they are modified
+(``meta = d[key]; meta["x"] = 1; d[key] = meta``) or changed through
+``SharedDict.update_item``; in-place mutation of a cached value is not seen
+by the other workers.
+
+Stores also hold compacted logs (``log_append`` and friends): ordered logs
+that keep only the newest entry per key, used for the change feed; and
+append-only journals (``journal_append``/``journal_read``) of records with
+monotonic IDs that are paged backwards, used for the chat history.
+"""
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+# Sequence numbers the json backend reserves on disk at a time for a log
+LOG_SEQ_BLOCK = 100
+
+
+class StateStore:
+    """Base class for state backends."""
+
+    # True when other processes may write to the store concurrently, in which
+    # case SharedDict caches have to be refreshed before use.
+    shared = False
+
+    def load(self, namespace):
+        """Return ``(data, seq)`` with the full contents of a namespace."""
+        raise NotImplementedError
+
+    def changes(self, namespace, since):
+        """Return ``(seq, changed)`` for writes made after ``since``.
+
+        ``changed`` maps each modified key to its new value, or to ``None``
+        when the key was deleted.
+        """
+        return since, {}
+
+    def put(self, namespace, key, value):
+        pass
+
+    def delete(self, namespace, key):
+        pass
+
+    def update(self, namespace, key, func):
+        """Atomically replace ``key`` with ``func(current_value)``.
+
+        ``current_value`` is ``None`` for a missing key; returning ``None``
+        deletes the key. Returns the new value.
+        """
+        raise NotImplementedError
+
+    def flush(self, namespace, data):
+        """Persist a full snapshot of ``data`` (snapshot backends only)."""
+        pass
+
+    def log_append(self, log, key, entry):
+        """Append ``entry`` to a log and return its sequence number.
+
+        An earlier entry with the same ``key`` is removed, so the log holds
+        at most one entry per key.
+        """
+        raise NotImplementedError
+
+    def log_read(self, log, since, limit):
+        """Return up to ``limit`` entries with a sequence number > ``since``.
+
+        Entries are returned oldest first with their ``seq`` set.
+        """
+        raise NotImplementedError
+
+    def log_bounds(self, log):
+        """Return ``(floor, head)`` of a log.
+
+        Entries at or below ``floor`` were trimmed; ``head`` is the newest
+        sequence number handed out.
+        """
+        raise NotImplementedError
+
+    def log_trim(self, log, max_entries):
+        """Drop the oldest entries beyond ``max_entries``, raising the floor."""
+        raise NotImplementedError
+
+    def journal_append(self, journal, record):
+        """Append ``record`` to a journal and return its new ID (1, 2, ...)."""
+        raise NotImplementedError
+
+    def journal_read(self, journal, before=None, limit=20):
+        """Return the last ``limit`` records with an ID below ``before``.
+
+        Records are returned oldest first with their ``id`` set; without
+        ``before`` the newest records are returned.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonLinesJournal:
+    """Append-only file with one JSON record per line, in ID order.
+
+    Nothing is held in memory: the last ID is read from the end of the file
+    on open, and pages before an ID are found by binary search over byte
+    offsets and read backwards from there.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._last_id = None
+
+    @staticmethod
+    def _record_id(line):
+        return json.loads(line)["id"]
+
+    def _line_at(self, f, pos):
+        """Offset and content of the first complete line at or after ``pos``"""
+        f.seek(max(pos - 1, 0))
+        if pos > 0:
+            f.readline()
+        start = f.tell()
+        return start, f.readline()
+
+    def _read_last_id(self):
+        try:
+            f = open(self.path, "rb+")
+        except FileNotFoundError:
+            return 0
+        with f:
+            size = f.seek(0, os.SEEK_END)
+            tail_start = max(size - self.CHUNK_SIZE, 0)
+            f.seek(tail_start)
+            tail = f.read()
+            # Drop a partial record left behind by a crash mid-write
+            end = tail.rfind(b"\n") + 1
+            if tail_start + end < size:
+                f.truncate(tail_start + end)
+            lines = tail[:end].splitlines()
+            for line in reversed(lines):
+                try:
+                    return self._record_id(line)
+                except (ValueError, KeyError):
+                    continue
+            return 0
+
+    def append(self, record):
+        with self._lock:
+            if self._last_id is None:
+                self._last_id = self._read_last_id()
+            record = dict(record, id=self._last_id + 1)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            self._last_id = record["id"]
+            return record["id"]
+
+    def read(self, before=None, limit=20):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            end = f.seek(0, os.SEEK_END)
+            if before is not None:
+                # Find the offset of the first record with an ID >= before
+                low, high = 0, end
+                while low < high:
+                    mid = (low + high) // 2
+                    _, line = self._line_at(f, mid)
+                    if not line or self._record_id(line) >= before:
+                        high = mid
+                    else:
+                        low = mid + 1
+                end = self._line_at(f, low)[0]
+
+            # Read backwards from there until enough complete lines are seen
+            start = end
+            data = b""
+            while start > 0 and data.count(b"\n") <= limit:
+                start = max(start - self.CHUNK_SIZE, 0)
+                f.seek(start)
+                data = f.read(end - start)
+            lines = data.splitlines()
+            if start > 0:
+                lines = lines[1:]  # The first line may be cut off
+        return [json.loads(line) for line in lines[-limit:] if line.strip()]
+
+
+class JsonFileStore(StateStore):
+    """One JSON document per namespace, rewritten on every flush.
+
+    Logs are kept in memory (a dict in sequence order) and written to the
+    file registered for the log name when trimmed and on close. Sequence
+    numbers are reserved ``LOG_SEQ_BLOCK`` at a time in a ``.seq`` file next
+    to it before they are handed out. When a log was not closed cleanly, the
+    changes since its last save are lost: it is then reopened empty with
+    both floor and head at the reserved number, so numbers are never reused
+    and every reader is told to resync.
+    """
+
+    def __init__(self, paths):
+        self.paths = dict(paths)
+        self._logs = {}
+        self._log_lock = threading.RLock()
+        self._journals = {}
+
+    def load(self, namespace):
+        path = self.paths[namespace]
+        try:
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    return json.load(f), 0
+        except (OSError, ValueError):
+            pass
+        return {}, 0
+
+    def flush(self, namespace, data):
+        self._write(self.paths[namespace], data)
+
+    @staticmethod
+    def _write(path, data):
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def _log(self, log):
+        if log not in self._logs:
+            data = self.load(log)[0] if log in self.paths else {}
+            seq = data.get("seq", 0)
+            floor = data.get("floor", 0)
+            entries = dict(data.get("entries", []))
+            reserved = self._reserved(log)
+            if reserved > seq:
+                # Not closed cleanly; the changes after the last save are lost
+                seq = floor = reserved
+                entries = {}
+            self._logs[log] = {
+                "seq": seq,
+                "floor": floor,
+                "entries": entries,
+                "reserved": seq,
+            }
+        return self._logs[log]
+
+    def _reserved(self, log):
+        if log not in self.paths:
+            return 0
+        try:
+            with open(f"{self.paths[log]}.seq", "r") as f:
+                return json.load(f)["reserved"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0
+
+    def _reserve(self, log, reserved):
+        self._logs[log]["reserved"] = reserved
+        if log in self.paths:
+            self._write(f"{self.paths[log]}.seq", {"reserved": reserved})
+
+    def _save_log(self, log):
+        if log in self.paths:
+            state = self._logs[log]
+            self.flush(
+                log,
+                {
+                    "seq": state["seq"],
+                    "floor": state["floor"],
+                    "entries": list(state["entries"].items()),
+                },
+            )
+
+    def log_append(self, log, key, entry):
+        with self._log_lock:
+            state = self._log(log)
+            state["seq"] += 1
+            if state["seq"] > state["reserved"]:
+                self._reserve(log, state["seq"] + LOG_SEQ_BLOCK - 1)
+            # Re-inserting moves the key to the end, keeping sequence order
+            state["entries"].pop(key, None)
+            state["entries"][key] = dict(entry, seq=state["seq"])
+            return state["seq"]
+
+    def log_read(self, log, since, limit):
+        with self._log_lock:
+            entries = []
+            for entry in self._log(log)["entries"].values():
+                if entry["seq"] > since:
+                    entries.append(entry)
+                    if len(entries) >= limit:
+                        break
+            return entries
+
+    def log_bounds(self, log):
+        with self._log_lock:
+            state = self._log(log)
+            return state["floor"], state["seq"]
+
+    def log_trim(self, log, max_entries):
+        with self._log_lock:
+            state = self._log(log)
+            entries = state["entries"]
+            while len(entries) > max_entries:
+                oldest = next(iter(entries))
+                state["floor"] = entries.pop(oldest)["seq"]
+            self._save_log(log)
+
+    def _journal(self, journal):
+        with self._log_lock:
+            if journal not in self._journals:
+                self._journals[journal] = JsonLinesJournal(self.paths[journal])
+            return self._journals[journal]
+
+    def journal_append(self, journal, record):
+        return self._journal(journal).append(record)
+
+    def journal_read(self, journal, before=None, limit=20):
+        return self._journal(journal).read(before, limit)
+
+    def close(self):
+        with self._log_lock:
+            for log in self._logs:
+                self._save_log(log)
+                # Everything handed out is saved: release the reservation
+                self._reserve(log, self._logs[log]["seq"])
+
+
+class SQLiteStore(StateStore):
+    """Namespaces stored as rows of a single SQLite database.
+
+    Every write bumps a store-wide sequence number that is recorded on the
+    row, so a reader can fetch only the rows written since its last sync.
+    Deleted keys are kept as rows with a NULL value for the same reason.
+    """
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # Connections must not be shared with forked worker processes
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS state (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT,
+                    seq INTEGER NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                );
+                CREATE INDEX IF NOT EXISTS state_seq ON state (namespace, seq);
+                CREATE TABLE IF NOT EXISTS sequence (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO sequence (name, value) VALUES ('state', 0);
+                CREATE TABLE IF NOT EXISTS log (
+                    log TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    entry TEXT NOT NULL,
+                    PRIMARY KEY (log, key)
+                );
+                CREATE INDEX IF NOT EXISTS log_seq ON log (log, seq);
+                CREATE TABLE IF NOT EXISTS journal (
+                    journal TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    record TEXT NOT NULL,
+                    PRIMARY KEY (journal, id)
+                );
+                """
+            )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _next_seq(self, conn):
+        conn.execute("UPDATE sequence SET value = value + 1 WHERE name = 'state'")
+        return conn.execute(
+            "SELECT value FROM sequence WHERE name = 'state'"
+        ).fetchone()[0]
+
+    def _write(self, conn, namespace, key, value):
+        seq = self._next_seq(conn)
+        conn.execute(
+            "INSERT OR REPLACE INTO state (namespace, key, value, seq) "
+            "VALUES (?, ?, ?, ?)",
+            (namespace, key, None if value is None else json.dumps(value), seq),
+        )
+
+    def load(self, namespace):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN")
+            try:
+                seq = conn.execute(
+                    "SELECT value FROM sequence WHERE name = 'state'"
+                ).fetchone()[0]
+                rows = conn.execute(
+                    "SELECT key, value FROM state "
+                    "WHERE namespace = ? AND value IS NOT NULL",
+                    (namespace,),
+                ).fetchall()
+            finally:
+                conn.execute("COMMIT")
+        return {key: json.loads(value) for key, value in rows}, seq
+
+    def changes(self, namespace, since):
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    "SELECT key, value, seq FROM state "
+                    "WHERE namespace = ? AND seq > ? ORDER BY seq",
+                    (namespace, since),
+                )
+                .fetchall()
+            )
+        changed = {}
+        for key, value, seq in rows:
+            changed[key] = None if value is None else json.loads(value)
+            since = seq
+        return since, changed
+
+    def put(self, namespace, key, value):
+        self._transaction(lambda conn: self._write(conn, namespace, key, value))
+
+    def delete(self, namespace, key):
+        self._transaction(lambda conn: self._write(conn, namespace, key, None))
+
+    def update(self, namespace, key, func):
+        def apply(conn):
+            row = conn.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            current = json.loads(row[0]) if row and row[0] is not None else None
+            value = func(current)
+            self._write(conn, namespace, key, value)
+            return value
+
+        return self._transaction(apply)
+
+    def log_append(self, log, key, entry):
+        def apply(conn):
+            seq = self._next_seq(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO log (log, key, seq, entry) VALUES (?, ?, ?, ?)",
+                (log, key, seq, json.dumps(entry)),
+            )
+            return seq
+
+        return self._transaction(apply)
+
+    def log_read(self, log, since, limit):
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    "SELECT seq, entry FROM log WHERE log = ? AND seq > ? "
+                    "ORDER BY seq LIMIT ?",
+                    (log, since, limit),
+                )
+                .fetchall()
+            )
+        return [dict(json.loads(entry), seq=seq) for seq, entry in rows]
+
+    def log_bounds(self, log):
+        with self._lock:
+            conn = self._connection()
+            head = conn.execute(
+                "SELECT value FROM sequence WHERE name = 'state'"
+            ).fetchone()[0]
+            row = conn.execute(
+                "SELECT value FROM sequence WHERE name = ?", (f"floor:{log}",)
+            ).fetchone()
+        return (row[0] if row else 0), head
+
+    def log_trim(self, log, max_entries):
+        def apply(conn):
+            row = conn.execute(
+                "SELECT seq FROM log WHERE log = ? ORDER BY seq DESC LIMIT 1 OFFSET ?",
+                (log, max_entries),
+            ).fetchone()
+            if row is None:
+                return
+            conn.execute("DELETE FROM log WHERE log = ? AND seq <= ?", (log, row[0]))
+            conn.execute(
+                "INSERT OR REPLACE INTO sequence (name, value) VALUES (?, ?)",
+                (f"floor:{log}", row[0]),
+            )
+
+        self._transaction(apply)
+
+    def journal_append(self, journal, record):
+        def apply(conn):
+            record_id = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) + 1 FROM journal WHERE journal = ?",
+                (journal,),
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO journal (journal, id, record) VALUES (?, ?, ?)",
+                (journal, record_id, json.dumps(record)),
+            )
+            return record_id
+
+        return self._transaction(apply)
+
+    def journal_read(self, journal, before=None, limit=20):
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    "SELECT id, record FROM journal WHERE journal = ? AND id < ? "
+                    "ORDER BY id DESC LIMIT ?",
+                    (journal, before if before is not None else 2**63 - 1, limit),
+                )
+                .fetchall()
+            )
+        return [dict(json.loads(record), id=record_id) for record_id, record in rows][
+            ::-1
+        ]
+
+    def _transaction(self, func):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class RedisStore(StateStore):
+    """Namespaces stored as Redis hashes.
+
+    Each namespace uses three keys: a hash with the values, a counter with
+    the namespace sequence number and a sorted set mapping every changed key
+    to the sequence number of its last write.
+    """
+
+    shared = True
+
+    _WRITE_SCRIPT = """
+    local seq = redis.call('INCR', KEYS[2])
+    if ARGV[2] == '' then
+        redis.call('HDEL', KEYS[1], ARGV[1])
+    else
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    end
+    redis.call('ZADD', KEYS[3], seq, ARGV[1])
+    return seq
+    """
+
+    _LOG_APPEND_SCRIPT = """
+    local seq = redis.call('INCR', KEYS[3])
+    redis.call('ZADD', KEYS[1], seq, ARGV[1])
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+    return seq
+    """
+
+    _JOURNAL_APPEND_SCRIPT = """
+    local id = redis.call('INCR', KEYS[2])
+    redis.call('ZADD', KEYS[1], id, id .. ':' .. ARGV[1])
+    return id
+    """
+
+    def __init__(self, url, prefix="fileshare"):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._write_script = self._redis.register_script(self._WRITE_SCRIPT)
+        self._log_append_script = self._redis.register_script(self._LOG_APPEND_SCRIPT)
+        self._journal_append_script = self._redis.register_script(
+            self._JOURNAL_APPEND_SCRIPT
+        )
+
+    def _keys(self, namespace):
+        base = f"{self._prefix}:{namespace}"
+        return [base, f"{base}:seq", f"{base}:changes"]
+
+    def load(self, namespace):
+        data_key, seq_key, _ = self._keys(namespace)
+        seq = int(self._redis.get(seq_key) or 0)
+        raw = self._redis.hgetall(data_key)
+        return {k.decode(): json.loads(v) for k, v in raw.items()}, seq
+
+    def changes(self, namespace, since):
+        data_key, _, changes_key = self._keys(namespace)
+        rows = self._redis.zrangebyscore(
+            changes_key, f"({since}", "+inf", withscores=True
+        )
+        if not rows:
+            return since, {}
+        keys = [key for key, _ in rows]
+        values = self._redis.hmget(data_key, keys)
+        changed = {
+            key.decode(): None if value is None else json.loads(value)
+            for key, value in zip(keys, values)
+        }
+        return int(rows[-1][1]), changed
+
+    def put(self, namespace, key, value):
+        self._write_script(keys=self._keys(namespace), args=[key, json.dumps(value)])
+
+    def delete(self, namespace, key):
+        self._write_script(keys=self._keys(namespace), args=[key, ""])
+
+    def _log_keys(self, log):
+        base = f"{self._prefix}:log:{log}"
+        # order (sorted set key -> seq), entries (hash), seq, floor
+        return [f"{base}:order", f"{base}:entries", f"{base}:seq", f"{base}:floor"]
+
+    def log_append(self, log, key, entry):
+        return int(
+            self._log_append_script(
+                keys=self._log_keys(log)[:3], args=[key, json.dumps(entry)]
+            )
+        )
+
+    def log_read(self, log, since, limit):
+        order_key, entries_key, _, _ = self._log_keys(log)
+        rows = self._redis.zrangebyscore(
+            order_key, f"({since}", "+inf", start=0, num=limit, withscores=True
+        )
+        if not rows:
+            return []
+        values = self._redis.hmget(entries_key, [key for key, _ in rows])
+        return [
+            dict(json.loads(value), seq=int(score))
+            for (_, score), value in zip(rows, values)
+            if value is not None
+        ]
+
+    def log_bounds(self, log):
+        _, _, seq_key, floor_key = self._log_keys(log)
+        floor, head = self._redis.mget(floor_key, seq_key)
+        return int(floor or 0), int(head or 0)
+
+    def log_trim(self, log, max_entries):
+        order_key, entries_key, _, floor_key = self._log_keys(log)
+        excess = self._redis.zcard(order_key) - max_entries
+        if excess <= 0:
+            return
+        rows = self._redis.zrange(order_key, 0, excess - 1, withscores=True)
+        keys = [key for key, _ in rows]
+        with self._redis.pipeline() as pipe:
+            pipe.zrem(order_key, *keys)
+            pipe.hdel(entries_key, *keys)
+            pipe.set(floor_key, int(rows[-1][1]))
+            pipe.execute()
+
+    def _journal_keys(self, journal):
+        # Sorted set of "id:record" members scored by ID, and the ID counter
+        base = f"{self._prefix}:journal:{journal}"
+        return [base, f"{base}:id"]
+
+    def journal_append(self, journal, record):
+        return int(
+            self._journal_append_script(
+                keys=self._journal_keys(journal), args=[json.dumps(record)]
+            )
+        )
+
+    def journal_read(self, journal, before=None, limit=20):
+        members = self._redis.zrevrangebyscore(
+            self._journal_keys(journal)[0],
+            f"({before}" if before is not None else "+inf",
+            "-inf",
+            start=0,
+            num=limit,
+        )
+        records = []
+        for member in reversed(members):
+            record_id, _, record = member.decode().partition(":")
+            records.append(dict(json.loads(record), id=int(record_id)))
+        return records
+
+    def update(self, namespace, key, func):
+        import redis
+
+        data_key = self._keys(namespace)[0]
+        while True:
+            with self._redis.pipeline() as pipe:
+                try:
+                    pipe.watch(data_key)
+                    raw = pipe.hget(data_key, key)
+                    value = func(json.loads(raw) if raw is not None else None)
+                    pipe.multi()
+                    self._write_script(
+                        keys=self._keys(namespace),
+                        args=[key, "" if value is None else json.dumps(value)],
+                        client=pipe,
+                    )
+                    pipe.execute()
+                    return value
+                except redis.WatchError:
+                    continue
+
+
+class SharedDict(MutableMapping):
+    """Dict-like view of one namespace of a ``StateStore``.
+
+    Reads are served from a local cache; writes go to the cache and the
+    store. Call ``refresh()`` to pick up writes from other processes.
+
+    Listeners added with ``add_listener`` are called as
+    ``listener(changes, reset=False)`` with ``{key: value or None}`` for
+    every change to the cache, local or picked up by ``refresh()``, and with
+    the full contents and ``reset=True`` when the cache is reloaded. They
+    let derived structures (e.g. search indexes) follow the namespace.
+    """
+
+    def __init__(self, store, namespace):
+        self._store = store
+        self._namespace = namespace
+        self._data = {}
+        self._seq = 0
+        self._lock = threading.RLock()
+        self._listeners = []
+
+    @property
+    def store(self):
+        return self._store
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, changes, reset=False):
+        for listener in self._listeners:
+            listener(changes, reset=reset)
+
+    def bind(self, store):
+        """Switch to another store; call ``reload()`` to load its contents."""
+        with self._lock:
+            self._store = store
+            self._data = {}
+            self._seq = 0
+            self._notify({}, reset=True)
+
+    def reload(self):
+        data, seq = self._store.load(self._namespace)
+        with self._lock:
+            self._data = data
+            self._seq = seq
+            self._notify(dict(data), reset=True)
+
+    def refresh(self):
+        if not self._store.shared:
+            return
+        seq, changed = self._store.changes(self._namespace, self._seq)
+        if not changed:
+            return
+        with self._lock:
+            for key, value in changed.items():
+                if value is None:
+                    self._data.pop(key, None)
+                else:
+                    self._data[key] = value
+            self._seq = max(self._seq, seq)
+            self._notify(changed)
+
+    def save(self):
+        self._store.flush(self._namespace, self._data)
+
+    def update_item(self, key, func):
+        """Atomically replace ``self[key]`` with ``func(self.get(key))``."""
+        with self._lock:
+            if self._store.shared:
+                value = self._store.update(self._namespace, key, func)
+            else:
+                value = func(self._data.get(key))
+            if value is None:
+                self._data.pop(key, None)
+            else:
+                self._data[key] = value
+            self._notify({key: value})
+            return value
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._store.put(self._namespace, key, value)
+            self._notify({key: value})
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+            self._store.delete(self._namespace, key)
+            self._notify({key: None})
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        return self._data.keys()
+
+    def items(self):
+        return self._data.items()
+
+    def values(self):
+        return self._data.values()
+
+    def __repr__(self):
+        return f"SharedDict({self._namespace!r}, {len(self._data)} keys)"
+
+
+def create_state_store(url, json_paths):
+    """Create a state store from a backend URL.
+
+    ``json_paths`` maps namespaces to the JSON files used by the default
+    ``json`` backend and imported once into an empty shared backend.
+    """
+    if not url or url == "json":
+        return JsonFileStore(json_paths)
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///") :])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(url)
+    raise ValueError(f"Unsupported state backend: {url}")
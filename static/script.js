@@ -1,7 +1,28 @@
 // Professional File Sharing App JavaScript
 
 // Socket.io connection
-const socket = io();
+// Connect with WebSocket straight away: the server may run several worker
+// processes behind one socket, and long-polling requests of one session
+// could land on different workers. Fall back to polling if WebSocket fails.
+const socket = io({ transports: ['websocket'] });
+let socketEverConnected = false;
+socket.on('connect', () => {
+    const reconnected = socketEverConnected;
+    socketEverConnected = true;
+    // Room membership is lost on reconnect
+    if (subscribedFolder !== null) {
+        socket.emit('subscribe_folder', { folder_path: subscribedFolder });
+    }
+    // Catch up on the changes missed while disconnected
+    if (reconnected) {
+        syncChanges();
+    }
+});
+socket.on('connect_error', () => {
+    if (!socketEverConnected) {
+        socket.io.opts.transports = ['polling', 'websocket'];
+    }
+});
 
 // Global variables
 let currentFiles = [];
@@ -10,6 +31,12 @@ let deleteModal = null;
 let fileToDelete = null;
 let shareLinkModal = null;
 let shareFileInfo = null;
+// Folder whose file events this client receives (null: none)
+let subscribedFolder = null;
+// Chat namespace socket, connected on the chat page only
+let chatSocket = null;
+// Sequence number of the last change applied to currentFiles (null: none)
+let lastChangeSeq = null;
 
 // Socket event handlers
 socket.on('connected', (data) => {
@@ -17,51 +44,95 @@ socket.on('connected', (data) => {
     addActivity('Connected to file sharing server');
 });
 
-socket.on('file_uploaded', (data) => {
-    const folderPath = data.folder_path ? ` in /${data.folder_path}` : '';
-    addActivity(`File uploaded: ${data.filename}${folderPath} (${data.size} MB) - Share: ${data.share_link}`);
-    refreshFiles();
-    updateStats();
-});
+// File changes arrive in coalesced batches; apply the deltas to the cached
+// file tree instead of refetching the listing and stats
+socket.on('files_changed', (data) => {
+    data.changes.forEach(applyFileChange);
+    data.changes.forEach(change => {
+        if (lastChangeSeq !== null && change.seq > lastChangeSeq) {
+            lastChangeSeq = change.seq;
+        }
+    });
 
-socket.on('file_downloaded', (data) => {
-    const folderPath = data.folder_path ? ` from /${data.folder_path}` : '';
-    addActivity(`File downloaded: ${data.filename}${folderPath} (Total downloads: ${data.downloads})`);
-    refreshFiles();
-    updateStats();
-});
+    if (data.changes.length > 5) {
+        addActivity(`${data.changes.length} files changed`);
+    } else {
+        data.changes.forEach(change => addActivity(describeFileChange(change)));
+    }
 
-socket.on('file_deleted', (data) => {
-    const folderPath = data.folder_path ? ` from /${data.folder_path}` : '';
-    addActivity(`File deleted: ${data.filename}${folderPath}`);
-    refreshFiles();
-    updateStats();
+    if (document.getElementById('filesTableBody')) {
+        displayFiles(currentFiles);
+    }
+    if (data.stats) {
+        displayStats(data.stats);
+    }
 });
 
-// Chat-specific socket handlers
-socket.on('chat_history', (data) => {
-    if (typeof displayChatHistory === 'function') {
-        displayChatHistory(data.messages);
+// Receive file events for a folder and its subfolders only
+function subscribeFolder(folderPath) {
+    if (subscribedFolder !== null && subscribedFolder !== folderPath) {
+        socket.emit('unsubscribe_folder', { folder_path: subscribedFolder });
     }
-});
+    subscribedFolder = folderPath;
+    socket.emit('subscribe_folder', { folder_path: folderPath });
+}
 
-socket.on('new_message', (data) => {
-    if (typeof displayMessage === 'function') {
+// Replay the change feed since lastChangeSeq; reload the listing when the
+// server no longer has the changes we missed
+function syncChanges() {
+    if (lastChangeSeq === null) return;
+
+    socket.emit('sync_changes', { since: lastChangeSeq, folder_path: subscribedFolder || '' }, (result) => {
+        if (!result || result.error) return;
+        if (result.resync_required) {
+            refreshFiles();
+            return;
+        }
+
+        // Feed entries carry the current state of each file
+        result.changes
+            .filter(entry => entry.type === 'file')
+            .forEach(entry => applyFileChange({
+                action: entry.action === 'deleted' ? 'deleted' : 'uploaded',
+                path: entry.path,
+                file: entry.data
+            }));
+        lastChangeSeq = result.last_seq;
+
+        if (result.has_more) {
+            syncChanges();
+            return;
+        }
+        if (result.changes.length > 0) {
+            addActivity(`${result.changes.length} changes synced after reconnecting`);
+            if (document.getElementById('filesTableBody')) {
+                displayFiles(currentFiles);
+            }
+            updateStats();
+        }
+    });
+}
+
+// Chat-specific socket handlers
+function connectChat() {
+    chatSocket = io('/chat', { transports: socket.io.opts.transports });
+
+    chatSocket.on('chat_history', (data) => {
+        displayChatHistory(data.messages, data.has_more);
+    });
+
+    chatSocket.on('new_message', (data) => {
         displayMessage(data);
-    }
-});
+    });
 
-socket.on('user_typing', (data) => {
-    if (typeof showTypingIndicator === 'function') {
+    chatSocket.on('user_typing', (data) => {
         showTypingIndicator(data.username);
-    }
-});
+    });
 
-socket.on('user_stop_typing', (data) => {
-    if (typeof hideTypingIndicator === 'function') {
+    chatSocket.on('user_stop_typing', (data) => {
         hideTypingIndicator(data.username);
-    }
-});
+    });
+}
 
 // Utility functions
 function addActivity(message) {
@@ -80,39 +151,97 @@ function addActivity(message) {
     }
 }
 
+function describeFileChange(change) {
+    const name = change.path.split('/').pop();
+    const slash = change.path.lastIndexOf('/');
+    const folder = slash > 0 ? ` /${change.path.substring(0, slash)}` : '';
+
+    if (change.action === 'uploaded') {
+        return `File uploaded: ${name}${folder ? ' in' + folder : ''} (${change.file.size} MB)`;
+    }
+    if (change.action === 'downloaded') {
+        return `File downloaded: ${name}${folder ? ' from' + folder : ''} (Total downloads: ${change.downloads})`;
+    }
+    return `File deleted: ${name}${folder ? ' from' + folder : ''}`;
+}
+
+// Return the children list of a folder in the cached tree
+function findFolderItems(folderPath, create) {
+    let items = currentFiles;
+    if (!folderPath) return items;
+
+    let path = '';
+    for (const part of folderPath.split('/')) {
+        path = path ? `${path}/${part}` : part;
+        let folder = items.find(item => item.type === 'folder' && item.name === part);
+        if (!folder) {
+            if (!create) return null;
+            folder = { name: part, type: 'folder', path: path, children: [] };
+            items.push(folder);
+        }
+        items = folder.children;
+    }
+    return items;
+}
+
+function applyFileChange(change) {
+    if (!Array.isArray(currentFiles)) return;
+
+    const slash = change.path.lastIndexOf('/');
+    const folderPath = slash > 0 ? change.path.substring(0, slash) : '';
+    const items = findFolderItems(folderPath, change.action === 'uploaded');
+    if (!items) return;
+
+    const index = items.findIndex(item => item.type === 'file' && item.path === change.path);
+    if (change.action === 'uploaded') {
+        if (index >= 0) {
+            items[index] = change.file;
+        } else {
+            items.push(change.file);
+        }
+    } else if (change.action === 'deleted') {
+        if (index >= 0) items.splice(index, 1);
+    } else if (change.action === 'downloaded') {
+        if (index >= 0) items[index].downloads = change.downloads;
+    }
+}
+
 async function updateStats() {
     try {
         const response = await fetch('/api/stats');
-        const stats = await response.json();
-
-        const totalFilesElem = document.getElementById('totalFiles');
-        const totalDownloadsElem = document.getElementById('totalDownloads');
-        const totalSizeElem = document.getElementById('totalSize');
-        const fileCountElem = document.getElementById('fileCount');
-        const folderCountElem = document.getElementById('folderCount');
-        const totalSizeDisplayElem = document.getElementById('totalSizeDisplay');
-
-        if (totalFilesElem) totalFilesElem.textContent = stats.total_files;
-        if (totalDownloadsElem) totalDownloadsElem.textContent = stats.total_downloads;
-        if (totalSizeElem) totalSizeElem.textContent = stats.total_size_mb + ' MB';
-        if (fileCountElem) fileCountElem.textContent = stats.total_files;
-        if (folderCountElem) {
-            // Count folders in current view
-            const folderCount = currentFiles.filter(item => item.type === 'folder').length;
-            folderCountElem.textContent = folderCount;
-        }
-        if (totalSizeDisplayElem) totalSizeDisplayElem.textContent = stats.total_size_mb + ' MB';
+        displayStats(await response.json());
     } catch (error) {
         console.error('Error updating stats:', error);
     }
 }
 
+function displayStats(stats) {
+    const totalFilesElem = document.getElementById('totalFiles');
+    const totalDownloadsElem = document.getElementById('totalDownloads');
+    const totalSizeElem = document.getElementById('totalSize');
+    const fileCountElem = document.getElementById('fileCount');
+    const folderCountElem = document.getElementById('folderCount');
+    const totalSizeDisplayElem = document.getElementById('totalSizeDisplay');
+
+    if (totalFilesElem) totalFilesElem.textContent = stats.total_files;
+    if (totalDownloadsElem) totalDownloadsElem.textContent = stats.total_downloads;
+    if (totalSizeElem) totalSizeElem.textContent = stats.total_size_mb + ' MB';
+    if (fileCountElem) fileCountElem.textContent = stats.total_files;
+    if (folderCountElem) {
+        // Count folders in current view
+        const folderCount = currentFiles.filter(item => item.type === 'folder').length;
+        folderCountElem.textContent = folderCount;
+    }
+    if (totalSizeDisplayElem) totalSizeDisplayElem.textContent = stats.total_size_mb + ' MB';
+}
+
 // File management functions
 async function refreshFiles() {
     try {
         const url = currentFolder ? `/api/files?folder=${encodeURIComponent(currentFolder)}` : '/api/files';
         const response = await fetch(url);
         currentFiles = await response.json();
+        lastChangeSeq = Number(response.headers.get('X-Change-Seq') || 0);
         displayFiles(currentFiles);
         updateStats();
     } catch (error) {
@@ -585,20 +714,32 @@ function setupSearch() {
     const searchInput = document.getElementById('searchInput');
     if (!searchInput) return;
 
+    // The server keeps a search index; query it once typing pauses
+    let searchTimeout = null;
     searchInput.addEventListener('input', (e) => {
-        const searchTerm = e.target.value.toLowerCase().trim();
+        const searchTerm = e.target.value.trim();
+        clearTimeout(searchTimeout);
 
         if (searchTerm === '') {
             displayFiles(currentFiles);
         } else {
-            const filteredFiles = currentFiles.filter(file =>
-                file.name.toLowerCase().includes(searchTerm)
-            );
-            displayFiles(filteredFiles);
+            searchTimeout = setTimeout(() => searchFiles(searchTerm), 200);
         }
     });
 }
 
+async function searchFiles(searchTerm) {
+    try {
+        const response = await fetch(`/api/search?q=${encodeURIComponent(searchTerm)}&per_page=50`);
+        const data = await response.json();
+        // Ignore responses for a query the user has typed past
+        if (document.getElementById('searchInput').value.trim() !== searchTerm) return;
+        displayFiles(data.results, false);
+    } catch (error) {
+        console.error('Search error:', error);
+    }
+}
+
 // Click outside modal to close
 function setupModalClose() {
     const modal = document.getElementById('deleteModal');
@@ -624,6 +765,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Setup file listing page
     if (document.getElementById('filesTableBody')) {
+        subscribeFolder(currentFolder);
         refreshFiles();
         setupSearch();
         setupModalClose();
@@ -636,6 +778,8 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Setup stats on home page
     if (document.getElementById('totalFiles')) {
+        // The dashboard shows activity from all folders
+        subscribeFolder('');
         updateStats();
         // Update stats every 10 seconds
         setInterval(updateStats, 10000);
@@ -656,6 +800,8 @@ let typingTimeout = null;
 let typingUsers = new Set();
 
 function setupChat() {
+    connectChat();
+
     const usernameInput = document.getElementById('usernameInput');
     const joinChatBtn = document.getElementById('joinChatBtn');
     const messageInput = document.getElementById('messageInput');
@@ -675,6 +821,13 @@ function setupChat() {
         }
     });
 
+    // Older history is loaded page by page when scrolling up
+    document.getElementById('chatMessages').addEventListener('scroll', (e) => {
+        if (e.target.scrollTop === 0) {
+            loadOlderChat();
+        }
+    });
+
     // Message sending
     sendBtn.addEventListener('click', sendMessage);
     messageInput.addEventListener('keypress', (e) => {
@@ -729,14 +882,14 @@ function setupChat() {
     // Typing indicators
     messageInput.addEventListener('input', () => {
         if (currentUsername) {
-            socket.emit('user_typing', { username: currentUsername });
+            chatSocket.emit('user_typing', { username: currentUsername });
 
             // Clear previous timeout
             clearTimeout(typingTimeout);
 
             // Set new timeout to stop typing
             typingTimeout = setTimeout(() => {
-                socket.emit('user_stop_typing', { username: currentUsername });
+                chatSocket.emit('user_stop_typing', { username: currentUsername });
             }, 1000);
         }
     });
@@ -785,7 +938,7 @@ function sendMessage() {
     const message = messageInput.value.trim();
 
     if (message && currentUsername) {
-        socket.emit('chat_message', {
+        chatSocket.emit('chat_message', {
             username: currentUsername,
             message: message
         });
@@ -793,7 +946,7 @@ function sendMessage() {
         messageInput.value = '';
 
         // Stop typing indicator
-        socket.emit('user_stop_typing', { username: currentUsername });
+        chatSocket.emit('user_stop_typing', { username: currentUsername });
     }
 }
 
@@ -823,7 +976,6 @@ function uploadChatFile(file) {
     // Create form data
     const formData = new FormData();
     formData.append('file', file);
-    formData.append('username', currentUsername);
 
     // Create XMLHttpRequest for progress tracking
     const xhr = new XMLHttpRequest();
@@ -866,18 +1018,49 @@ function uploadChatFile(file) {
     xhr.send(formData);
 }
 
-function displayChatHistory(messages) {
+// ID of the oldest message shown, and whether the server has older ones
+let oldestChatId = null;
+let hasOlderChat = false;
+let loadingOlderChat = false;
+
+function displayChatHistory(messages, hasMore) {
     const chatMessages = document.getElementById('chatMessages');
     chatMessages.innerHTML = '';
 
     messages.forEach(message => {
         displayMessage(message, false);
     });
+    oldestChatId = messages.length > 0 ? messages[0].id : null;
+    hasOlderChat = Boolean(hasMore);
 
     scrollToBottom();
 }
 
-function displayMessage(messageData, scroll = true) {
+// Load the previous page of history when scrolled to the top
+function loadOlderChat() {
+    if (loadingOlderChat || !hasOlderChat || oldestChatId === null) return;
+    loadingOlderChat = true;
+
+    chatSocket.emit('chat_history', { before_id: oldestChatId }, (data) => {
+        loadingOlderChat = false;
+        if (!data || data.error) return;
+
+        const chatMessages = document.getElementById('chatMessages');
+        const previousHeight = chatMessages.scrollHeight;
+        data.messages.slice().reverse().forEach(message => {
+            displayMessage(message, false, true);
+        });
+        // Keep the messages the user was reading in place
+        chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+
+        if (data.messages.length > 0) {
+            oldestChatId = data.messages[0].id;
+        }
+        hasOlderChat = data.has_more;
+    });
+}
+
+function displayMessage(messageData, scroll = true, prepend = false) {
     const chatMessages = document.getElementById('chatMessages');
     const messageDiv = document.createElement('div');
     messageDiv.className = 'message';
@@ -972,7 +1155,11 @@ function displayMessage(messageData, scroll = true) {
     }
 
     messageDiv.innerHTML = contentHtml;
-    chatMessages.appendChild(messageDiv);
+    if (prepend) {
+        chatMessages.insertBefore(messageDiv, chatMessages.firstChild);
+    } else {
+        chatMessages.appendChild(messageDiv);
+    }
 
     if (scroll) {
         scrollToBottom();
@@ -1081,6 +1268,7 @@ function escapeHtml(text) {
 // Folder navigation functions
 function navigateToFolder(folderPath) {
     currentFolder = folderPath;
+    subscribeFolder(folderPath);
     refreshFiles();
     updateBreadcrumb(folderPath);
 }
@@ -1139,15 +1327,17 @@ async function createFolder() {
 }
 
 // Updated displayFiles function to handle folders
-function displayFiles(items) {
+function displayFiles(items, filterByFolder = true) {
     const tbody = document.getElementById('filesTableBody');
     const noFiles = document.getElementById('noFiles');
 
     if (!tbody) return;
 
-    // Filter items based on current folder
+    // Filter items based on current folder (search results span all folders)
     let displayItems = items;
-    if (Array.isArray(items)) {
+    if (!filterByFolder) {
+        displayItems = items.slice();
+    } else if (Array.isArray(items)) {
         // If items is a flat array (old format), filter by folder path
         displayItems = items.filter(item => {
             const itemFolder = item.folder_path || '';
@@ -1179,12 +1369,14 @@ function displayFiles(items) {
 
     if (noFiles) noFiles.style.display = 'none';
 
-    // Sort items: folders first, then files
-    displayItems.sort((a, b) => {
-        if (a.type === 'folder' && b.type === 'file') return -1;
-        if (a.type === 'file' && b.type === 'folder') return 1;
-        return a.name.localeCompare(b.name);
-    });
+    // Sort items: folders first, then files (search results keep their rank)
+    if (filterByFolder) {
+        displayItems.sort((a, b) => {
+            if (a.type === 'folder' && b.type === 'file') return -1;
+            if (a.type === 'file' && b.type === 'folder') return 1;
+            return a.name.localeCompare(b.name);
+        });
+    }
 
     tbody.innerHTML = displayItems.map(item => {
         if (item.type === 'folder') {
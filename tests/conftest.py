@@ -6,17 +6,46 @@ import tempfile
 
 import pytest
 
-from app import app as flask_app
+from app import create_app
 
 
 @pytest.fixture
 def app():
     """Create and configure a new app instance for each test."""
     # Create a temporary file to serve as the test database
-    db_fd, flask_app.config["DATABASE"] = tempfile.mkstemp()
-    flask_app.config["TESTING"] = True
-    flask_app.config["WTF_CSRF_ENABLED"] = False
-    flask_app.config["UPLOAD_FOLDER"] = tempfile.mkdtemp()
+    db_fd, db_path = tempfile.mkstemp()
+    flask_app = create_app(
+        {
+            "DATABASE": db_path,
+            "TESTING": True,
+            "WTF_CSRF_ENABLED": False,
+            "UPLOAD_FOLDER": tempfile.mkdtemp(),
+            # Keep state files out of the working tree
+            "DATA_DIR": tempfile.mkdtemp(),
+            "STATE_BACKEND": "json",
+            "LOAD_STATE": True,
+            "BACKGROUND_TASKS": False,
+            "STORAGE_MODE": "blob",
+            "OBJECT_STORE": None,
+            "OBJECT_STORE_FALLBACK": None,
+            "TIERING": False,
+            "COLD_STORE": None,
+            "COMPRESSION": False,
+            "FILE_VERSIONING": False,
+            "RETENTION_POLICIES": {"default": {"ttl_days": 7}},
+            "STORAGE_QUOTAS": {},
+            # Reclaim released contents at once
+            "GC_GRACE": -1,
+            "METRICS_TOKEN": None,
+            "PROFILE_SAMPLE_RATE": 0,
+            "PROFILE_SAMPLER": False,
+            "SLOW_REQUEST_THRESHOLD": 1.0,
+            "SLOW_REQUEST_LOG": None,
+            "TRACE_EXPORT_FILE": None,
+            # Deliver socket events immediately
+            "SOCKETIO_COALESCE_WINDOW": 0,
+        }
+    )
 
     with flask_app.app_context():
         yield flask_app
@@ -32,6 +61,13 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture
+def auth_client(client):
+    """A test client logged in as the default admin user."""
+    client.post("/login", data={"username": "admin", "password": "admin"})
+    return client
+
+
 @pytest.fixture
 def runner(app):
     """A test runner for the app's Click commands."""
@@ -1,9 +1,13 @@
 """
 Basic tests for the FileShare Pro application.
 """
+import os
+
 import pytest
 from flask import url_for
 
+from app import create_app
+
 
 class TestBasicRoutes:
     """Test basic application routes."""
@@ -70,5 +74,28 @@ class TestFileOperations:
         assert response.status_code == 302
 
 
+class TestAppFactory:
+    """Test the create_app() factory."""
+
+    def test_secret_key_survives_restart(self, app, temp_dir):
+        config = {"DATA_DIR": temp_dir, "LOAD_STATE": False}
+        app.config["SECRET_KEY"] = None
+        secret_key = create_app(config).config["SECRET_KEY"]
+
+        app.config["SECRET_KEY"] = None
+        assert create_app(config).config["SECRET_KEY"] == secret_key
+        with open(os.path.join(temp_dir, app.config["SECRET_KEY_FILE"])) as f:
+            assert f.read().strip() == secret_key
+
+    def test_state_files_live_in_data_dir(self, app):
+        # The default admin user is created on first start
+        assert os.path.exists(os.path.join(app.config["DATA_DIR"], "users.json"))
+
+    def test_default_admin_can_log_in(self, auth_client):
+        response = auth_client.get("/api/stats")
+        assert response.status_code == 200
+        assert response.get_json()["total_files"] == 0
+
+
 # Add more test classes for API endpoints, file operations, etc.
 # These tests should be expanded based on your actual implementation
@@ -0,0 +1,237 @@
+"""
+Tests for the content-addressed blob store.
+"""
+import io
+import os
+
+import pytest
+
+import app as fileshare
+from blob_store import BlobStore, hash_file, sample_digests
+from state_store import JsonFileStore, SharedDict
+
+
+@pytest.fixture
+def store(temp_dir):
+    return BlobStore(
+        os.path.join(temp_dir, "blobs"), SharedDict(JsonFileStore({}), "blobs")
+    )
+
+
+def write(temp_dir, name, content):
+    path = os.path.join(temp_dir, name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def upload(client, name, content):
+    return client.post(
+        "/api/upload",
+        data={"file": (io.BytesIO(content), name)},
+        content_type="multipart/form-data",
+    )
+
+
+class TestBlobStore:
+    """Test deduplication, reference counting and garbage collection."""
+
+    def test_identical_content_is_stored_once(self, store, temp_dir):
+        first = write(temp_dir, "a.pdf", b"same content")
+        second = write(temp_dir, "b.pdf", b"same content")
+        _, digest = hash_file(first)
+
+        assert store.add(first, digest) is False
+        assert store.add(second, digest) is True
+        assert os.path.samefile(first, second)
+        assert os.path.samefile(first, store.path(digest))
+        assert store.index[digest]["refs"] == 2
+        with open(second, "rb") as f:
+            assert f.read() == b"same content"
+
+    def test_find_requires_matching_size(self, store, temp_dir):
+        path = write(temp_dir, "a.txt", b"hello")
+        _, digest = hash_file(path)
+        store.add(path, digest)
+
+        assert store.find(5, digest)["refs"] == 1
+        assert store.find(6, digest) is None
+        assert store.find(5, "0" * 64) is None
+
+    def test_gc_reclaims_unreferenced_blobs(self, store, temp_dir):
+        path = write(temp_dir, "a.txt", b"hello")
+        _, digest = hash_file(path)
+        store.add(path, digest)
+        store.add(write(temp_dir, "b.txt", b"hello"), digest)
+
+        store.release(digest)
+        assert store.gc() == (0, 0)
+
+        os.remove(path)
+        os.remove(os.path.join(temp_dir, "b.txt"))
+        store.release(digest)
+        assert store.gc() == (0, 0)  # still within the grace period
+        assert store.gc(grace=-1) == (1, 5)
+        assert digest not in store.index
+        assert not os.path.exists(store.path(digest))
+
+    def test_gc_recounts_references(self, store, temp_dir):
+        path = write(temp_dir, "a.txt", b"hello")
+        _, digest = hash_file(path)
+        store.add(path, digest)
+
+        # The file is still linked, so dropping the blob frees nothing
+        assert store.gc(references={}, grace=-1) == (1, 0)
+        assert os.path.exists(path)
+
+    def test_gc_keeps_blobs_of_uploads_in_progress(self, store, temp_dir):
+        path = write(temp_dir, "a.txt", b"hello")
+        _, digest = hash_file(path)
+        store.add(path, digest)
+
+        # Linked, but the file metadata is not written yet
+        assert store.gc(references={}) == (0, 0)
+        assert store.index[digest]["refs"] == 0
+
+        assert store.gc(references={digest: 1}, grace=-1) == (0, 0)
+        assert store.index[digest]["refs"] == 1
+        assert "zero_since" not in store.index[digest]
+
+    def test_gc_removes_orphaned_blob_files(self, store, temp_dir):
+        orphan = store.path("ab" * 32)
+        os.makedirs(os.path.dirname(orphan))
+        write(os.path.dirname(orphan), os.path.basename(orphan), b"left over")
+
+        assert store.gc() == (0, 0)  # still within the grace period
+        assert store.gc(grace=-1) == (1, 9)
+
+
+class TestUploadDeduplication:
+    """Test deduplication through the upload and delete endpoints."""
+
+    def test_duplicate_uploads_share_one_blob(self, auth_client):
+        upload(auth_client, "logo.png", b"pixels")
+        upload(auth_client, "copy.png", b"pixels")
+
+        digests = {
+            fileshare.files_metadata[name]["sha256"]
+            for name in ("logo.png", "copy.png")
+        }
+        assert len(digests) == 1
+        digest = digests.pop()
+        assert fileshare.blobs[digest]["refs"] == 2
+
+        auth_client.delete("/api/delete/logo.png")
+        assert fileshare.blobs[digest]["refs"] == 1
+        response = auth_client.get("/api/download/copy.png")
+        assert response.data == b"pixels"
+
+        auth_client.delete("/api/delete/copy.png")
+        assert fileshare.collect_blobs() == (1, 6)
+        assert digest not in fileshare.blobs
+
+
+class TestUploadCheck:
+    """Test /api/v1/upload/check (instant upload of known content)."""
+
+    HEADERS = {"X-API-Key": "test-key"}
+
+    @pytest.fixture(autouse=True)
+    def api_key(self, app):
+        fileshare.api_keys["test-key"] = {
+            "name": "backup",
+            "created_at": "",
+            "usage_count": 0,
+        }
+
+    def check(self, client, **data):
+        return client.post("/api/v1/upload/check", json=data, headers=self.HEADERS)
+
+    def test_known_content_creates_file_without_upload(self, auth_client):
+        content = b"quarterly report" * 10000
+        upload(auth_client, "report.pdf", content)
+        stored = fileshare.files_metadata["report.pdf"]
+
+        response = self.check(
+            auth_client,
+            filename="report.pdf",
+            folder_path="backup",
+            size=len(content),
+            sha256=stored["sha256"],
+        )
+        data = response.get_json()
+        assert data["exists"] is True
+        assert data["data"]["filename"] == "report.pdf"
+        assert data["data"]["share_token"] in fileshare.share_links
+
+        copy = fileshare.files_metadata["backup/report.pdf"]
+        assert copy["sha256"] == stored["sha256"]
+        assert copy["uploaded_by"] == "backup"
+        assert fileshare.blobs[stored["sha256"]]["refs"] == 2
+        assert auth_client.get("/api/download/backup/report.pdf").data == content
+
+    def test_unknown_or_mismatched_content(self, auth_client, temp_dir):
+        content = b"x" * 100000
+        upload(auth_client, "data.txt", content)
+        stored = fileshare.files_metadata["data.txt"]
+
+        def exists(**data):
+            data.setdefault("filename", "new.txt")
+            return self.check(auth_client, **data).get_json()["exists"]
+
+        assert not exists(size=len(content), md5="0" * 32)
+        assert not exists(size=len(content) + 1, sha256=stored["sha256"])
+        assert not exists(size=len(content), sha256=stored["sha256"], tail_md5="0")
+
+        _, tail = sample_digests(write(temp_dir, "local.txt", content))
+        assert exists(size=len(content), sha256=stored["sha256"], tail_md5=tail)
+
+    def test_md5_alone_does_not_claim_content(self, auth_client):
+        content = b"payroll" * 10000
+        upload(auth_client, "payroll.txt", content)
+        stored = fileshare.files_metadata["payroll.txt"]
+
+        def exists(**data):
+            return self.check(
+                auth_client, filename="mine.txt", size=len(content), **data
+            ).get_json()["exists"]
+
+        # A colliding MD5 with another SHA-256, or an MD5 alone
+        assert not exists(md5=stored["md5"], sha256="0" * 64)
+        assert not exists(md5=stored["md5"])
+        assert "mine.txt" not in fileshare.files_metadata
+
+        # Files stored before SHA-256 was recorded are found by MD5
+        fileshare.files_metadata["payroll.txt"] = dict(stored, sha256=None)
+        assert exists(md5=stored["md5"])
+
+    def test_known_content_in_sanitized_folder(self, auth_client, temp_dir):
+        content = b"minutes" * 10000
+        auth_client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(content), "notes.txt"), "folder_path": "My Team"},
+            content_type="multipart/form-data",
+        )
+        stored = fileshare.files_metadata["My Team/notes.txt"]
+        head, _ = sample_digests(write(temp_dir, "local.txt", content))
+
+        response = self.check(
+            auth_client,
+            filename="copy.txt",
+            size=len(content),
+            sha256=stored["sha256"],
+            head_md5=head,
+        )
+        assert response.get_json()["exists"] is True
+        assert auth_client.get("/api/download/copy.txt").data == content
+
+    def test_validation(self, client):
+        assert self.check(client, filename="a.txt", size=1).status_code == 400
+        assert (
+            self.check(client, filename="a.exe", size=1, md5="0" * 32).status_code
+            == 400
+        )
+        response = client.post(
+            "/api/v1/upload/check", json={"filename": "a.txt", "size": 1, "md5": "0"}
+        )
+        assert response.status_code == 401
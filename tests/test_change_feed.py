@@ -0,0 +1,175 @@
+"""
+Tests for the sequence-numbered change feed.
+"""
+import io
+import os
+
+import pytest
+
+from app import socketio
+from change_feed import ChangeFeed
+from state_store import JsonFileStore, SQLiteStore
+
+
+def upload(client, name, folder_path=""):
+    return client.post(
+        "/api/upload",
+        data={"file": (io.BytesIO(b"hello"), name), "folder_path": folder_path},
+        content_type="multipart/form-data",
+    )
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, temp_dir):
+    if request.param == "sqlite":
+        return SQLiteStore(os.path.join(temp_dir, "state.db"))
+    return JsonFileStore({"changes": os.path.join(temp_dir, "changes.json")})
+
+
+class TestChangeFeed:
+    """Test recording, compaction and trimming of the feed."""
+
+    def test_changes_are_returned_in_order(self, store):
+        feed = ChangeFeed(store)
+        first = feed.record("file", "a.txt", "a.txt", "uploaded", {"downloads": 0})
+        second = feed.record("file", "b.txt", "b.txt", "uploaded", {"downloads": 0})
+
+        result = feed.read(0)
+        assert [c["path"] for c in result["changes"]] == ["a.txt", "b.txt"]
+        assert result["last_seq"] == second["seq"] > first["seq"]
+        assert feed.read(result["last_seq"])["changes"] == []
+
+    def test_log_keeps_newest_entry_per_key(self, store):
+        feed = ChangeFeed(store)
+        feed.record("file", "a.txt", "a.txt", "uploaded", {"downloads": 0})
+        feed.record("file", "b.txt", "b.txt", "uploaded", {"downloads": 0})
+        feed.record("file", "a.txt", "a.txt", "downloaded", {"downloads": 1})
+
+        changes = feed.read(0)["changes"]
+        assert [(c["path"], c["action"]) for c in changes] == [
+            ("b.txt", "uploaded"),
+            ("a.txt", "downloaded"),
+        ]
+        assert changes[1]["data"] == {"downloads": 1}
+
+    def test_paging_with_limit(self, store):
+        feed = ChangeFeed(store)
+        for i in range(5):
+            feed.record("file", f"f{i}.txt", f"f{i}.txt", "uploaded")
+
+        page = feed.read(0, limit=3)
+        assert len(page["changes"]) == 3 and page["has_more"]
+        rest = feed.read(page["last_seq"], limit=3)
+        assert [c["path"] for c in rest["changes"]] == ["f3.txt", "f4.txt"]
+        assert not rest["has_more"]
+
+    def test_trimmed_cursor_requires_resync(self, store):
+        feed = ChangeFeed(store, max_entries=2)
+        for i in range(5):
+            feed.record("file", f"f{i}.txt", f"f{i}.txt", "uploaded")
+        feed.trim()
+
+        assert feed.read(0) == {"resync_required": True, "last_seq": feed.head()}
+        changes = feed.read(3)["changes"]
+        assert [c["path"] for c in changes] == ["f3.txt", "f4.txt"]
+
+    def test_unclean_restart_does_not_reuse_sequence_numbers(self, temp_dir):
+        path = os.path.join(temp_dir, "changes.json")
+        feed = ChangeFeed(JsonFileStore({"changes": path}))
+        for i in range(150):
+            feed.record("file", f"f{i}.txt", f"f{i}.txt", "uploaded")
+        cursor = feed.head()
+
+        # Restart without close(): the changes after the last trim are lost
+        restarted = ChangeFeed(JsonFileStore({"changes": path}))
+        assert restarted.head() >= cursor
+        assert restarted.read(cursor) == {
+            "resync_required": True,
+            "last_seq": restarted.head(),
+        }
+        entry = restarted.record("file", "new.txt", "new.txt", "uploaded")
+        assert entry["seq"] > cursor
+
+    def test_clean_restart_keeps_the_log(self, temp_dir):
+        path = os.path.join(temp_dir, "changes.json")
+        store = JsonFileStore({"changes": path})
+        feed = ChangeFeed(store)
+        for i in range(5):
+            feed.record("file", f"f{i}.txt", f"f{i}.txt", "uploaded")
+        store.close()
+
+        restarted = ChangeFeed(JsonFileStore({"changes": path}))
+        assert restarted.head() == 5
+        assert [c["path"] for c in restarted.read(3)["changes"]] == [
+            "f3.txt",
+            "f4.txt",
+        ]
+
+    def test_cursor_ahead_of_log_requires_resync(self, store):
+        feed = ChangeFeed(store)
+        feed.record("file", "a.txt", "a.txt", "uploaded")
+        assert feed.read(feed.head() + 10)["resync_required"]
+
+    def test_folder_filter(self, store):
+        feed = ChangeFeed(store)
+        feed.record("file", "docs/a.txt", "docs/a.txt", "uploaded")
+        feed.record("file", "images/b.png", "images/b.png", "uploaded")
+
+        result = feed.read(0, folder_path="docs")
+        assert [c["path"] for c in result["changes"]] == ["docs/a.txt"]
+        assert result["last_seq"] == feed.head()
+
+
+class TestChangesEndpoint:
+    """Test /api/changes and the Socket.IO replay."""
+
+    def test_listing_cursor_and_changes_since(self, auth_client):
+        upload(auth_client, "before.txt")
+        listing = auth_client.get("/api/files")
+        since = int(listing.headers["X-Change-Seq"])
+
+        upload(auth_client, "after.txt")
+        auth_client.delete("/api/delete/before.txt")
+
+        result = auth_client.get(f"/api/changes?since={since}").get_json()
+        files = {c["path"]: c for c in result["changes"] if c["type"] == "file"}
+        assert files["after.txt"]["action"] == "uploaded"
+        assert files["after.txt"]["data"]["name"] == "after.txt"
+        assert files["before.txt"]["action"] == "deleted"
+        assert files["before.txt"]["data"] is None
+
+        # The share link removed with the file is part of the feed as well
+        links = [c for c in result["changes"] if c["type"] == "share_link"]
+        assert any(c["action"] == "deleted" for c in links)
+
+    def test_invalid_since(self, auth_client):
+        assert auth_client.get("/api/changes?since=abc").status_code == 400
+
+    def test_requires_login(self, client):
+        assert client.get("/api/changes?since=0").status_code == 302
+
+    def test_sync_changes_replays_missed_changes(self, app, auth_client):
+        since = int(auth_client.get("/api/files").headers["X-Change-Seq"])
+        upload(auth_client, "missed.txt", "docs")
+
+        sio_client = socketio.test_client(app, flask_test_client=auth_client)
+        result = sio_client.emit(
+            "sync_changes", {"since": since, "folder_path": "docs"}, callback=True
+        )
+        assert [c["path"] for c in result["changes"] if c["type"] == "file"] == [
+            "docs/missed.txt"
+        ]
+
+    def test_files_changed_carries_sequence_numbers(self, app, auth_client):
+        sio_client = socketio.test_client(app, flask_test_client=auth_client)
+        sio_client.emit("subscribe_folder", {"folder_path": ""}, callback=True)
+        sio_client.get_received()
+
+        upload(auth_client, "a.txt")
+        batches = [
+            msg["args"][0]
+            for msg in sio_client.get_received()
+            if msg["name"] == "files_changed"
+        ]
+        seqs = [c["seq"] for batch in batches for c in batch["changes"]]
+        assert seqs and all(isinstance(seq, int) for seq in seqs)
@@ -0,0 +1,114 @@
+"""
+Tests for the persistent, paged chat history.
+"""
+import os
+
+import pytest
+
+from app import socketio
+from chat_history import ChatHistory
+from state_store import JsonFileStore, JsonLinesJournal, SQLiteStore
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, temp_dir):
+    if request.param == "sqlite":
+        return SQLiteStore(os.path.join(temp_dir, "state.db"))
+    return JsonFileStore({"chat": os.path.join(temp_dir, "chat.jsonl")})
+
+
+def post(history, count):
+    for i in range(count):
+        history.append({"username": "alice", "message": f"m{i}"})
+
+
+class TestChatHistory:
+    """Test message IDs, the ring buffer and paging."""
+
+    def test_ids_stay_unique_beyond_the_cache(self, store):
+        history = ChatHistory(store, cache_size=5)
+        post(history, 12)
+
+        messages, has_more = history.recent(20)
+        assert [m["id"] for m in messages] == list(range(1, 13))
+        assert not has_more
+
+    def test_pages_backwards_with_before_id(self, store):
+        history = ChatHistory(store, cache_size=5)
+        post(history, 12)
+
+        page, has_more = history.recent(4)
+        assert [m["id"] for m in page] == [9, 10, 11, 12] and has_more
+        page, has_more = history.before(page[0]["id"], 4)
+        assert [m["id"] for m in page] == [5, 6, 7, 8] and has_more
+        page, has_more = history.before(page[0]["id"], 4)
+        assert [m["id"] for m in page] == [1, 2, 3, 4] and not has_more
+
+    def test_history_survives_restart(self, store):
+        post(ChatHistory(store), 3)
+
+        history = ChatHistory(store)
+        message = history.append({"username": "bob", "message": "back"})
+        assert message["id"] == 4
+        assert [m["message"] for m in history.recent(2)[0]] == ["m2", "back"]
+
+    def test_cache_is_bounded(self, store):
+        history = ChatHistory(store, cache_size=5)
+        post(history, 50)
+        assert len(history._recent) == 5
+
+
+class TestJsonLinesJournal:
+    """Test the append-only file used by the JSON backend."""
+
+    def test_partial_record_is_discarded(self, temp_dir):
+        path = os.path.join(temp_dir, "chat.jsonl")
+        journal = JsonLinesJournal(path)
+        journal.append({"message": "a"})
+        with open(path, "a") as f:
+            f.write('{"message": "trunc')
+
+        journal = JsonLinesJournal(path)
+        assert journal.append({"message": "b"}) == 2
+        assert [r["message"] for r in journal.read()] == ["a", "b"]
+
+    def test_read_spans_chunks(self, temp_dir):
+        journal = JsonLinesJournal(os.path.join(temp_dir, "chat.jsonl"))
+        journal.CHUNK_SIZE = 64
+        for i in range(100):
+            journal.append({"message": "x" * 20})
+
+        assert [r["id"] for r in journal.read(before=50, limit=10)] == list(
+            range(40, 50)
+        )
+        assert [r["id"] for r in journal.read(limit=3)] == [98, 99, 100]
+
+
+class TestChatHistoryEvents:
+    """Test history delivery over the chat namespace."""
+
+    def test_connect_sends_recent_page_and_history_pages(self, app):
+        sender = socketio.test_client(app, namespace="/chat")
+        for i in range(25):
+            sender.emit(
+                "chat_message",
+                {"username": "alice", "message": f"m{i}"},
+                namespace="/chat",
+            )
+
+        client = socketio.test_client(app, namespace="/chat")
+        history = [
+            msg["args"][0]
+            for msg in client.get_received("/chat")
+            if msg["name"] == "chat_history"
+        ][0]
+        assert len(history["messages"]) == 20 and history["has_more"]
+
+        older = client.emit(
+            "chat_history",
+            {"before_id": history["messages"][0]["id"]},
+            namespace="/chat",
+            callback=True,
+        )
+        assert [m["message"] for m in older["messages"]] == [f"m{i}" for i in range(5)]
+        assert not older["has_more"]
@@ -0,0 +1,147 @@
+"""
+Tests for content-defined chunking and the chunk store.
+"""
+import io
+import os
+import random
+
+import pytest
+
+import app as fileshare
+from chunk_store import MAX_SIZE, MIN_SIZE, Chunker, ChunkStore
+from state_store import JsonFileStore, SharedDict
+
+
+def random_bytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+@pytest.fixture
+def store(temp_dir):
+    return ChunkStore(
+        os.path.join(temp_dir, "store"), SharedDict(JsonFileStore({}), "chunks")
+    )
+
+
+def write(temp_dir, name, content):
+    path = os.path.join(temp_dir, name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+class TestChunker:
+    """Test chunk boundaries."""
+
+    def test_chunks_cover_the_stream(self):
+        data = random_bytes(300000)
+        chunks = list(Chunker().chunks(io.BytesIO(data)))
+
+        assert b"".join(chunks) == data
+        assert all(MIN_SIZE <= len(chunk) <= MAX_SIZE for chunk in chunks[:-1])
+
+    def test_edit_only_changes_nearby_chunks(self):
+        data = random_bytes(500000)
+        edited = data[:250000] + b"inserted bytes" + data[250000:]
+
+        original = set(Chunker().chunks(io.BytesIO(data)))
+        changed = list(Chunker().chunks(io.BytesIO(edited)))
+        new = [chunk for chunk in changed if chunk not in original]
+        assert len(new) <= 2
+        assert sum(len(chunk) for chunk in new) < 2 * MAX_SIZE
+
+
+class TestChunkStore:
+    """Test storage, reassembly and garbage collection."""
+
+    def test_put_and_read_back(self, store, temp_dir):
+        data = random_bytes(200000)
+        path = write(temp_dir, "a.bin", data)
+        _, digest = store.put(path)
+
+        assert os.path.getsize(path) < 100  # replaced by a pointer
+        with store.open(digest) as f:
+            assert f.read() == data
+            f.seek(123456)
+            assert f.read(1000) == data[123456:124456]
+            f.seek(-10, io.SEEK_END)
+            assert f.read() == data[-10:]
+
+    def test_similar_files_share_chunks(self, store, temp_dir):
+        data = random_bytes(400000)
+        store.put(write(temp_dir, "v1.xlsx", data))
+        store.put(write(temp_dir, "v2.xlsx", data[:1000] + b"edit" + data[1000:]))
+
+        stats = store.stats()
+        assert stats["logical_bytes"] == 2 * len(data) + 4
+        assert stats["stored_bytes"] < len(data) + 2 * MAX_SIZE
+
+    def test_gc_reclaims_released_content(self, store, temp_dir):
+        shared = random_bytes(100000, seed=1)
+        _, first = store.put(write(temp_dir, "a.bin", shared + random_bytes(50000)))
+        _, second = store.put(write(temp_dir, "b.bin", shared))
+
+        store.release(first)
+        assert store.gc() == (0, 0)  # still within the grace period
+        removed, reclaimed = store.gc(grace=-1)
+        assert removed == 1 and 0 < reclaimed < 100000
+        with store.open(second) as f:
+            assert f.read() == shared
+
+        store.release(second)
+        store.gc(grace=-1)
+        assert dict(store.index) == {}
+        for directory, _, filenames in os.walk(store.root):
+            assert filenames == []
+
+    def test_gc_keeps_content_of_uploads_in_progress(self, store, temp_dir):
+        data = random_bytes(50000)
+        path = write(temp_dir, "a.bin", data)
+        _, digest = store.put(path)
+
+        # Stored, but the file metadata is not written yet
+        assert store.gc(references={}) == (0, 0)
+        assert store.index[f"file:{digest}"]["refs"] == 0
+
+        assert store.gc(references={digest: 1}, grace=-1) == (0, 0)
+        assert store.index[f"file:{digest}"]["refs"] == 1
+        with store.open(digest) as f:
+            assert f.read() == data
+
+
+class TestChunkedStorageMode:
+    """Test uploads and downloads with STORAGE_MODE = "chunked"."""
+
+    @pytest.fixture(autouse=True)
+    def chunked(self, app):
+        app.config["STORAGE_MODE"] = "chunked"
+
+    def upload(self, client, name, content):
+        return client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(content), name)},
+            content_type="multipart/form-data",
+        )
+
+    def test_download_reassembles_with_ranges(self, auth_client):
+        data = random_bytes(150000)
+        self.upload(auth_client, "archive.zip", data)
+        assert fileshare.files_metadata["archive.zip"]["storage"] == "chunked"
+
+        response = auth_client.get("/api/download/archive.zip")
+        assert response.data == data
+
+        response = auth_client.get(
+            "/api/download/archive.zip", headers={"Range": "bytes=70000-70099"}
+        )
+        assert response.status_code == 206
+        assert response.data == data[70000:70100]
+        assert response.headers["Content-Range"] == "bytes 70000-70099/150000"
+
+    def test_delete_and_collect(self, auth_client):
+        self.upload(auth_client, "data.txt", b"hello chunks")
+        digest = fileshare.files_metadata["data.txt"]["sha256"]
+
+        auth_client.delete("/api/delete/data.txt")
+        assert fileshare.collect_chunks() == (1, 12)
+        assert f"file:{digest}" not in fileshare.chunks
@@ -0,0 +1,157 @@
+"""
+Tests for at-rest compression.
+"""
+import io
+import os
+import random
+
+import pytest
+
+import app as fileshare
+from compression import (
+    CODECS,
+    FRAME_SIZE,
+    FramedFile,
+    choose_codec,
+    codec_for_type,
+    compress_stream,
+    open_framed,
+)
+from object_store import LocalBackend, ObjectStore
+from state_store import JsonFileStore, SharedDict
+
+TEXT = b"date,region,amount\n2024-01-01,north,1200\n" * 20000
+
+
+def random_bytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def write(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+class TestCodecChoice:
+    """Test the MIME type and entropy checks."""
+
+    def test_codec_per_type(self):
+        assert codec_for_type("text/csv") == ("zstd" if "zstd" in CODECS else "zlib")
+        assert codec_for_type("application/vnd.ms-excel") == "zlib"
+        assert codec_for_type("image/jpeg") is None
+        assert codec_for_type("application/zip") is None
+        assert codec_for_type(None) is None
+
+    def test_entropy_check_skips_incompressible_data(self, temp_dir):
+        text = write(os.path.join(temp_dir, "a.txt"), TEXT)
+        noise = write(os.path.join(temp_dir, "b.txt"), random_bytes(100000))
+        small = write(os.path.join(temp_dir, "c.txt"), b"tiny")
+
+        assert choose_codec("text/plain", text) is not None
+        assert choose_codec("text/plain", noise) is None
+        assert choose_codec("text/plain", small) is None
+        assert choose_codec("image/png", text) is None
+
+
+class TestFramedFormat:
+    """Test compressing and reading frames."""
+
+    def compress(self, content, codec="zlib"):
+        packed = io.BytesIO()
+        size, stored = compress_stream(io.BytesIO(content), packed, codec)
+        assert size == len(content)
+        assert stored == len(packed.getvalue())
+        packed.seek(0)
+        return packed
+
+    @pytest.mark.parametrize("codec", sorted(CODECS))
+    def test_round_trip(self, codec):
+        packed = self.compress(TEXT, codec)
+        assert len(packed.getvalue()) < len(TEXT) // 5
+        with open_framed(packed) as f:
+            assert f.read() == TEXT
+
+    def test_seek_reads_only_needed_frames(self):
+        raw = FramedFile(self.compress(TEXT))
+        raw.seek(FRAME_SIZE * 2 + 5)
+        assert raw.read(14) == TEXT[FRAME_SIZE * 2 + 5 : FRAME_SIZE * 2 + 19]
+        assert raw._current[0] == 2
+        raw.seek(-4, io.SEEK_END)
+        assert raw.read(10) == TEXT[-4:]
+        assert raw.read(10) == b""
+
+    def test_incompressible_frames_are_stored_as_is(self):
+        content = random_bytes(FRAME_SIZE + 100)
+        packed = self.compress(content)
+        assert len(packed.getvalue()) < len(content) + 200
+        with open_framed(packed) as f:
+            assert f.read() == content
+
+    def test_empty_content(self):
+        with open_framed(self.compress(b"")) as f:
+            assert f.read() == b""
+
+    def test_rejects_other_content(self):
+        with pytest.raises(ValueError):
+            FramedFile(io.BytesIO(b"plain content, not framed"))
+
+
+class TestCompressedObjects:
+    """Test compressed objects in the object store."""
+
+    def test_put_compressed(self, temp_dir):
+        store = ObjectStore(
+            LocalBackend(os.path.join(temp_dir, "objects")),
+            SharedDict(JsonFileStore({}), "objects"),
+        )
+        path = write(os.path.join(temp_dir, "a.csv"), TEXT)
+        _, digest = store.put(path, codec="zlib")
+
+        entry = store.index[digest]
+        assert entry["size"] == len(TEXT)
+        assert entry["codec"] == "zlib"
+        assert store.backend.stat(digest)["size"] == entry["stored_size"]
+        assert entry["stored_size"] < len(TEXT) // 5
+        with store.open(digest) as f:
+            f.seek(len(TEXT) - 10)
+            assert f.read() == TEXT[-10:]
+
+
+class TestCompressionUploads:
+    """Test compression of uploads through the app."""
+
+    @pytest.fixture(autouse=True)
+    def compression(self, app):
+        app.config["COMPRESSION"] = True
+        yield
+        app.config["COMPRESSION"] = False
+
+    def upload(self, auth_client, content, filename):
+        return auth_client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(content), filename), "folder_path": "docs"},
+            content_type="multipart/form-data",
+        )
+
+    def test_compressible_upload(self, auth_client):
+        self.upload(auth_client, TEXT, "sales.txt")
+        metadata = fileshare.files_metadata["docs/sales.txt"]
+        digest = metadata["sha256"]
+
+        assert metadata["storage"] == "object"
+        assert metadata["size"] == len(TEXT)
+        assert fileshare.objects[digest]["stored_size"] < len(TEXT) // 5
+
+        token = fileshare.find_share_token("sales.txt", "docs")
+        response = auth_client.get(f"/share/{token}")
+        assert response.data == TEXT
+        response = auth_client.get(
+            f"/share/{token}", headers={"Range": "bytes=300000-300017"}
+        )
+        assert response.status_code == 206
+        assert response.data == TEXT[300000:300018]
+
+    def test_incompressible_upload_is_stored_as_is(self, auth_client):
+        self.upload(auth_client, random_bytes(50000), "noise.txt")
+        assert fileshare.files_metadata["docs/noise.txt"]["storage"] == "file"
@@ -0,0 +1,219 @@
+"""
+Tests for the full-text content index.
+"""
+import io
+import os
+import zipfile
+
+import pytest
+
+import app as fileshare
+from change_feed import ChangeFeed
+from content_index import ContentIndex, extract_text
+from state_store import JsonFileStore
+
+DOCX_XML = (
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/'
+    'wordprocessingml/2006/main"><w:body>'
+    "<w:p><w:r><w:t>Quarterly revenue</w:t></w:r></w:p>"
+    "<w:p><w:r><w:t>grew in Europe</w:t></w:r></w:p>"
+    "</w:body></w:document>"
+)
+XLSX_STRINGS = (
+    '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    "<si><t>Warehouse</t></si><si><t>inventory</t></si></sst>"
+)
+
+
+def write_zip(path, parts):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data in parts.items():
+            zf.writestr(name, data)
+
+
+class Library:
+    """Files on disk plus a change feed, as the application records them."""
+
+    def __init__(self, root):
+        self.root = root
+        self.files = {}
+        self.feed = ChangeFeed(JsonFileStore({}))
+        os.makedirs(os.path.join(root, "files"))
+
+    def path(self, file_key):
+        return os.path.join(self.root, "files", file_key)
+
+    def add(self, file_key, text, md5=None):
+        with open(self.path(file_key), "w") as f:
+            f.write(text)
+        self.files[file_key] = {"md5": md5 or str(hash(text))}
+        self.feed.record("file", file_key, file_key, "uploaded", self.files[file_key])
+
+    def delete(self, file_key):
+        os.remove(self.path(file_key))
+        del self.files[file_key]
+        self.feed.record("file", file_key, file_key, "deleted")
+
+    def index(self, **kwargs):
+        return ContentIndex(
+            os.path.join(self.root, "index"),
+            feed=self.feed,
+            resolve_path=self.path,
+            list_files=lambda: dict(self.files),
+            **kwargs,
+        )
+
+
+@pytest.fixture
+def library(temp_dir):
+    return Library(temp_dir)
+
+
+def found(index, query):
+    return [file_key for file_key, _ in index.search(query, limit=50)[1]]
+
+
+class TestExtraction:
+    """Test text extraction from supported formats."""
+
+    def test_docx_and_xlsx(self, temp_dir):
+        docx = os.path.join(temp_dir, "report.docx")
+        write_zip(docx, {"word/document.xml": DOCX_XML})
+        xlsx = os.path.join(temp_dir, "stock.xlsx")
+        write_zip(xlsx, {"xl/sharedStrings.xml": XLSX_STRINGS})
+
+        assert "Quarterly revenue" in extract_text(docx)
+        assert "grew in Europe" in extract_text(docx)
+        assert "inventory" in extract_text(xlsx)
+
+    def test_broken_and_unsupported_files(self, temp_dir):
+        broken = os.path.join(temp_dir, "broken.docx")
+        with open(broken, "wb") as f:
+            f.write(b"not a zip")
+        assert extract_text(broken) == ""
+        assert extract_text(os.path.join(temp_dir, "image.png")) == ""
+
+
+class TestContentIndex:
+    """Test ingest, ranking, deletes and segment merging."""
+
+    def test_search_ranks_with_bm25(self, library):
+        library.add("a.txt", "apple banana cherry")
+        library.add("b.txt", "apple apple apple banana")
+        library.add("c.txt", "durian")
+        index = library.index()
+        index.sync()
+
+        assert found(index, "apple") == ["b.txt", "a.txt"]
+        assert sorted(found(index, "cherry durian")) == ["a.txt", "c.txt"]
+        assert found(index, "missing") == []
+
+    def test_deletes_and_updates(self, library):
+        library.add("a.txt", "apple")
+        index = library.index()
+        index.sync()
+
+        library.add("a.txt", "banana", md5="changed")
+        index.sync()
+        assert found(index, "apple") == []
+        assert found(index, "banana") == ["a.txt"]
+
+        library.delete("a.txt")
+        index.sync()
+        assert found(index, "banana") == []
+
+    def test_segments_are_merged(self, library):
+        index = library.index(max_segments=3, merge_factor=3)
+        for i in range(10):
+            library.add(f"f{i}.txt", f"common word{i}")
+            index.sync()
+
+        index.refresh()
+        assert len(index._segments) <= 3
+        assert len(found(index, "common")) == 10
+        assert found(index, "word7") == ["f7.txt"]
+        segment_files = [
+            name for name in os.listdir(index.directory) if name.endswith(".json")
+        ]
+        assert len(segment_files) == len(index._segments) + 1  # + manifest
+
+    def test_ingest_resumes_and_other_readers_see_it(self, library):
+        library.add("a.txt", "apple")
+        library.index().sync()
+        library.add("b.txt", "apple")
+
+        # A new instance (restart) continues from the recorded feed position
+        writer = library.index()
+        assert writer.sync() == 1
+        reader = library.index()
+        assert sorted(found(reader, "apple")) == ["a.txt", "b.txt"]
+
+    def test_rebuild_when_feed_was_trimmed(self, library):
+        index = library.index()
+        library.add("a.txt", "apple")
+        index.sync()
+
+        # The changes for b.txt are trimmed before the index sees them
+        library.add("b.txt", "apple")
+        library.add("c.txt", "cherry")
+        library.feed.store.log_trim(library.feed.log, 1)
+        index.sync()
+        assert sorted(found(index, "apple")) == ["a.txt", "b.txt"]
+        assert found(index, "cherry") == ["c.txt"]
+
+    def test_snippet_highlights_terms(self, library):
+        index = library.index()
+        library.add("a.txt", "The <quick> brown fox jumps over the lazy dog")
+        index.sync()
+        snippet = index.snippet("a.txt", "fox")
+        assert "<mark>fox</mark>" in snippet
+        assert "&lt;quick&gt;" in snippet
+
+    def test_snippets_come_from_the_index(self, library):
+        index = library.index(batch_size=1, max_segments=1, merge_factor=2)
+        library.add("a.txt", "alpha\n\n  beta gamma")
+        library.add("b.txt", "delta epsilon")
+        index.sync()
+        index.refresh()
+        assert len(index._segments) == 1  # Merged
+
+        # Queries do not read the files
+        os.remove(library.path("a.txt"))
+        assert index.snippet("a.txt", "beta") == "alpha <mark>beta</mark> gamma"
+        assert index.snippet("b.txt", "delta") == "<mark>delta</mark> epsilon"
+        assert index.snippet("c.txt", "delta") == ""
+
+
+class TestContentSearchEndpoint:
+    """Test /api/search/content."""
+
+    def test_uploaded_documents_are_searchable(self, auth_client):
+        auth_client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(b"the zebra crossing"), "notes.txt")},
+            content_type="multipart/form-data",
+        )
+        fileshare.content_index.sync()
+
+        data = auth_client.get("/api/search/content?q=zebra").get_json()
+        assert data["total"] == 1
+        assert data["results"][0]["path"] == "notes.txt"
+        assert "<mark>zebra</mark>" in data["results"][0]["snippet"]
+
+    def test_files_in_sanitized_folders(self, auth_client):
+        auth_client.post(
+            "/api/upload",
+            data={
+                "file": (io.BytesIO(b"the zebra crossing"), "notes.txt"),
+                "folder_path": "My Folder",
+            },
+            content_type="multipart/form-data",
+        )
+        fileshare.content_index.sync()
+
+        data = auth_client.get("/api/search/content?q=zebra").get_json()
+        assert data["total"] == 1
+        assert "<mark>zebra</mark>" in data["results"][0]["snippet"]
+
+    def test_requires_login(self, client):
+        assert client.get("/api/search/content?q=x").status_code == 302
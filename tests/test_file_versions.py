@@ -0,0 +1,115 @@
+"""
+Tests for file versioning.
+"""
+import io
+
+import pytest
+
+import app as fileshare
+from file_versions import FileVersions
+from state_store import JsonFileStore, SharedDict
+
+
+def upload(client, name, content):
+    return client.post(
+        "/api/upload",
+        data={"file": (io.BytesIO(content), name)},
+        content_type="multipart/form-data",
+    )
+
+
+class TestFileVersions:
+    """Test version records and retention."""
+
+    @pytest.fixture
+    def versions(self):
+        return FileVersions(SharedDict(JsonFileStore({}), "versions"))
+
+    def test_archive_numbers_versions_and_keeps_last_k(self, versions):
+        assert versions.current_version("a.txt") == 1
+        for number in range(3):
+            dropped = versions.archive("a.txt", {"md5": f"v{number + 1}"}, keep=2)
+        assert [entry["md5"] for entry in dropped] == ["v1"]
+        assert versions.current_version("a.txt") == 4
+        assert [entry["version"] for entry in versions.archived("a.txt")] == [2, 3]
+        assert versions.get("a.txt", 3)["md5"] == "v3"
+
+    def test_archive_update_retried(self, versions):
+        versions.archive("a.txt", {"md5": "v1"}, keep=1)
+        update_item = versions.index.update_item
+
+        def retried(key, func):
+            # A shared store calls the function again after a conflict
+            func(versions.index.get(key))
+            return update_item(key, func)
+
+        versions.index.update_item = retried
+        dropped = versions.archive("a.txt", {"md5": "v2"}, keep=1)
+        assert [entry["md5"] for entry in dropped] == ["v1"]
+
+    def test_listing_and_remove(self, versions):
+        versions.archive("a.txt", {"md5": "old"}, keep=5)
+        listing = versions.listing("a.txt", {"md5": "new"})
+        assert [(entry["version"], entry["current"]) for entry in listing] == [
+            (2, True),
+            (1, False),
+        ]
+        assert [entry["md5"] for entry in versions.remove("a.txt")] == ["old"]
+        assert versions.current_version("a.txt") == 1
+
+
+class TestVersioningMode:
+    """Test uploads, downloads and share links with FILE_VERSIONING on."""
+
+    @pytest.fixture(autouse=True)
+    def versioning(self, app):
+        app.config["FILE_VERSIONING"] = True
+        app.config["MAX_FILE_VERSIONS"] = 2
+
+    def test_reupload_creates_version(self, auth_client):
+        for content in (b"one", b"two", b"three", b"four"):
+            upload(auth_client, "notes.txt", content)
+
+        assert list(fileshare.files_metadata) == ["notes.txt"]
+        data = auth_client.get("/api/versions/notes.txt").get_json()
+        assert data["current_version"] == 4
+        assert [entry["version"] for entry in data["versions"]] == [4, 3, 2]
+
+        assert auth_client.get("/api/download/notes.txt").data == b"four"
+        assert auth_client.get("/api/download/notes.txt?version=2").data == b"two"
+        response = auth_client.get("/api/download/notes.txt?version=1")
+        assert response.status_code == 404
+
+        # The content of the dropped version is reclaimed
+        assert fileshare.collect_blobs() == (1, 3)
+
+    def test_share_links_latest_and_pinned(self, auth_client):
+        upload(auth_client, "logo.txt", b"first")
+        pinned = auth_client.post(
+            "/api/generate-share-link/logo.txt", json={"version": 1}
+        ).get_json()["share_link"]
+        latest = auth_client.post(
+            "/api/generate-share-link/logo.txt", json={}
+        ).get_json()["share_link"]
+        upload(auth_client, "logo.txt", b"second")
+
+        assert auth_client.get(pinned).data == b"first"
+        assert auth_client.get(latest).data == b"second"
+        response = auth_client.post(
+            "/api/generate-share-link/logo.txt", json={"version": 7}
+        )
+        assert response.status_code == 404
+
+    def test_delete_releases_all_versions(self, auth_client):
+        upload(auth_client, "a.txt", b"old")
+        upload(auth_client, "a.txt", b"new")
+        auth_client.delete("/api/delete/a.txt")
+
+        assert "a.txt" not in fileshare.versions
+        assert fileshare.collect_blobs() == (2, 6)
+
+    def test_suffix_naming_without_versioning(self, app, auth_client):
+        app.config["FILE_VERSIONING"] = False
+        upload(auth_client, "a.txt", b"old")
+        upload(auth_client, "a.txt", b"new")
+        assert sorted(fileshare.files_metadata) == ["a.txt", "a_1.txt"]
@@ -0,0 +1,179 @@
+"""
+Tests for the metadata query API and its secondary indexes.
+"""
+import io
+
+import pytest
+
+from app import api_keys
+from metadata_index import FileTotals, MetadataIndex, ShareTokenIndex, parse_query
+
+
+@pytest.fixture
+def index():
+    index = MetadataIndex()
+    index.apply(
+        {
+            "docs/report.pdf": {
+                "size": 5000,
+                "upload_date": "2024-01-10T09:00:00",
+                "downloads": 12,
+                "uploaded_by": "alice",
+            },
+            "docs/2024/notes.txt": {
+                "size": 300,
+                "upload_date": "2024-02-01T12:00:00",
+                "downloads": 0,
+                "api_upload": True,
+                "uploaded_by": "reporting",
+            },
+            "images/logo.png": {
+                "size": 800,
+                "upload_date": "2024-03-05T08:30:00",
+                "downloads": 3,
+                "chat_upload": True,
+                "uploaded_by": "bob",
+            },
+        },
+        reset=True,
+    )
+    return index
+
+
+def keys(index, **kwargs):
+    return index.query(**kwargs)["file_keys"]
+
+
+class TestMetadataIndex:
+    """Test filters, ordering, paging and facets."""
+
+    def test_default_order_is_newest_first(self, index):
+        assert keys(index) == [
+            "images/logo.png",
+            "docs/2024/notes.txt",
+            "docs/report.pdf",
+        ]
+
+    def test_range_filters_are_inclusive(self, index):
+        assert keys(index, size=(300, 800), sort="size", descending=False) == [
+            "docs/2024/notes.txt",
+            "images/logo.png",
+        ]
+        assert keys(index, upload_date=("2024-02-01T12:00:00", None)) == [
+            "images/logo.png",
+            "docs/2024/notes.txt",
+        ]
+        assert keys(index, downloads=(1, None), sort="downloads") == [
+            "docs/report.pdf",
+            "images/logo.png",
+        ]
+
+    def test_hash_filters(self, index):
+        assert keys(index, mime_types=["image/*"]) == ["images/logo.png"]
+        assert keys(
+            index, uploaders=["alice", "bob"], sort="name", descending=False
+        ) == [
+            "images/logo.png",
+            "docs/report.pdf",
+        ]
+        assert keys(index, sources=["api"]) == ["docs/2024/notes.txt"]
+
+    def test_folder_filter(self, index):
+        assert keys(index, folder_path="docs", recursive=False) == ["docs/report.pdf"]
+        assert len(keys(index, folder_path="docs")) == 2
+
+    def test_combined_filters_and_facets(self, index):
+        result = index.query(
+            folder_path="docs", size=(None, 1000), facets=["source", "mime_type"]
+        )
+        assert result["file_keys"] == ["docs/2024/notes.txt"]
+        assert result["facets"] == {
+            "source": {"api": 1},
+            "mime_type": {"text/plain": 1},
+        }
+
+    def test_paging(self, index):
+        result = index.query(offset=1, limit=1)
+        assert result["total"] == 3
+        assert result["file_keys"] == ["docs/2024/notes.txt"]
+
+    def test_updates_move_entries(self, index):
+        index.apply({"images/logo.png": None, "docs/report.pdf": {"size": 1}})
+        assert keys(index, size=(None, 10)) == ["docs/report.pdf"]
+        assert "images/logo.png" not in keys(index)
+
+    def test_parse_query_validation(self):
+        with pytest.raises(ValueError):
+            parse_query({"min_size": "big"})
+        with pytest.raises(ValueError):
+            parse_query({"uploaded_after": "yesterday"})
+        with pytest.raises(ValueError):
+            parse_query({"sort": "md5"})
+        query = parse_query(
+            {"page": "3", "per_page": "10", "mime": "image/*,text/plain"}
+        )
+        assert query["offset"] == 20 and query["limit"] == 10
+        assert query["mime_types"] == ["image/*", "text/plain"]
+
+
+class TestQueryEndpoints:
+    """Test /api/files/query and /api/v1/files/query."""
+
+    def upload(self, client, name, content=b"data"):
+        client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(content), name)},
+            content_type="multipart/form-data",
+        )
+
+    def test_query_with_facets(self, auth_client):
+        self.upload(auth_client, "small.txt", b"x")
+        self.upload(auth_client, "large.txt", b"x" * 1000)
+
+        data = auth_client.get(
+            "/api/files/query?min_size=100&facets=uploader,mime_type"
+        ).get_json()
+        assert [f["name"] for f in data["files"]] == ["large.txt"]
+        assert data["facets"]["uploader"] == {"admin": 1}
+
+    def test_invalid_parameters(self, auth_client):
+        response = auth_client.get("/api/files/query?max_size=abc")
+        assert response.status_code == 400
+        assert "max_size" in response.get_json()["error"]
+
+    def test_v1_query(self, auth_client):
+        self.upload(auth_client, "a.txt")
+        api_keys["test-key"] = {"name": "test", "created_at": "", "usage_count": 0}
+
+        data = auth_client.get(
+            "/api/v1/files/query?source=web", headers={"X-API-Key": "test-key"}
+        ).get_json()
+        assert data["success"] and data["total"] == 1
+        assert data["files"][0]["filename"] == "a.txt"
+
+
+class TestDerivedIndexes:
+    """Test the stats totals and the share token index."""
+
+    def test_file_totals(self):
+        totals = FileTotals()
+        totals.apply({"a.txt": {"size": 10, "downloads": 1}}, reset=True)
+        totals.apply({"b.txt": {"size": 5}})
+        totals.apply({"a.txt": {"size": 10, "downloads": 3}})
+        assert totals.totals() == {"files": 2, "bytes": 15, "downloads": 3}
+        totals.apply({"a.txt": None})
+        assert totals.totals() == {"files": 1, "bytes": 5, "downloads": 0}
+
+    def test_share_token_index(self):
+        tokens = ShareTokenIndex()
+        link = {"filename": "a.txt", "folder_path": "docs", "version": None}
+        tokens.apply({"t1": link, "t2": dict(link, version=2)}, reset=True)
+        tokens.apply({"t3": link})
+        assert tokens.lookup("a.txt", "docs") == "t1"
+        assert tokens.lookup("a.txt", "") is None
+        tokens.apply({"t1": None})
+        assert tokens.lookup("a.txt", "docs") == "t3"
+        assert tokens.file_tokens("a.txt", "docs") == ["t2", "t3"]
+        tokens.apply({}, reset=True)
+        assert tokens.lookup("a.txt", "docs") is None
+        assert tokens.file_tokens("a.txt", "docs") == []
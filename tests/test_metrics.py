@@ -0,0 +1,169 @@
+"""
+Tests for the metrics registry and the /metrics endpoint.
+"""
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+import app as fileshare
+from app import socketio
+from metrics import Registry
+
+
+class TestRegistry:
+    """Test counters, gauges, histograms and worker snapshots."""
+
+    def test_counter_and_gauge(self):
+        registry = Registry()
+        registry.counter("requests_total", "Requests")
+        registry.gauge("clients", "Clients")
+        registry.inc("requests_total", method="GET")
+        registry.inc("requests_total", 2, method="GET")
+        registry.inc("clients", 1)
+        registry.inc("clients", -1)
+
+        text = registry.render()
+        assert "# TYPE requests_total counter" in text
+        assert 'requests_total{method="GET"} 3' in text
+        assert "clients 0" in text
+
+    def test_histogram_buckets(self):
+        registry = Registry()
+        registry.histogram("latency", "Latency", buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            registry.observe("latency", value, route="/")
+
+        text = registry.render()
+        assert 'latency_bucket{route="/",le="0.1"} 2' in text
+        assert 'latency_bucket{route="/",le="1"} 3' in text
+        assert 'latency_bucket{route="/",le="+Inf"} 4' in text
+        assert 'latency_sum{route="/"} 3.65' in text
+        assert 'latency_count{route="/"} 4' in text
+
+    def test_timed_and_folding(self):
+        registry = Registry(fold_at=2)
+        registry.histogram("work", "Work", buckets=(60,))
+
+        @registry.timed("work", operation="decorated")
+        def work():
+            return 42
+
+        assert work() == 42
+        with registry.timed("work", operation="block"):
+            pass
+        work()
+        # The recording thread folded the first events
+        assert len(registry._events) < 3
+        assert 'work_count{operation="decorated"} 2' in registry.render()
+
+    def test_callback_gauge(self):
+        registry = Registry()
+        registry.gauge("entries", "Entries", lambda: {"files": 2, "users": 1}, "kind")
+        text = registry.render()
+        assert 'entries{kind="files"} 2' in text
+        assert 'entries{kind="users"} 1' in text
+
+    def test_snapshots_are_added_up(self):
+        worker, other = Registry(), Registry()
+        for registry in (worker, other):
+            registry.counter("bytes_total", "Bytes")
+            registry.histogram("latency", "Latency", buckets=(1,))
+        worker.inc("bytes_total", 10)
+        other.inc("bytes_total", 5)
+        other.observe("latency", 0.5)
+
+        # Snapshots are written to and read from JSON files
+        snapshot = json.loads(json.dumps(other.snapshot()))
+        text = worker.render([snapshot])
+        assert "bytes_total 15" in text
+        assert 'latency_bucket{le="1"} 1' in text
+        assert "latency_count 1" in text
+
+
+class TestMetricsEndpoint:
+    """Test the metrics of the app."""
+
+    def upload(self, auth_client, content, filename="data.txt"):
+        return auth_client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(content), filename), "folder_path": "docs"},
+            content_type="multipart/form-data",
+        )
+
+    def value(self, text, series):
+        for line in text.splitlines():
+            if line.startswith(series + " "):
+                return float(line.split()[-1])
+        return 0
+
+    def test_requests_and_transfers(self, auth_client):
+        before = auth_client.get("/metrics").get_data(as_text=True)
+        self.upload(auth_client, b"x" * 1000)
+        auth_client.get("/api/download/docs/data.txt")
+        response = auth_client.get("/metrics")
+        assert response.mimetype == "text/plain"
+        text = response.get_data(as_text=True)
+
+        for name, delta in (
+            ("fileshare_upload_bytes_total", 1000),
+            ("fileshare_download_bytes_total", 1000),
+        ):
+            assert self.value(text, name) - self.value(before, name) == delta
+        count = (
+            "fileshare_request_duration_seconds_count"
+            '{method="POST",route="/api/upload",status="200"}'
+        )
+        assert self.value(text, count) - self.value(before, count) == 1
+        for operation in ("save_metadata", "hash", "store_content"):
+            assert (
+                f'fileshare_operation_duration_seconds_count{{operation="{operation}"}}'
+                in text
+            )
+        assert 'fileshare_metadata_entries{kind="files"} 1' in text
+        assert 'fileshare_pending_jobs{job="uploads_in_flight"} 0' in text
+
+    def test_socketio_clients(self, app, auth_client):
+        series = 'fileshare_socketio_clients{namespace="/"}'
+        before = self.value(fileshare.metrics.render(), series)
+        sio_client = socketio.test_client(app, flask_test_client=auth_client)
+        assert self.value(fileshare.metrics.render(), series) == before + 1
+        sio_client.disconnect()
+        assert self.value(fileshare.metrics.render(), series) == before
+
+    def test_metrics_token(self, app, client):
+        app.config["METRICS_TOKEN"] = "secret"
+        assert client.get("/metrics").status_code == 401
+        response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+        assert response.status_code == 200
+
+    def test_worker_snapshots(self, app, client, monkeypatch):
+        monkeypatch.setenv("FILESHARE_WORKER_ID", "0")
+        other = Registry()
+        other.counter("fileshare_download_bytes_total", "Bytes")
+        other.inc("fileshare_download_bytes_total", 12345)
+        os.makedirs(fileshare.metrics_dir())
+
+        def write(name, pid):
+            path = os.path.join(fileshare.metrics_dir(), name)
+            with open(path, "w") as f:
+                json.dump({"pid": pid, "metrics": other.snapshot()}, f)
+            return path
+
+        # A live worker, a worker that exited and a worker that stopped
+        # writing snapshots
+        write("worker-1.json", os.getppid())
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        write("worker-2.json", dead.pid)
+        stale = write("worker-3.json", os.getppid())
+        os.utime(stale, (time.time() - 3600, time.time() - 3600))
+        fileshare.write_metrics_snapshot()
+
+        text = client.get("/metrics").get_data(as_text=True)
+        expected = self.value(
+            fileshare.metrics.render(), "fileshare_download_bytes_total"
+        )
+        assert self.value(text, "fileshare_download_bytes_total") == expected + 12345
@@ -0,0 +1,274 @@
+"""
+Tests for the storage backends, the object store and object migration.
+"""
+import hashlib
+import io
+import os
+
+import pytest
+
+import app as fileshare
+from object_store import LocalBackend, ObjectStore, create_backend, migrate
+from state_store import JsonFileStore, SharedDict
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def check_backend(backend, temp_dir):
+    """Exercise the backend interface"""
+    source = write(os.path.join(temp_dir, "src", "a.bin"), b"0123456789")
+    backend.put("abcdef", source)
+    backend.put_stream("fedcba", io.BytesIO(b"streamed"))
+
+    assert backend.stat("abcdef") == {"size": 10}
+    assert backend.stat("missing") is None
+    assert backend.read_range("abcdef", 2, 5) == b"234"
+    with backend.open("abcdef") as f:
+        f.seek(7)
+        assert f.read() == b"789"
+    assert sorted(backend.keys()) == ["abcdef", "fedcba"]
+
+    backend.delete("abcdef")
+    backend.delete("abcdef")
+    assert backend.stat("abcdef") is None
+
+
+class TestBackends:
+    """Test the local layouts and the S3 backend."""
+
+    def test_sharded_layout(self, temp_dir):
+        backend = create_backend(f"sharded://{temp_dir}/objects")
+        check_backend(backend, temp_dir)
+        assert backend.path("fedcba") == os.path.join(
+            temp_dir, "objects", "fe", "dc", "fedcba"
+        )
+
+    def test_legacy_layout(self, temp_dir):
+        backend = create_backend(f"legacy://{temp_dir}/uploads")
+        check_backend(backend, temp_dir)
+        write(os.path.join(temp_dir, "uploads", "docs", "a.txt"), b"a")
+        assert "docs/a.txt" in set(backend.keys())
+
+    def test_compressed_layout(self, temp_dir):
+        backend = create_backend(f"compressed://{temp_dir}/archive")
+        check_backend(backend, temp_dir)
+        assert backend.path("fedcba").endswith(".fz")
+
+    def test_s3(self, temp_dir):
+        moto = pytest.importorskip("moto")
+        boto3 = pytest.importorskip("boto3")
+        mock = getattr(moto, "mock_aws", None) or moto.mock_s3
+        with mock():
+            boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="files")
+            backend = create_backend("s3://files/objects?region_name=us-east-1")
+            check_backend(backend, temp_dir)
+
+    def test_unknown_scheme(self):
+        with pytest.raises(ValueError):
+            create_backend("ftp://example.com/files")
+
+
+class TestObjectStore:
+    """Test reference counting, fallback reads and migration."""
+
+    @pytest.fixture
+    def store(self, temp_dir):
+        return ObjectStore(
+            LocalBackend(os.path.join(temp_dir, "objects")),
+            SharedDict(JsonFileStore({}), "objects"),
+        )
+
+    def test_identical_content_is_stored_once(self, store, temp_dir):
+        first = write(os.path.join(temp_dir, "a.txt"), b"same")
+        second = write(os.path.join(temp_dir, "b.txt"), b"same")
+        _, digest = store.put(first)
+        store.put(second)
+
+        assert list(store.backend.keys()) == [digest]
+        assert store.index[digest]["refs"] == 2
+        # The caller removes the uploads once their metadata is recorded
+        assert os.path.exists(first)
+        with store.open(digest) as f:
+            assert f.read() == b"same"
+
+        store.release(digest)
+        assert store.gc() == (0, 0)
+        store.release(digest)
+        assert store.gc() == (0, 0)  # still within the grace period
+        assert store.gc(grace=-1) == (1, 4)
+        assert list(store.backend.keys()) == []
+
+    def test_gc_keeps_objects_of_uploads_in_progress(self, store, temp_dir):
+        _, digest = store.put(write(os.path.join(temp_dir, "a.txt"), b"new"))
+
+        # Stored, but the file metadata is not written yet
+        assert store.gc(references={}) == (0, 0)
+        assert store.backend.stat(digest) == {"size": 3}
+
+        assert store.gc(references={digest: 1}, grace=-1) == (0, 0)
+        assert store.index[digest]["refs"] == 1
+
+    def test_migration_with_fallback_reads(self, store, temp_dir):
+        digests = [
+            store.put(write(os.path.join(temp_dir, f"{n}.txt"), b"x" * n))[1]
+            for n in range(1, 4)
+        ]
+        target = LocalBackend(os.path.join(temp_dir, "new"), sharded=True)
+        store.fallback, store.backend = store.backend, target
+
+        moved = []
+        result = migrate(
+            store.fallback,
+            target,
+            keys=digests[:1],
+            progress=lambda key, count, size: moved.append(key),
+        )
+        assert result == (1, 1)
+        assert moved == digests[:1]
+        # Moved and not yet moved objects are both readable
+        for n, digest in enumerate(digests, 1):
+            with store.open(digest) as f:
+                assert f.read() == b"x" * n
+
+        assert migrate(store.fallback, target) == (2, 5)
+        assert list(store.fallback.keys()) == []
+        assert sorted(target.keys()) == sorted(digests)
+
+    def test_migration_rekeys_legacy_objects(self, store, temp_dir):
+        uploads = os.path.join(temp_dir, "uploads")
+        write(os.path.join(uploads, "docs", "a.txt"), b"legacy content")
+        source = LocalBackend(uploads, sharded=False)
+
+        assert migrate(source, store.backend) == (1, 14)
+        digest = hashlib.sha256(b"legacy content").hexdigest()
+        assert list(store.backend.keys()) == [digest]
+        # Still served from the upload folder until it is adopted
+        assert list(source.keys()) == ["docs/a.txt"]
+
+        assert not store.adopt("0" * 64, 14)
+        assert store.adopt(digest, 14)
+        assert store.index[digest]["refs"] == 1
+        with store.open(digest) as f:
+            assert f.read() == b"legacy content"
+
+
+class TestObjectStorageMode:
+    """Test uploads and downloads with STORAGE_MODE=object."""
+
+    @pytest.fixture
+    def object_mode(self, app):
+        app.config["STORAGE_MODE"] = "object"
+        yield
+        app.config["STORAGE_MODE"] = "blob"
+
+    def upload(self, client, name, content):
+        return client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(content), name)},
+            content_type="multipart/form-data",
+        )
+
+    def test_upload_download_and_delete(self, auth_client, object_mode):
+        content = bytes(range(256)) * 100
+        self.upload(auth_client, "data.pdf", content)
+        metadata = fileshare.files_metadata["data.pdf"]
+        assert metadata["storage"] == "object"
+        digest = metadata["sha256"]
+        assert fileshare.object_store.backend.stat(digest) == {"size": len(content)}
+
+        response = auth_client.get("/api/download/data.pdf")
+        assert response.data == content
+        response = auth_client.get(
+            "/api/download/data.pdf", headers={"Range": "bytes=256-511"}
+        )
+        assert response.status_code == 206
+        assert response.data == bytes(range(256))
+
+        auth_client.delete("/api/delete/data.pdf")
+        assert fileshare.collect_objects() == (1, len(content))
+        assert fileshare.object_store.backend.stat(digest) is None
+
+    def test_no_entries_in_upload_folder(self, app, auth_client, object_mode):
+        self.upload(auth_client, "a.txt", b"first")
+        self.upload(auth_client, "a.txt", b"second")
+        auth_client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(b"notes"), "b.txt"), "folder_path": "docs"},
+            content_type="multipart/form-data",
+        )
+
+        assert sorted(fileshare.files_metadata) == ["a.txt", "a_1.txt", "docs/b.txt"]
+        for _, _, filenames in os.walk(app.config["UPLOAD_FOLDER"]):
+            assert filenames == []
+
+        # Folders are listed from the metadata too
+        os.rmdir(os.path.join(app.config["UPLOAD_FOLDER"], "docs"))
+        listing = auth_client.get("/api/files").get_json()
+        assert sorted(item["path"] for item in listing) == ["a.txt", "a_1.txt", "docs"]
+        folder = next(item for item in listing if item["type"] == "folder")
+        assert [child["name"] for child in folder["children"]] == ["b.txt"]
+        assert auth_client.get("/api/download/a_1.txt").data == b"second"
+
+        report = auth_client.get("/api/reconcile?refresh=true").get_json()
+        assert report["missing"] == [] and report["orphans"] == []
+        assert report["files_in_metadata"] == 3
+
+        response = auth_client.delete("/api/delete/docs/b.txt")
+        assert response.status_code == 200
+        assert "docs/b.txt" not in fileshare.files_metadata
+
+    def test_adopt_existing_files(self, auth_client, runner):
+        self.upload(auth_client, "old.txt", b"stored in the upload folder")
+        digest = fileshare.files_metadata["old.txt"]["sha256"]
+
+        result = runner.invoke(args=["adopt-objects"])
+        assert "Moved 1 files" in result.output
+        assert fileshare.files_metadata["old.txt"]["storage"] == "object"
+        assert fileshare.blobs[digest]["refs"] == 0
+        response = auth_client.get("/api/download/old.txt")
+        assert response.data == b"stored in the upload folder"
+        assert not os.path.exists(fileshare.stored_file_path("old.txt"))
+
+    def test_migrate_and_adopt_files_without_digests(self, app, auth_client, runner):
+        self.upload(auth_client, "old.txt", b"uploaded long ago")
+        # Recorded before digests were kept
+        fileshare.files_metadata["old.txt"] = {
+            key: value
+            for key, value in fileshare.files_metadata["old.txt"].items()
+            if key not in ("md5", "sha256")
+        }
+        source = LocalBackend(app.config["UPLOAD_FOLDER"], sharded=False)
+        migrate(source, fileshare.object_store.backend, keys=["old.txt"])
+
+        # The server keeps serving the file until it is adopted
+        assert auth_client.get("/api/download/old.txt").data == b"uploaded long ago"
+        result = runner.invoke(args=["adopt-objects"])
+        assert "Moved 1 files" in result.output
+
+        metadata = fileshare.files_metadata["old.txt"]
+        digest = hashlib.sha256(b"uploaded long ago").hexdigest()
+        assert metadata["storage"] == "object"
+        assert metadata["sha256"] == digest
+        assert fileshare.objects[digest]["refs"] == 1
+        assert not os.path.exists(fileshare.stored_file_path("old.txt"))
+        assert auth_client.get("/api/download/old.txt").data == b"uploaded long ago"
+
+    def test_adopt_migrated_files(self, app, auth_client, runner):
+        self.upload(auth_client, "old.txt", b"moved by a migration")
+        self.upload(auth_client, "new.txt", b"still in the upload folder")
+        digest = fileshare.files_metadata["old.txt"]["sha256"]
+        os.remove(fileshare.stored_file_path("old.txt"))
+        fileshare.object_store.backend.put_stream(
+            digest, io.BytesIO(b"moved by a migration")
+        )
+
+        result = runner.invoke(args=["adopt-objects"])
+        assert "Moved 2 files" in result.output
+        assert fileshare.objects[digest]["refs"] == 1
+        response = auth_client.get("/api/download/old.txt")
+        assert response.data == b"moved by a migration"
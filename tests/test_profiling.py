@@ -0,0 +1,131 @@
+"""
+Tests for request profiling and the stack sampler.
+"""
+import os
+import pstats
+import sys
+import threading
+import time
+
+import app as fileshare
+from profiling import RequestProfiler, StackSampler, collapse
+
+
+class TestProfilers:
+    """Test the profilers on their own."""
+
+    def test_request_profiler(self, temp_dir):
+        profiler = RequestProfiler(temp_dir, keep=2)
+        assert not profiler.sampled()
+
+        profile = profiler.start()
+        # Only one request is profiled at a time
+        assert profiler.start() is None
+        sum(range(1000))
+        name = profiler.finish(profile, "GET /api/files")
+        assert name.endswith("-GET-api-files.pstats")
+        stats = pstats.Stats(os.path.join(temp_dir, name))
+        assert stats.total_calls > 0
+
+        for _ in range(2):
+            profiler.finish(profiler.start(), "GET /")
+        assert len(profiler.profiles()) == 2
+
+        profiler.sample_rate = 1
+        assert profiler.sampled()
+
+    def test_collapse(self):
+        def inner():
+            return collapse(sys._getframe())
+
+        stack = inner()
+        assert stack.endswith("test_profiling:test_collapse;test_profiling:inner")
+
+    def test_sampler_counts_stacks(self):
+        sampler = StackSampler(interval=0.001)
+        done = threading.Event()
+
+        def busy_wait():
+            done.wait(5)
+
+        worker = threading.Thread(target=busy_wait)
+        worker.start()
+        assert sampler.start(duration=5)
+        assert not sampler.start()
+        deadline = time.time() + 5
+        while sampler.samples < 5 and time.time() < deadline:
+            time.sleep(0.01)
+        assert sampler.stop()
+        done.set()
+        worker.join()
+
+        assert not sampler.running
+        lines = sampler.collapsed().splitlines()
+        assert any("test_profiling:busy_wait" in line for line in lines)
+        stack, count = lines[0].rsplit(" ", 1)
+        assert int(count) >= 1
+
+        sampler.reset()
+        assert sampler.collapsed() == ""
+
+
+class TestProfilingEndpoints:
+    """Test the admin profiling API."""
+
+    def test_profile_with_header(self, auth_client):
+        response = auth_client.get("/api/stats", headers={"X-Profile": "1"})
+        name = response.headers["X-Profile-Id"]
+        assert name.endswith(".pstats")
+
+        profiles = auth_client.get("/api/profiling").json["requests"]["profiles"]
+        assert [entry["name"] for entry in profiles] == [name]
+        download = auth_client.get(f"/api/profiling/profiles/{name}")
+        assert download.status_code == 200
+        assert auth_client.get("/api/profiling/profiles/..").status_code == 404
+
+        # Without the header nothing is profiled
+        assert "X-Profile-Id" not in auth_client.get("/api/stats").headers
+
+    def test_sample_rate(self, auth_client):
+        response = auth_client.post("/api/profiling/requests", json={"sample_rate": 1})
+        assert response.json["requests"]["sample_rate"] == 1
+        assert "X-Profile-Id" in auth_client.get("/api/stats").headers
+
+        assert (
+            auth_client.post("/api/profiling/requests", json={"sample_rate": 2})
+        ).status_code == 400
+        auth_client.post("/api/profiling/requests", json={"sample_rate": 0})
+        assert "X-Profile-Id" not in auth_client.get("/api/stats").headers
+
+    def test_sampler_start_stop(self, auth_client):
+        response = auth_client.post(
+            "/api/profiling/sampler/start", json={"interval": 0.001, "duration": 5}
+        )
+        assert response.json["sampler"]["running"]
+        assert (
+            auth_client.post("/api/profiling/sampler/start", json={}).status_code == 409
+        )
+        deadline = time.time() + 5
+        while fileshare.stack_sampler.samples < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        live = auth_client.get("/api/profiling/sampler/stacks")
+        assert live.mimetype == "text/plain"
+
+        response = auth_client.post("/api/profiling/sampler/stop")
+        assert not response.json["sampler"]["running"]
+        download = auth_client.get(
+            f"/api/profiling/profiles/{response.json['profile']}"
+        )
+        assert download.status_code == 200
+        # The saved stacks include those sampled before the stop
+        assert len(download.data.splitlines()) >= len(live.data.splitlines())
+
+    def test_admin_only(self, client):
+        fileshare.create_user("alice", "secret")
+        client.post("/login", data={"username": "alice", "password": "secret"})
+        assert client.get("/api/profiling").status_code == 403
+        response = client.get("/api/stats", headers={"X-Profile": "1"})
+        assert "X-Profile-Id" not in response.headers
+
+    def test_login_required(self, client):
+        assert client.get("/api/profiling").status_code in (302, 401)
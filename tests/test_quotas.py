@@ -0,0 +1,158 @@
+"""
+Tests for per-user and per-API-key storage quotas.
+"""
+import base64
+import io
+
+import pytest
+
+import app as fileshare
+from quotas import QuotaLedger
+
+MB = 1024 * 1024
+
+
+class TestQuotaLedger:
+    """Test incremental usage accounting and limits."""
+
+    def test_usage_follows_metadata_changes(self):
+        ledger = QuotaLedger()
+        ledger.apply(
+            {
+                "a.txt": {"size": 10, "uploaded_by": "admin"},
+                "b.txt": {"size": 5, "api_key": "k", "uploaded_by": "backup"},
+                "c.txt": {"size": 7},
+            }
+        )
+        assert ledger.usage(("user", "admin")) == {"bytes": 10, "files": 1}
+        assert ledger.usage(("api_key", "k")) == {"bytes": 5, "files": 1}
+        assert ledger.usage(("user", "backup")) == {"bytes": 0, "files": 0}
+
+        ledger.apply({"a.txt": {"size": 30, "uploaded_by": "admin"}, "b.txt": None})
+        assert ledger.usage(("user", "admin")) == {"bytes": 30, "files": 1}
+        assert ledger.usage(("api_key", "k")) == {"bytes": 0, "files": 0}
+
+        ledger.apply({"d.txt": {"size": 1, "uploaded_by": "eve"}}, reset=True)
+        assert ledger.usage(("user", "admin"))["files"] == 0
+
+    def test_limits_and_checks(self):
+        ledger = QuotaLedger(
+            {
+                "users": {"default": {"max_mb": 1}, "admin": {"max_mb": None}},
+                "api_keys": {"k": {"max_files": 1}},
+            }
+        )
+        ledger.apply({"a.txt": {"size": MB - 10, "uploaded_by": "eve"}})
+
+        assert ledger.check(("user", "eve"), 10) is None
+        assert "Storage quota exceeded" in ledger.check(("user", "eve"), 11)
+        assert ledger.check(("user", "admin"), 10 * MB) is None
+        assert ledger.report(("user", "eve"))["remaining_bytes"] == 10
+
+        assert ledger.check(("api_key", "k"), 10 * MB) is None
+        ledger.apply({"b.txt": {"size": 1, "api_key": "k"}})
+        assert "File quota exceeded" in ledger.check(("api_key", "k"), 1)
+
+
+class TestQuotaEnforcement:
+    """Test quotas on the upload endpoints and the v1 quota API."""
+
+    HEADERS = {"X-API-Key": "test-key"}
+
+    @pytest.fixture(autouse=True)
+    def api_key(self, app):
+        fileshare.api_keys["test-key"] = {
+            "name": "backup",
+            "created_at": "",
+            "usage_count": 0,
+        }
+        app.config["STORAGE_QUOTAS"] = {"api_keys": {"default": {"max_mb": 1}}}
+        fileshare.quota_ledger.configure(app.config["STORAGE_QUOTAS"])
+        yield
+        fileshare.quota_ledger.configure({})
+
+    def upload(self, client, name, size):
+        return client.post(
+            "/api/v1/upload",
+            data={"file": (io.BytesIO(b"x" * size), name)},
+            content_type="multipart/form-data",
+            headers=self.HEADERS,
+        )
+
+    def test_declared_size_is_rejected_before_reading(self, client):
+        response = self.upload(client, "big.txt", 2 * MB)
+        assert response.status_code == 413
+        assert response.get_json()["quota"]["bytes"] == 0
+        assert "big.txt" not in fileshare.files_metadata
+
+    def test_body_is_not_read_when_rejected(self, client):
+        class Unreadable(io.RawIOBase):
+            def seekable(self):
+                return True
+
+            def seek(self, offset, whence=io.SEEK_SET):
+                return 0
+
+            def readinto(self, buffer):
+                raise AssertionError("body was read")
+
+        response = client.post(
+            "/api/v1/upload",
+            input_stream=Unreadable(),
+            content_type="multipart/form-data; boundary=x",
+            headers=self.HEADERS,
+            environ_overrides={"CONTENT_LENGTH": str(2 * MB)},
+        )
+        assert response.status_code == 413
+
+    def test_usage_is_updated_by_upload_and_delete(self, client):
+        assert self.upload(client, "a.txt", MB // 2).status_code == 200
+        quota = client.get("/api/v1/quota", headers=self.HEADERS).get_json()
+        assert quota["bytes"] == MB // 2
+        assert quota["files"] == 1
+        assert quota["max_bytes"] == MB
+
+        assert self.upload(client, "b.txt", MB // 2 + 1).status_code == 413
+
+        client.delete("/api/delete/a.txt")
+        assert self.upload(client, "b.txt", MB // 2 + 1).status_code == 200
+
+    def test_exact_size_is_checked_after_reading(self, client):
+        self.upload(client, "a.txt", MB - 100)
+        file_data = base64.b64encode(b"y" * 200).decode()
+        response = client.post(
+            "/api/v1/upload/base64",
+            json={"filename": "b.txt", "file_data": file_data},
+            headers=self.HEADERS,
+        )
+        assert response.status_code == 413
+        assert "b.txt" not in fileshare.files_metadata
+
+    def test_chat_upload_is_charged_to_the_caller(self, client):
+        def chat_upload(name, size, **kwargs):
+            return client.post(
+                "/api/chat/upload",
+                data={
+                    "file": (io.BytesIO(b"x" * size), name),
+                    "username": "someone-else",
+                },
+                content_type="multipart/form-data",
+                **kwargs,
+            )
+
+        assert chat_upload("a.txt", 10).status_code == 401
+        assert chat_upload("a.txt", MB // 2, headers=self.HEADERS).status_code == 200
+        assert chat_upload("b.txt", MB // 2 + 1, headers=self.HEADERS).status_code == (
+            413
+        )
+        assert fileshare.quota_ledger.usage(("api_key", "test-key"))["files"] == 1
+
+        client.post("/login", data={"username": "admin", "password": "admin"})
+        assert chat_upload("c.txt", 10).status_code == 200
+        uploaders = {
+            metadata["uploaded_by"] for metadata in fileshare.files_metadata.values()
+        }
+        assert uploaders == {"backup", "admin"}
+
+    def test_quota_api_requires_key(self, client):
+        assert client.get("/api/v1/quota").status_code == 401
@@ -0,0 +1,189 @@
+"""
+Tests for coalesced real-time file change broadcasts.
+"""
+import io
+
+from app import socketio
+from realtime import EventCoalescer, folder_rooms
+
+
+class RecordingSocketIO:
+    """Minimal stand-in that records emits and runs tasks inline."""
+
+    def __init__(self):
+        self.emitted = []
+        self.tasks = []
+
+    def emit(self, event, data, **kwargs):
+        self.emitted.append((event, data))
+
+    def start_background_task(self, target, *args):
+        self.tasks.append(target)
+
+    def sleep(self, seconds):
+        pass
+
+    def run_tasks(self):
+        while self.tasks:
+            self.tasks.pop(0)()
+
+
+class TestEventCoalescer:
+    """Test batching and merging of file changes."""
+
+    def test_changes_within_window_become_one_broadcast(self):
+        sio = RecordingSocketIO()
+        coalescer = EventCoalescer(sio, window=0.25)
+        for i in range(100):
+            coalescer.publish({"action": "deleted", "path": f"f{i}.txt"})
+
+        assert sio.emitted == []
+        sio.run_tasks()
+
+        assert len(sio.emitted) == 1
+        event, payload = sio.emitted[0]
+        assert event == "files_changed"
+        assert len(payload["changes"]) == 100
+
+    def test_download_is_merged_into_pending_upload(self):
+        sio = RecordingSocketIO()
+        coalescer = EventCoalescer(sio, window=0.25)
+        coalescer.publish(
+            {"action": "uploaded", "path": "a.txt", "file": {"downloads": 0}}
+        )
+        coalescer.publish({"action": "downloaded", "path": "a.txt", "downloads": 3})
+        sio.run_tasks()
+
+        changes = sio.emitted[0][1]["changes"]
+        assert changes == [
+            {"action": "uploaded", "path": "a.txt", "file": {"downloads": 3}}
+        ]
+
+    def test_full_batch_is_sent_immediately(self):
+        sio = RecordingSocketIO()
+        coalescer = EventCoalescer(sio, window=0.25, max_batch=2)
+        coalescer.publish({"action": "deleted", "path": "a.txt"})
+        coalescer.publish({"action": "deleted", "path": "b.txt"})
+
+        assert len(sio.emitted) == 1
+
+    def test_summary_is_added_to_payload(self):
+        sio = RecordingSocketIO()
+        coalescer = EventCoalescer(sio, window=0)
+        coalescer.summary = lambda: {"stats": {"total_files": 1}}
+        coalescer.publish({"action": "deleted", "path": "a.txt"})
+
+        assert sio.emitted[0][1]["stats"] == {"total_files": 1}
+
+
+def upload(client, name, folder_path=""):
+    return client.post(
+        "/api/upload",
+        data={"file": (io.BytesIO(b"hello"), name), "folder_path": folder_path},
+        content_type="multipart/form-data",
+    )
+
+
+def received(sio_client, event):
+    return [msg["args"][0] for msg in sio_client.get_received() if msg["name"] == event]
+
+
+class TestFolderRooms:
+    """Test folder room naming."""
+
+    def test_folder_rooms_include_ancestors(self):
+        assert folder_rooms("docs/2024/") == [
+            "folder:",
+            "folder:docs",
+            "folder:docs/2024",
+        ]
+        assert folder_rooms("") == ["folder:"]
+
+
+class TestFilesChangedEvent:
+    """Test folder-scoped files_changed broadcasts from the upload API."""
+
+    def _subscribe(self, app, auth_client, folder_path):
+        sio_client = socketio.test_client(app, flask_test_client=auth_client)
+        sio_client.emit("subscribe_folder", {"folder_path": folder_path})
+        sio_client.get_received()
+        return sio_client
+
+    def test_upload_broadcasts_file_delta(self, app, auth_client):
+        sio_client = self._subscribe(app, auth_client, "")
+
+        response = upload(auth_client, "hello.txt")
+        assert response.status_code == 200
+
+        batches = received(sio_client, "files_changed")
+        assert len(batches) == 1
+        change = batches[0]["changes"][0]
+        assert change["action"] == "uploaded"
+        assert change["file"]["name"] == "hello.txt"
+        assert batches[0]["stats"]["total_files"] == 1
+
+    def test_ancestor_folder_subscribers_receive_events(self, app, auth_client):
+        sio_client = self._subscribe(app, auth_client, "docs")
+
+        upload(auth_client, "report.txt", "docs/2024")
+
+        assert len(received(sio_client, "files_changed")) == 1
+
+    def test_other_folders_and_unsubscribed_clients_receive_nothing(
+        self, app, auth_client
+    ):
+        sibling = self._subscribe(app, auth_client, "images")
+        idle = socketio.test_client(app, flask_test_client=auth_client)
+        idle.get_received()
+
+        upload(auth_client, "report.txt", "docs")
+
+        assert received(sibling, "files_changed") == []
+        assert received(idle, "files_changed") == []
+        assert received(idle, "file_uploaded") == []
+
+    def test_only_files_changed_is_sent(self, app, auth_client):
+        sio_client = self._subscribe(app, auth_client, "")
+
+        def events():
+            messages = sio_client.get_received()
+            assert {msg["name"] for msg in messages} == {"files_changed"}
+            return messages[-1]["args"][0]["stats"]
+
+        upload(auth_client, "hello.txt")
+        assert events()["total_files"] == 1
+        auth_client.get("/api/download/hello.txt")
+        assert events()["total_downloads"] == 1
+        auth_client.delete("/api/delete/hello.txt")
+        assert events() == {
+            "total_files": 0,
+            "total_size_mb": 0,
+            "total_downloads": 0,
+        }
+
+    def test_subscribe_requires_login(self, app, client):
+        sio_client = socketio.test_client(app, flask_test_client=client)
+        ack = sio_client.emit("subscribe_folder", {"folder_path": ""}, callback=True)
+        assert ack == {"error": "Authentication required"}
+
+
+class TestChatNamespace:
+    """Test that chat runs on its own namespace."""
+
+    def test_chat_messages_stay_on_chat_namespace(self, app):
+        chat_client = socketio.test_client(app, namespace="/chat")
+        files_client = socketio.test_client(app)
+        chat_client.get_received("/chat")
+        files_client.get_received()
+
+        chat_client.emit(
+            "chat_message", {"username": "alice", "message": "hi"}, namespace="/chat"
+        )
+
+        messages = [
+            msg
+            for msg in chat_client.get_received("/chat")
+            if msg["name"] == "new_message"
+        ]
+        assert len(messages) == 1
+        assert files_client.get_received() == []
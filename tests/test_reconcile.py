@@ -0,0 +1,162 @@
+"""
+Tests for the upload folder / metadata reconciliation.
+"""
+import io
+import os
+import time
+
+import pytest
+
+import app as fileshare
+from reconcile import DirectoryScanner, Reconciler
+
+HOUR = 3600
+
+
+def write(path, content=b"data", age=2 * HOUR):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    past = time.time() - age
+    os.utime(path, (past, past))
+
+
+def settle(root):
+    """Move directory mtimes out of the racy window"""
+    past = time.time() - HOUR
+    for directory, _, _ in os.walk(root):
+        os.utime(directory, (past, past))
+
+
+class TestDirectoryScanner:
+    """Test incremental scans against the directory checkpoint."""
+
+    def test_unchanged_directories_are_not_listed(self, temp_dir):
+        write(os.path.join(temp_dir, "a.txt"))
+        write(os.path.join(temp_dir, "docs", "b.txt"))
+        write(os.path.join(temp_dir, "docs", "old", "c.txt"))
+        settle(temp_dir)
+        scanner = DirectoryScanner(temp_dir, {})
+
+        files, listed, total = scanner.scan()
+        assert files == {"a.txt", "docs/b.txt", "docs/old/c.txt"}
+        assert (listed, total) == (3, 3)
+
+        assert scanner.scan() == (files, 0, 3)
+        assert scanner.scan(full=True) == (files, 3, 3)
+
+    def test_changed_directories_are_listed_again(self, temp_dir):
+        write(os.path.join(temp_dir, "docs", "b.txt"))
+        settle(temp_dir)
+        scanner = DirectoryScanner(temp_dir, {})
+        scanner.scan()
+
+        write(os.path.join(temp_dir, "docs", "new.txt"))
+        files, listed, _ = scanner.scan()
+        assert files == {"docs/b.txt", "docs/new.txt"}
+        assert listed == 1
+
+    def test_removed_directories_leave_the_checkpoint(self, temp_dir):
+        write(os.path.join(temp_dir, "tmp", "a.txt"))
+        checkpoint = {}
+        DirectoryScanner(temp_dir, checkpoint, "uploads:").scan()
+        assert "uploads:tmp" in checkpoint
+
+        os.remove(os.path.join(temp_dir, "tmp", "a.txt"))
+        os.rmdir(os.path.join(temp_dir, "tmp"))
+        DirectoryScanner(temp_dir, checkpoint, "uploads:").scan()
+        assert list(checkpoint) == ["uploads:"]
+
+
+class TestReconciler:
+    """Test the report and the fix actions."""
+
+    @pytest.fixture
+    def folders(self, temp_dir):
+        uploads = os.path.join(temp_dir, "uploads")
+        thumbnails = os.path.join(temp_dir, "thumbnails")
+        write(os.path.join(uploads, "kept.png"))
+        write(os.path.join(uploads, "docs", "orphan.txt"))
+        write(os.path.join(uploads, "docs", "uploading.txt"), age=0)
+        write(os.path.join(thumbnails, "thumb_kept.png.jpg"))
+        write(os.path.join(thumbnails, "thumb_gone.png.jpg"))
+        return uploads, thumbnails
+
+    def test_report_and_fix(self, folders):
+        uploads, thumbnails = folders
+        removed = []
+        reconciler = Reconciler(
+            uploads,
+            thumbnails,
+            {},
+            expected=lambda: {"kept.png": "kept.png", "docs/gone.txt": "docs/gone.txt"},
+            remove=lambda keys: removed.extend(keys) or len(keys),
+        )
+
+        report = reconciler.run()
+        assert report["orphans"] == ["docs/orphan.txt"]
+        assert report["missing"] == ["docs/gone.txt"]
+        assert report["stale_thumbnails"] == ["thumb_gone.png.jpg"]
+
+        fixed = reconciler.fix(
+            ["remove_missing", "delete_orphans", "delete_stale_thumbnails"]
+        )
+        assert fixed == {
+            "remove_missing": 1,
+            "delete_orphans": 1,
+            "delete_stale_thumbnails": 1,
+        }
+        assert removed == ["docs/gone.txt"]
+        assert not os.path.exists(os.path.join(uploads, "docs", "orphan.txt"))
+        assert os.path.exists(os.path.join(uploads, "docs", "uploading.txt"))
+        assert os.listdir(thumbnails) == ["thumb_kept.png.jpg"]
+
+    def test_unknown_action(self, folders):
+        reconciler = Reconciler(*folders, {}, expected=dict)
+        with pytest.raises(ValueError):
+            reconciler.fix(["delete_everything"])
+
+
+class TestReconcileEndpoints:
+    """Test /api/reconcile with files in sanitized folders."""
+
+    def test_missing_file_is_reported_and_removed(self, auth_client, monkeypatch):
+        monkeypatch.setattr(fileshare.reconciler, "thumbnails_folder", "")
+        auth_client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(b"a"), "a.txt"), "folder_path": "my docs"},
+            content_type="multipart/form-data",
+        )
+        auth_client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(b"b"), "b.txt"), "folder_path": "my docs"},
+            content_type="multipart/form-data",
+        )
+        report = auth_client.get("/api/reconcile?refresh=true").get_json()
+        assert report["missing"] == report["orphans"] == []
+        assert report["files_on_disk"] == 2
+
+        os.remove(fileshare.stored_file_path("my docs/b.txt"))
+        report = auth_client.get("/api/reconcile?refresh=true").get_json()
+        assert report["missing"] == ["my docs/b.txt"]
+
+        response = auth_client.post(
+            "/api/reconcile/fix", json={"actions": ["remove_missing"]}
+        )
+        assert response.get_json()["fixed"] == {"remove_missing": 1}
+        assert "my docs/b.txt" not in fileshare.files_metadata
+        assert "my docs/a.txt" in fileshare.files_metadata
+
+    def test_requires_login(self, client):
+        assert client.get("/api/reconcile").status_code in (302, 401)
+
+    def test_admin_only(self, client):
+        fileshare.create_user("alice", "secret")
+        client.post("/login", data={"username": "alice", "password": "secret"})
+        assert client.get("/api/reconcile").status_code == 403
+        response = client.post("/api/reconcile/fix", json={"actions": ["x"]})
+        assert response.status_code == 403
+
+    def test_invalid_actions(self, auth_client):
+        response = auth_client.post("/api/reconcile/fix", json={"actions": ["x"]})
+        assert response.status_code == 400
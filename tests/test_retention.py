@@ -0,0 +1,188 @@
+"""
+Tests for the retention policy engine.
+"""
+import io
+import os
+import time
+from datetime import datetime, timedelta
+
+import app as fileshare
+from retention import RETRY_DELAY, RetentionEngine, resolve_policy
+
+DAY = 86400
+
+
+def uploaded(days_ago=0, **metadata):
+    date = datetime.now() - timedelta(days=days_ago)
+    return dict({"upload_date": date.isoformat(), "size": 0}, **metadata)
+
+
+def engine(policies, batch_size=100):
+    deleted = []
+    retention = RetentionEngine(
+        policies,
+        lambda files, tokens: deleted.append((sorted(files), sorted(tokens))),
+        batch_size,
+    )
+    return retention, deleted
+
+
+class TestResolvePolicy:
+    """Test how default, folder and API key policies combine."""
+
+    POLICIES = {
+        "default": {"ttl_days": 7},
+        "folders": {
+            "chat": {"ttl_days": 1},
+            "chat/keep": {"ttl_days": None, "max_total_mb": 10},
+        },
+        "api_keys": {"key": {"max_downloads": 1}},
+    }
+
+    def test_deepest_folder_wins(self):
+        assert resolve_policy(self.POLICIES, "a.txt", {})[0]["ttl_days"] == 7
+        assert resolve_policy(self.POLICIES, "chat/a.txt", {})[0]["ttl_days"] == 1
+        policy, scope = resolve_policy(self.POLICIES, "chat/keep/x/a.txt", {})
+        assert policy["ttl_days"] is None
+        assert scope == ("folder", "chat/keep")
+        assert resolve_policy(self.POLICIES, "chatter/a.txt", {})[0]["ttl_days"] == 7
+
+    def test_api_key_policy_applies_on_top(self):
+        policy, scope = resolve_policy(self.POLICIES, "chat/a.txt", {"api_key": "key"})
+        assert policy == {"ttl_days": 1, "max_downloads": 1, "max_total_mb": None}
+        assert scope is None
+
+
+class TestRetentionEngine:
+    """Test deadlines, download limits, size caps and batching."""
+
+    def test_files_expire_after_ttl(self):
+        retention, deleted = engine({"folders": {"tmp": {"ttl_days": 1}}})
+        retention.apply_files(
+            {
+                "old.txt": uploaded(8),
+                "new.txt": uploaded(1),
+                "tmp/a.txt": uploaded(2),
+                "tmp/b.txt": uploaded(0),
+            }
+        )
+
+        assert retention.tick() == 2
+        assert deleted == [(["old.txt", "tmp/a.txt"], [])]
+        assert retention.tick() == 0
+        assert retention.tick(now=time.time() + 7 * DAY) == 2
+
+    def test_rescheduled_and_removed_entries_are_skipped(self):
+        retention, deleted = engine({})
+        retention.apply_files({"a.txt": uploaded(8), "b.txt": uploaded(8)})
+        retention.apply_files({"a.txt": uploaded(0), "b.txt": None})
+
+        assert retention.tick() == 0
+        assert retention.pending() == 1
+
+    def test_download_limit(self):
+        retention, deleted = engine({"api_keys": {"key": {"max_downloads": 2}}})
+        retention.apply_files({"a.txt": uploaded(api_key="key", downloads=1)})
+        assert retention.tick() == 0
+
+        retention.apply_files({"a.txt": uploaded(api_key="key", downloads=2)})
+        assert retention.tick() == 1
+        assert deleted == [(["a.txt"], [])]
+
+    def test_size_cap_evicts_oldest_files(self):
+        retention, deleted = engine(
+            {"folders": {"cache": {"ttl_days": None, "max_total_mb": 1}}}
+        )
+        half = 512 * 1024
+        retention.apply_files(
+            {f"cache/{n}.bin": uploaded(5 - n, size=half) for n in range(4)}
+        )
+
+        assert retention.tick() == 2
+        assert deleted == [(["cache/0.bin", "cache/1.bin"], [])]
+        retention.apply_files({"cache/0.bin": None, "cache/1.bin": None})
+        assert retention.tick() == 0
+
+    def test_size_cap_with_small_batches_and_failures(self):
+        retention, deleted = engine(
+            {"folders": {"cache": {"ttl_days": None, "max_total_mb": 1}}},
+            batch_size=1,
+        )
+        half = 512 * 1024
+        retention.apply_files(
+            {f"cache/{n}.bin": uploaded(5 - n, size=half) for n in range(4)}
+        )
+        now = time.time()
+
+        # The first deletion fails: retried later, not handed out again
+        assert retention.tick(now=now) == 1
+        retention.retry(["cache/0.bin"], now=now)
+        assert retention.tick(now=now) == 1
+        retention.apply_files({"cache/1.bin": None})
+        assert retention.tick(now=now) == 0
+        assert deleted == [(["cache/0.bin"], []), (["cache/1.bin"], [])]
+
+        # Still over the cap: newer files are evicted once it is gone
+        retention.apply_files({"cache/4.bin": uploaded(0, size=half)})
+        assert retention.tick(now=now + RETRY_DELAY + 1) == 1
+        assert deleted[-1] == (["cache/0.bin"], [])
+        retention.apply_files({"cache/0.bin": None})
+        assert retention.tick(now=now + RETRY_DELAY + 1) == 1
+        assert deleted[-1] == (["cache/2.bin"], [])
+
+    def test_share_links_expire(self):
+        retention, deleted = engine({})
+        past = (datetime.now() - timedelta(hours=1)).isoformat()
+        retention.apply_links(
+            {
+                "expired": {"expires_at": past},
+                "used": {"max_downloads": 1, "download_count": 1},
+                "open": {"expires_at": None, "max_downloads": None},
+            }
+        )
+
+        assert retention.tick() == 2
+        assert deleted == [([], ["expired", "used"])]
+
+    def test_batches_are_limited(self):
+        retention, deleted = engine({}, batch_size=2)
+        retention.apply_files({f"{n}.txt": uploaded(8) for n in range(5)})
+
+        assert [retention.tick() for _ in range(4)] == [2, 2, 1, 0]
+
+    def test_failed_deletes_are_retried(self):
+        retention, deleted = engine({})
+        retention.retry(["a.txt"], now=0)
+        assert retention.tick(now=1) == 0
+        assert retention.tick(now=DAY) == 1
+
+
+class TestRetentionCascade:
+    """Test expiry of uploaded files through the app."""
+
+    def test_expiry_removes_file_links_and_content(self, auth_client):
+        auth_client.post(
+            "/api/upload",
+            data={
+                "file": (io.BytesIO(b"old notes"), "notes.txt"),
+                "folder_path": "my docs",
+            },
+            content_type="multipart/form-data",
+        )
+        file_key = "my docs/notes.txt"
+        assert file_key in fileshare.files_metadata
+        auth_client.post(f"/api/generate-share-link/{file_key}")
+        assert len(fileshare.share_links) == 1
+        file_path = fileshare.stored_file_path(file_key)
+        assert os.path.exists(file_path)
+        digest = fileshare.files_metadata[file_key]["sha256"]
+
+        # The share link expires together with the file
+        assert fileshare.retention.tick(now=time.time() + 8 * DAY) == 2
+        assert file_key not in fileshare.files_metadata
+        assert not fileshare.share_links
+        assert not os.path.exists(file_path)
+        assert fileshare.blobs[digest]["refs"] == 0
+
+        fileshare.refresh_shared_state()
+        assert file_key not in fileshare.files_metadata
@@ -0,0 +1,194 @@
+"""
+Tests for the background integrity scrubber.
+"""
+import io
+import os
+import threading
+
+import pytest
+
+import app as fileshare
+from app import socketio
+from scrubber import CURSOR_KEY, Scrubber, ThrottledReader
+from state_store import JsonFileStore, SharedDict
+
+
+class TestScrubber:
+    """Test the incremental walk."""
+
+    def make(self, state, contents, bad=(), mismatches=None):
+        def verify(digest, info):
+            return {"error": "content mismatch"} if digest in bad else None
+
+        return Scrubber(
+            state,
+            contents=lambda: contents,
+            verify=verify,
+            on_mismatch=lambda digest, entry: mismatches.append(digest),
+        )
+
+    def test_pass_resumes_from_cursor(self):
+        state = SharedDict(JsonFileStore({}), "scrub")
+        contents = {digest: {"file_keys": [digest]} for digest in "abcde"}
+        mismatches = []
+        scrubber = self.make(state, contents, {"d"}, mismatches)
+
+        assert scrubber.step(batch=2, now=100) == 2
+        assert state[CURSOR_KEY]["digest"] == "b"
+
+        # A new scrubber (e.g. after a restart) continues with "c"
+        scrubber = self.make(state, contents, {"d"}, mismatches)
+        assert scrubber.step(batch=2, now=200) == 2
+        assert state["c"] == {"verified_at": 200, "ok": True}
+        assert state["d"]["error"] == "content mismatch"
+        assert state["d"]["file_keys"] == ["d"]
+        assert mismatches == ["d"]
+
+        report = scrubber.report()
+        assert (report["position"], report["total"]) == (4, 5)
+        assert [entry["sha256"] for entry in report["mismatches"]] == ["d"]
+
+        assert scrubber.step(batch=2, now=300) == 1
+        assert scrubber.step(batch=2, now=300) == 0
+        assert state[CURSOR_KEY]["passes"] == 1
+        assert state[CURSOR_KEY]["last_pass_started"] == 100
+
+    def test_finished_pass_forgets_deleted_contents(self):
+        state = SharedDict(JsonFileStore({}), "scrub")
+        contents = {"a": {}, "b": {}}
+        scrubber = self.make(state, contents)
+        while scrubber.step(now=1):
+            pass
+
+        del contents["b"]
+        while scrubber.step(now=2):
+            pass
+        assert set(state.keys()) == {CURSOR_KEY, "a"}
+        assert state[CURSOR_KEY]["passes"] == 2
+
+    def test_unreadable_contents_are_reported(self):
+        state = SharedDict(JsonFileStore({}), "scrub")
+
+        def verify(digest, info):
+            raise FileNotFoundError(digest)
+
+        scrubber = Scrubber(state, lambda: {"a": {}}, verify)
+        scrubber.step(now=1)
+        assert state["a"]["error"] == "missing"
+
+    def test_throttled_reader(self):
+        charged = []
+        with ThrottledReader(io.BytesIO(b"0123456789"), charged.append) as f:
+            f.seek(2)
+            assert f.read(3) == b"234"
+            assert f.read() == b"56789"
+        assert sum(charged) == 8
+
+
+class TestScrubbing:
+    """Test verification of stored files through the app."""
+
+    @pytest.fixture(autouse=True)
+    def unthrottled(self):
+        fileshare.scrub_throttle.rate = None
+
+    def upload(self, auth_client, content, filename="data.txt"):
+        return auth_client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(content), filename), "folder_path": "docs"},
+            content_type="multipart/form-data",
+        )
+
+    def scrub(self):
+        while fileshare.scrubber.step():
+            pass
+
+    def test_intact_files_pass(self, auth_client):
+        self.upload(auth_client, b"intact content")
+        self.scrub()
+        digest = fileshare.files_metadata["docs/data.txt"]["sha256"]
+        assert fileshare.scrub_state[digest]["ok"]
+
+        report = auth_client.get("/api/scrub").json
+        assert report["passes"] == 1
+        assert report["mismatches"] == []
+
+    def test_corruption_is_reported(self, app, auth_client):
+        self.upload(auth_client, b"x" * 5000)
+        self.upload(auth_client, b"y" * 5000, "other.txt")
+        # Corrupt one stored file in place (without changing its size)
+        with open(fileshare.stored_file_path("docs/data.txt"), "r+b") as f:
+            f.seek(100)
+            f.write(b"z")
+        sio_client = socketio.test_client(app, flask_test_client=auth_client)
+        sio_client.get_received()
+
+        self.scrub()
+        report = auth_client.get("/api/scrub").json
+        assert len(report["mismatches"]) == 1
+        mismatch = report["mismatches"][0]
+        assert mismatch["file_keys"] == ["docs/data.txt"]
+        assert mismatch["bad_leaves"] == [0]
+
+        events = [
+            msg for msg in sio_client.get_received() if msg["name"] == "integrity_error"
+        ]
+        assert events[0]["args"][0]["file_keys"] == ["docs/data.txt"]
+
+    def test_integrity_errors_go_to_admins_only(self, app, client):
+        fileshare.create_user("alice", "secret")
+        client.post("/login", data={"username": "alice", "password": "secret"})
+        user = socketio.test_client(app, flask_test_client=client)
+        anonymous = socketio.test_client(app)
+        for sio_client in (user, anonymous):
+            sio_client.get_received()
+
+        fileshare.report_mismatch("a" * 64, {"error": "missing", "file_keys": []})
+        for sio_client in (user, anonymous):
+            assert [msg["name"] for msg in sio_client.get_received()] == []
+
+    def test_contents_are_read_on_a_low_priority_thread(self, auth_client):
+        self.upload(auth_client, b"intact content")
+        threads = []
+        verify = fileshare.verify_content
+
+        def record(digest, info):
+            threads.append(threading.get_native_id())
+            return verify(digest, info)
+
+        fileshare.verify_content = record
+        try:
+            self.scrub()
+        finally:
+            fileshare.verify_content = verify
+        assert threads and threading.get_native_id() not in threads
+        if hasattr(os, "getpriority"):
+            assert os.getpriority(os.PRIO_PROCESS, threads[0]) == 19
+            assert os.getpriority(os.PRIO_PROCESS, threading.get_native_id()) < 19
+
+    def test_truncation_and_missing_files(self, auth_client):
+        self.upload(auth_client, b"x" * 5000)
+        self.upload(auth_client, b"y" * 5000, "other.txt")
+        with open(fileshare.stored_file_path("docs/data.txt"), "r+b") as f:
+            f.truncate(10)
+        blob_path = fileshare.blob_store.path(
+            fileshare.files_metadata["docs/other.txt"]["sha256"]
+        )
+        os.remove(blob_path)
+        os.remove(fileshare.stored_file_path("docs/other.txt"))
+
+        self.scrub()
+        errors = {
+            mismatch["file_keys"][0]: mismatch["error"]
+            for mismatch in fileshare.scrubber.report()["mismatches"]
+        }
+        assert errors["docs/data.txt"].startswith("size mismatch")
+        assert errors["docs/other.txt"] == "missing"
+
+    def test_scrub_report_requires_login(self, client):
+        assert client.get("/api/scrub").status_code in (302, 401)
+
+    def test_scrub_report_is_admin_only(self, client):
+        fileshare.create_user("alice", "secret")
+        client.post("/login", data={"username": "alice", "password": "secret"})
+        assert client.get("/api/scrub").status_code == 403
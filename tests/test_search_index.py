@@ -0,0 +1,117 @@
+"""
+Tests for the filename search index and the search endpoints.
+"""
+import io
+
+from app import api_keys
+from search_index import TrigramIndex
+
+
+def build_index(*file_keys):
+    index = TrigramIndex()
+    for file_key in file_keys:
+        index.add(file_key, {})
+    return index
+
+
+def keys(index, query, **kwargs):
+    return [file_key for file_key, _, _ in index.search(query, **kwargs)[1]]
+
+
+class TestTrigramIndex:
+    """Test matching, ranking and incremental updates."""
+
+    def test_substring_match(self):
+        index = build_index("reports/q1_summary.pdf", "notes.txt")
+        assert keys(index, "summ") == ["reports/q1_summary.pdf"]
+
+    def test_ranking_prefers_exact_then_prefix(self):
+        index = build_index("old_report.pdf", "report.pdf", "report_2024.pdf")
+        assert keys(index, "report.pdf", fuzzy=False) == [
+            "report.pdf",
+            "old_report.pdf",
+        ]
+        assert keys(index, "report", fuzzy=False) == [
+            "report.pdf",
+            "report_2024.pdf",
+            "old_report.pdf",
+        ]
+
+    def test_fuzzy_match_tolerates_typos(self):
+        index = build_index("invoice_march.pdf", "notes.txt")
+        assert keys(index, "invioce_march") == ["invoice_march.pdf"]
+        assert keys(index, "invioce_march", fuzzy=False) == []
+
+    def test_short_queries_and_folders(self):
+        index = build_index("docs/a.txt", "images/b.png")
+        assert keys(index, "b.") == ["images/b.png"]
+        assert keys(index, "images") == ["images/b.png"]
+        assert keys(index, "txt", folder_path="images") == []
+
+    def test_original_name_is_searchable(self):
+        index = TrigramIndex()
+        index.add("1700000000_scan.pdf", {"original_name": "Passport Scan.pdf"})
+        total, hits = index.search("passport")
+        assert total == 1 and hits[0][2] == "original_name"
+
+    def test_updates_and_removal(self):
+        index = build_index("draft.txt")
+        index.apply({"draft.txt": None, "final.txt": {}})
+        assert keys(index, "draft") == []
+        assert keys(index, "final") == ["final.txt"]
+        assert not index._postings.get("dra")
+
+    def test_unchanged_text_is_not_reindexed(self):
+        index = build_index("notes.txt")
+        grams = index._grams["notes.txt"]
+        index.apply({"notes.txt": {"downloads": 5}})
+        assert index._grams["notes.txt"] is grams
+        index.apply({"notes.txt": {"original_name": "Meeting Notes.txt"}})
+        assert keys(index, "meeting") == ["notes.txt"]
+
+    def test_pagination(self):
+        index = build_index(*[f"log_{i:02d}.txt" for i in range(25)])
+        total, page = index.search("log_", limit=10, offset=20)
+        assert total == 25
+        assert [file_key for file_key, _, _ in page] == [
+            f"log_{i:02d}.txt" for i in range(20, 25)
+        ]
+
+
+class TestSearchEndpoints:
+    """Test /api/search and /api/v1/search."""
+
+    def upload(self, client, name, folder_path=""):
+        client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(b"data"), name), "folder_path": folder_path},
+            content_type="multipart/form-data",
+        )
+
+    def test_search_returns_ranked_entries(self, auth_client):
+        self.upload(auth_client, "budget.txt", "finance")
+        self.upload(auth_client, "notes.txt")
+
+        data = auth_client.get("/api/search?q=budg").get_json()
+        assert data["total"] == 1
+        assert data["results"][0]["path"] == "finance/budget.txt"
+        assert data["results"][0]["match"] == "prefix"
+
+    def test_deleted_files_leave_the_index(self, auth_client):
+        self.upload(auth_client, "budget.txt")
+        auth_client.delete("/api/delete/budget.txt")
+        assert auth_client.get("/api/search?q=budget").get_json()["total"] == 0
+
+    def test_search_requires_login(self, client):
+        assert client.get("/api/search?q=x").status_code == 302
+
+    def test_v1_search_with_api_key(self, auth_client):
+        self.upload(auth_client, "budget.txt")
+        api_keys["test-key"] = {"name": "test", "created_at": "", "usage_count": 0}
+
+        response = auth_client.get(
+            "/api/v1/search?q=budget", headers={"X-API-Key": "test-key"}
+        )
+        data = response.get_json()
+        assert data["success"] and data["results"][0]["filename"] == "budget.txt"
+        assert auth_client.get("/api/v1/search?q=budget").status_code == 401
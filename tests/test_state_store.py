@@ -0,0 +1,80 @@
+"""
+Tests for the shared state backends.
+"""
+import json
+import os
+
+from state_store import JsonFileStore, SharedDict, SQLiteStore, create_state_store
+
+
+class TestJsonFileStore:
+    """Test the default single-process JSON backend."""
+
+    def test_save_and_reload(self, temp_dir):
+        path = os.path.join(temp_dir, "files.json")
+        store = JsonFileStore({"files": path})
+        files = SharedDict(store, "files")
+        files["a.txt"] = {"size": 1}
+        files.save()
+
+        with open(path) as f:
+            assert json.load(f) == {"a.txt": {"size": 1}}
+
+        reloaded = SharedDict(JsonFileStore({"files": path}), "files")
+        reloaded.reload()
+        assert reloaded["a.txt"] == {"size": 1}
+
+    def test_missing_file_loads_empty(self, temp_dir):
+        store = JsonFileStore({"files": os.path.join(temp_dir, "missing.json")})
+        files = SharedDict(store, "files")
+        files.reload()
+        assert len(files) == 0
+
+
+class TestSQLiteStore:
+    """Test state sharing between two workers using one SQLite database."""
+
+    def _workers(self, temp_dir):
+        path = os.path.join(temp_dir, "state.db")
+        first = SharedDict(SQLiteStore(path), "files")
+        second = SharedDict(SQLiteStore(path), "files")
+        first.reload()
+        second.reload()
+        return first, second
+
+    def test_writes_are_visible_after_refresh(self, temp_dir):
+        first, second = self._workers(temp_dir)
+        first["a.txt"] = {"downloads": 0}
+        assert "a.txt" not in second
+
+        second.refresh()
+        assert second["a.txt"] == {"downloads": 0}
+
+    def test_deletes_are_visible_after_refresh(self, temp_dir):
+        first, second = self._workers(temp_dir)
+        first["a.txt"] = {"downloads": 0}
+        second.refresh()
+        del second["a.txt"]
+
+        first.refresh()
+        assert "a.txt" not in first
+
+    def test_update_item_is_atomic_across_workers(self, temp_dir):
+        first, second = self._workers(temp_dir)
+        first["a.txt"] = {"downloads": 0}
+
+        def increment(meta):
+            return dict(meta, downloads=meta["downloads"] + 1)
+
+        # The second worker has a stale cache but still must not lose updates
+        first.update_item("a.txt", increment)
+        second.update_item("a.txt", increment)
+
+        first.refresh()
+        assert first["a.txt"]["downloads"] == 2
+
+    def test_create_state_store_from_url(self, temp_dir):
+        path = os.path.join(temp_dir, "state.db")
+        store = create_state_store(f"sqlite:///{path}", {})
+        assert isinstance(store, SQLiteStore)
+        assert store.shared
@@ -0,0 +1,183 @@
+"""
+Tests for hot/cold storage tiering.
+"""
+import io
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fileshare
+from object_store import CompressedBackend, LocalBackend, ObjectStore
+from scrubber import ThrottledReader
+from state_store import JsonFileStore, SharedDict
+from tiering import Throttle, cold_contents, is_cold
+
+DAY = 86400
+
+
+def days_ago(days):
+    return (datetime.now() - timedelta(days=days)).isoformat()
+
+
+class TestColdness:
+    """Test which contents count as cold."""
+
+    def test_popular_files_stay_hot_longer(self):
+        now = time.time()
+        assert not is_cold({"upload_date": days_ago(20)}, now, 30)
+        assert is_cold({"upload_date": days_ago(31)}, now, 30)
+        assert not is_cold({"upload_date": days_ago(31), "downloads": 3}, now, 30)
+        assert is_cold({"upload_date": days_ago(61), "downloads": 1}, now, 30)
+        assert not is_cold(
+            {"upload_date": days_ago(90), "last_accessed": days_ago(1)}, now, 30
+        )
+
+    def test_shared_content_is_cold_only_when_all_files_are(self):
+        files = [
+            ("a.txt", {"sha256": "aa", "upload_date": days_ago(40)}),
+            ("b.txt", {"sha256": "aa", "upload_date": days_ago(1)}),
+            ("c.txt", {"sha256": "cc", "upload_date": days_ago(40)}),
+            ("d.txt", {"sha256": "cc", "upload_date": days_ago(50)}),
+            (
+                "e.txt",
+                {"sha256": "ee", "upload_date": days_ago(40), "storage": "chunked"},
+            ),
+        ]
+        assert cold_contents(files, time.time(), 30) == {"cc": ["c.txt", "d.txt"]}
+
+
+class TestThrottle:
+    def test_delays_follow_the_rate(self):
+        delays = []
+        throttle = Throttle(rate=1000, sleep=delays.append)
+        throttle(500)
+        throttle(500)
+        assert delays[0] == pytest.approx(0.5, abs=0.05)
+        assert delays[1] == pytest.approx(1.0, abs=0.05)
+
+        Throttle(rate=None, sleep=delays.append)(10**9)
+        assert len(delays) == 2
+
+
+class TestTieredObjectStore:
+    """Test the compressed cold backend and moves between tiers."""
+
+    @pytest.fixture
+    def store(self, temp_dir):
+        return ObjectStore(
+            LocalBackend(os.path.join(temp_dir, "hot")),
+            SharedDict(JsonFileStore({}), "objects"),
+            cold=CompressedBackend(os.path.join(temp_dir, "cold")),
+        )
+
+    def test_compressed_backend(self, temp_dir):
+        backend = CompressedBackend(temp_dir)
+        content = b"row,value\n" * 10000
+        backend.put_stream("abcd", io.BytesIO(content))
+
+        assert backend.stat("abcd") == {"size": len(content)}
+        assert os.path.getsize(backend.path("abcd")) < len(content) // 10
+        assert backend.read_range("abcd", 10, 19) == b"row,value"
+        assert list(backend.keys()) == ["abcd"]
+
+    def test_move_between_tiers(self, store, temp_dir):
+        path = os.path.join(temp_dir, "a.txt")
+        with open(path, "wb") as f:
+            f.write(b"cold data" * 1000)
+        _, digest = store.put(path)
+
+        assert store.move(digest, "cold") == 9000
+        assert store.tier(digest) == "cold"
+        assert store.backend.stat(digest) is None
+        with store.open(digest) as f:
+            f.seek(9)
+            assert f.read(9) == b"cold data"
+
+        assert store.move(digest, "cold") == 0
+        store.move(digest, "hot")
+        assert store.tier(digest) == "hot"
+        assert store.cold.stat(digest) is None
+        assert "tier" not in store.index[digest]
+
+        store.release(digest)
+        assert store.gc(grace=-1) == (1, 9000)
+
+    def test_move_throttles_every_read(self, store, temp_dir):
+        path = os.path.join(temp_dir, "big.txt")
+        with open(path, "wb") as f:
+            f.write(b"x" * (3 * 1024 * 1024))
+        _, digest = store.put(path)
+
+        charged = []
+        ran = []
+
+        def run(func, *args):
+            ran.append(func.__name__)
+            return func(*args)
+
+        store.move(
+            digest,
+            "cold",
+            reader=lambda stream: ThrottledReader(stream, charged.append),
+            run=run,
+        )
+        # Charged as the file is read, not once it has been moved
+        assert len(charged) > 1
+        assert sum(charged) == 3 * 1024 * 1024
+        assert ran == ["_copy", "delete"]
+
+
+class TestTiering:
+    """Test demotion and promotion through the app."""
+
+    @pytest.fixture(autouse=True)
+    def tiering(self, app):
+        app.config["TIERING"] = True
+        fileshare.tier_throttle.rate = None
+        yield
+        app.config["TIERING"] = False
+        fileshare.promotions.clear()
+
+    def test_idle_files_move_to_cold_tier_and_back(self, auth_client):
+        content = b"quarterly numbers\n" * 5000
+        auth_client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(content), "q3.txt"), "folder_path": "docs"},
+            content_type="multipart/form-data",
+        )
+        auth_client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(b"fresh"), "new.txt")},
+            content_type="multipart/form-data",
+        )
+        file_key = "docs/q3.txt"
+        digest = fileshare.files_metadata[file_key]["sha256"]
+        token = fileshare.find_share_token("q3.txt", "docs")
+
+        demoted, _ = fileshare.run_tiering_pass(now=time.time() + 31 * DAY)
+        assert demoted == 2
+        assert fileshare.files_metadata[file_key]["storage"] == "object"
+        assert fileshare.object_store.tier(digest) == "cold"
+        assert fileshare.blobs[digest]["refs"] == 0
+        # Nothing is left in the upload folder
+        assert not os.path.exists(fileshare.stored_file_path(file_key))
+
+        response = auth_client.get(f"/share/{token}")
+        assert response.data == content
+        assert digest in fileshare.promotions
+        # The queue is shared state: it survives a restart
+        fileshare.load_promotions()
+        assert digest in fileshare.promotions
+
+        assert fileshare.promote_pending() == 1
+        assert fileshare.promotions == {}
+        assert fileshare.object_store.tier(digest) == "hot"
+        response = auth_client.get(f"/share/{token}", headers={"Range": "bytes=0-8"})
+        assert response.data == b"quarterly"
+        assert fileshare.files_metadata[file_key]["downloads"] == 2
+
+        # Read just now: not cold again
+        demoted, _ = fileshare.run_tiering_pass(now=time.time() + DAY)
+        assert demoted == 0
@@ -0,0 +1,157 @@
+"""
+Tests for request tracing and the slow-request log.
+"""
+import io
+import json
+import os
+
+import app as fileshare
+from tracing import Trace, Tracer
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+class TestTracer:
+    """Test spans, the log entry and the OTLP export."""
+
+    def test_spans_and_log_entry(self):
+        trace = Trace("POST /api/upload", request_id="req-1")
+        with trace.span("save_file"):
+            with trace.span("fsync"):
+                pass
+        with trace.span("save_metadata"):
+            pass
+        trace.finish(status=200, request_bytes=10)
+
+        entry = trace.to_log()
+        assert entry["request_id"] == "req-1"
+        assert entry["status"] == 200
+        assert entry["request_bytes"] == 10
+        assert [stage["name"] for stage in entry["stages"]] == [
+            "save_file",
+            "fsync",
+            "save_metadata",
+        ]
+        assert entry["stages"][1]["parent"] == "save_file"
+        assert "parent" not in entry["stages"][0]
+        assert entry["other_ms"] >= 0
+
+    def test_otlp_document(self):
+        trace = Trace("GET /api/files")
+        with trace.span("scan_directory"):
+            with trace.span("stat"):
+                pass
+        trace.finish(status=503)
+
+        resource = trace.to_otlp()["resourceSpans"][0]
+        assert resource["resource"]["attributes"][0] == {
+            "key": "service.name",
+            "value": {"stringValue": "fileshare-pro"},
+        }
+        root, scan, stat = resource["scopeSpans"][0]["spans"]
+        assert len(root["traceId"]) == 32 and len(root["spanId"]) == 16
+        assert root["status"] == {"code": 2}
+        assert scan["parentSpanId"] == root["spanId"]
+        assert stat["parentSpanId"] == scan["spanId"]
+        assert int(root["startTimeUnixNano"]) <= int(scan["startTimeUnixNano"])
+        assert int(stat["endTimeUnixNano"]) <= int(root["endTimeUnixNano"])
+
+    def test_threshold(self, temp_dir):
+        log_path = os.path.join(temp_dir, "slow.log")
+        tracer = Tracer(threshold=0, log_path=log_path)
+        trace = tracer.begin("GET /")
+        tracer.current = lambda: trace
+
+        @tracer.span("work")
+        def work():
+            return 1
+
+        assert work() == 1
+        assert tracer.end(trace, status=200)["stages"][0]["name"] == "work"
+        assert read_lines(log_path)[0]["name"] == "GET /"
+
+        tracer.threshold = 60
+        assert tracer.end(tracer.begin("GET /"), status=200) is None
+        assert len(read_lines(log_path)) == 1
+
+    def test_disabled(self):
+        tracer = Tracer()
+        assert tracer.begin("GET /") is None
+        with tracer.span("work") as span:
+            assert span is None
+
+
+class TestRequestTracing:
+    """Test the traced request paths."""
+
+    def upload(self, auth_client, content, filename="data.txt"):
+        return auth_client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(content), filename), "folder_path": "docs"},
+            content_type="multipart/form-data",
+            headers={"X-Request-ID": "upload-1"},
+        )
+
+    def test_slow_upload_is_logged(self, app, auth_client, temp_dir):
+        log_path = os.path.join(temp_dir, "slow.log")
+        app.config.update(SLOW_REQUEST_THRESHOLD=0, SLOW_REQUEST_LOG=log_path)
+        fileshare.configure_tracing()
+        response = self.upload(auth_client, b"x" * 1000)
+        assert response.headers["X-Request-ID"] == "upload-1"
+
+        entry = [e for e in read_lines(log_path) if e["request_id"] == "upload-1"][0]
+        assert entry["route"] == "/api/upload"
+        assert entry["status"] == 200
+        assert entry["request_bytes"] > 1000
+        stages = [stage["name"] for stage in entry["stages"]]
+        for stage in (
+            "receive_body",
+            "save_file",
+            "store_content",
+            "save_metadata",
+            "generate_share_link",
+            "publish_file_change",
+        ):
+            assert stage in stages
+        for name in ("hash", "tree_hash"):
+            stage = next(stage for stage in entry["stages"] if stage["name"] == name)
+            assert stage["parent"] == "store_content"
+
+    def test_download_listing_and_share(self, app, auth_client, temp_dir):
+        self.upload(auth_client, b"shared content")
+        log_path = os.path.join(temp_dir, "slow.log")
+        export_path = os.path.join(temp_dir, "traces.jsonl")
+        app.config.update(
+            SLOW_REQUEST_THRESHOLD=0,
+            SLOW_REQUEST_LOG=log_path,
+            TRACE_EXPORT_FILE=export_path,
+        )
+        fileshare.configure_tracing()
+        auth_client.get("/api/download/docs/data.txt")
+        token = auth_client.get("/api/files").json[0]["children"][0]["share_token"]
+        auth_client.get(f"/share/{token}")
+
+        entries = {entry["route"]: entry for entry in read_lines(log_path)}
+        download = entries["/api/download/<path:filepath>"]
+        assert download["response_bytes"] == len(b"shared content")
+        assert "send_file" in [stage["name"] for stage in download["stages"]]
+        assert [stage["name"] for stage in entries["/api/files"]["stages"]][:1] == [
+            "scan_directory"
+        ]
+        share_stages = [
+            stage["name"] for stage in entries["/share/<share_token>"]["stages"]
+        ]
+        for stage in ("save_metadata", "save_share_links", "send_file"):
+            assert stage in share_stages
+        assert len(read_lines(export_path)) == 3
+
+    def test_fast_requests_are_not_logged(self, app, auth_client, temp_dir):
+        log_path = os.path.join(temp_dir, "slow.log")
+        app.config.update(SLOW_REQUEST_THRESHOLD=60, SLOW_REQUEST_LOG=log_path)
+        fileshare.configure_tracing()
+        response = auth_client.get("/api/stats")
+        assert "X-Request-ID" in response.headers
+        assert not os.path.exists(log_path)
@@ -0,0 +1,144 @@
+"""
+Tests for chunked tree hashes.
+"""
+import hashlib
+import io
+import os
+import random
+
+import pytest
+
+import app as fileshare
+from tree_hash import (
+    LEAF_SIZE,
+    TreeHasher,
+    compute_tree,
+    leaf_hashes,
+    leaves_for_range,
+    tree_root,
+    verify_tree,
+)
+
+CONTENT = random.Random(0).randbytes(10000)
+
+
+def opener(content):
+    return lambda: io.BytesIO(content)
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class TestTreeHash:
+    """Test leaves, roots and verification."""
+
+    def test_leaves_and_root(self):
+        tree = compute_tree(opener(CONTENT), len(CONTENT), leaf_size=4096)
+        assert tree["leaves"] == [
+            sha256(CONTENT[:4096]),
+            sha256(CONTENT[4096:8192]),
+            sha256(CONTENT[8192:]),
+        ]
+        pair = hashlib.sha256(
+            bytes.fromhex(tree["leaves"][0]) + bytes.fromhex(tree["leaves"][1])
+        ).digest()
+        # The odd leaf is carried up to the next level
+        assert tree["root"] == sha256(pair + bytes.fromhex(tree["leaves"][2]))
+
+    def test_single_leaf_and_empty_content(self):
+        assert compute_tree(opener(CONTENT), len(CONTENT))["root"] == sha256(CONTENT)
+        assert compute_tree(opener(b""), 0)["leaves"] == [sha256(b"")]
+        assert tree_root([]) == sha256(b"")
+
+    def test_parallel_matches_serial(self):
+        serial = leaf_hashes(opener(CONTENT), len(CONTENT), 1000, workers=1)
+        assert leaf_hashes(opener(CONTENT), len(CONTENT), 1000, workers=4) == serial
+        assert leaf_hashes(opener(CONTENT), len(CONTENT), 1000, leaves=[3]) == [
+            serial[3]
+        ]
+
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_streamed_tree_matches_computed_tree(self, workers):
+        for length in (0, 1000, 4500, len(CONTENT)):
+            hasher = TreeHasher(leaf_size=1000, workers=workers)
+            for start in range(0, length, 700):
+                hasher.update(CONTENT[start : min(start + 700, length)])
+            content = CONTENT[:length]
+            assert hasher.tree() == compute_tree(opener(content), length, 1000)
+
+    def test_verify_finds_damaged_leaves(self):
+        tree = compute_tree(opener(CONTENT), len(CONTENT), leaf_size=1000)
+        assert verify_tree(opener(CONTENT), len(CONTENT), tree) == []
+
+        damaged = bytearray(CONTENT)
+        damaged[4500] ^= 0xFF
+        assert verify_tree(opener(bytes(damaged)), len(damaged), tree) == [4]
+        assert verify_tree(opener(bytes(damaged)), len(damaged), tree, [0, 1]) == []
+        assert verify_tree(opener(CONTENT[:9000]), 9000, tree) == [9]
+
+    def test_leaves_for_range(self):
+        assert list(leaves_for_range(0, 10, 4)) == [0, 1, 2]
+        assert list(leaves_for_range(4, 8, 4)) == [1]
+        assert list(leaves_for_range(5, 5, 4)) == [1]
+
+
+class TestFileHashes:
+    """Test tree hashes of uploads and the hashes API."""
+
+    def upload(self, auth_client, content, filename="data.txt"):
+        return auth_client.post(
+            "/api/upload",
+            data={"file": (io.BytesIO(content), filename), "folder_path": "docs"},
+            content_type="multipart/form-data",
+        )
+
+    @pytest.mark.parametrize("mode", ["blob", "object", "chunked"])
+    def test_tree_is_computed_at_ingest(self, app, auth_client, mode, monkeypatch):
+        app.config["STORAGE_MODE"] = mode
+        # The leaves are hashed while the upload is hashed, not read again
+        monkeypatch.setattr(fileshare, "compute_tree", None)
+        content = b"a" * LEAF_SIZE + b"b" * 100
+        self.upload(auth_client, content)
+        digest = fileshare.files_metadata["docs/data.txt"]["sha256"]
+
+        tree = fileshare.trees[digest]
+        assert tree["leaves"] == [sha256(content[:LEAF_SIZE]), sha256(b"b" * 100)]
+
+        response = auth_client.get("/api/hashes/docs/data.txt")
+        assert response.json["root"] == tree["root"]
+        assert response.json["leaf_size"] == LEAF_SIZE
+        assert response.json["size"] == len(content)
+        assert auth_client.get("/api/hashes/docs/missing.txt").status_code == 404
+
+    def test_v1_hashes(self, client, auth_client):
+        self.upload(auth_client, b"hello tree")
+        fileshare.api_keys["test-key"] = {
+            "name": "t",
+            "created_at": "",
+            "usage_count": 0,
+        }
+
+        response = client.get(
+            "/api/v1/hashes/docs/data.txt", headers={"X-API-Key": "test-key"}
+        )
+        assert response.json["success"]
+        assert response.json["leaves"] == [sha256(b"hello tree")]
+
+    def test_v1_hashes_require_key(self, client):
+        assert client.get("/api/v1/hashes/docs/data.txt").status_code == 401
+
+    def test_older_files_and_collection(self, auth_client):
+        self.upload(auth_client, b"old content")
+        digest = fileshare.files_metadata["docs/data.txt"]["sha256"]
+        del fileshare.trees[digest]
+
+        # Computed on first request
+        response = auth_client.get("/api/hashes/docs/data.txt")
+        assert response.json["root"] == sha256(b"old content")
+        assert digest in fileshare.trees
+
+        fileshare.remove_file("docs/data.txt")
+        assert fileshare.collect_trees() == 1
+        assert digest not in fileshare.trees
+        assert not os.path.exists(fileshare.stored_file_path("docs/data.txt"))
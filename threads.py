@@ -0,0 +1,134 @@
+"""
+OS threads under eventlet for FileShare Pro.
+
+serve.py monkey-patches the standard library, so ``threading.Thread``
+starts a green thread: it runs on the worker's only OS thread, one at a
+time, and whatever it computes blocks every request the worker serves.
+Work that must run in parallel (leaf hashing), sample the other threads
+(the stack sampler) or run at a priority of its own (scrubbing) uses the
+threads of the unpatched ``threading`` module, and a green thread waits
+for it without blocking the others.
+
+Without monkey patching (tests, ``python app.py``) these are the plain
+``threading`` threads.
+"""
+import threading
+
+
+def _monkey_patched():
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched("thread")
+
+
+def native_threading():
+    """The threading module as it was before eventlet's monkey patching"""
+    if not _monkey_patched():
+        return threading
+    from eventlet import patcher
+
+    return patcher.original("threading")
+
+
+def wait(event, timeout=None):
+    """Wait for a ``native_threading()`` event, letting green threads run
+
+    Under eventlet the wait happens in its thread pool (``tpool``), so the
+    calling green thread yields instead of blocking the worker.
+    """
+    if not _monkey_patched():
+        return event.wait(timeout)
+    from eventlet import tpool
+
+    return tpool.execute(event.wait, timeout)
+
+
+def parallel_map(func, items, workers):
+    """``[func(item) for item in items]``, on up to ``workers`` OS threads
+
+    The first exception raised by ``func`` is raised again once all threads
+    have stopped.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    native = native_threading()
+    results = [None] * len(items)
+    errors = []
+    positions = iter(range(len(items)))
+    lock = native.Lock()
+    done = native.Event()
+    running = [min(workers, len(items))]
+
+    def work():
+        try:
+            while not errors:
+                with lock:
+                    position = next(positions, None)
+                if position is None:
+                    break
+                results[position] = func(items[position])
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            with lock:
+                running[0] -= 1
+                if not running[0]:
+                    done.set()
+
+    for _ in range(running[0]):
+        native.Thread(target=work, daemon=True).start()
+    wait(done)
+    if errors:
+        raise errors[0]
+    return results
+
+
+class Worker:
+    """One OS thread running the functions passed to ``call()`` in turn.
+
+    ``setup`` is called first on the thread itself, e.g. to lower its
+    priority, which would otherwise apply to the whole worker process.
+    """
+
+    def __init__(self, setup=None):
+        self.setup = setup
+        self._jobs = []
+        self._lock = None
+        self._pending = None
+        self._thread = None
+
+    def _start(self):
+        native = native_threading()
+        self._lock = native.Lock()
+        self._pending = native.Semaphore(0)
+        self._thread = native.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        if self.setup:
+            self.setup()
+        while True:
+            self._pending.acquire()
+            with self._lock:
+                job = self._jobs.pop(0)
+            try:
+                job["result"] = job["func"](*job["args"])
+            except BaseException as e:
+                job["error"] = e
+            job["done"].set()
+
+    def call(self, func, *args):
+        """Run ``func(*args)`` on the thread and return its result"""
+        if self._thread is None:
+            self._start()
+        job = {"func": func, "args": args, "done": native_threading().Event()}
+        with self._lock:
+            self._jobs.append(job)
+        self._pending.release()
+        wait(job["done"])
+        if "error" in job:
+            raise job["error"]
+        return job.get("result")
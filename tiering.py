@@ -0,0 +1,76 @@
+"""
+Hot/cold storage tiering for FileShare Pro.
+
+Most files are never downloaded again after their first days, while a few
+stay popular. With tiering enabled, contents nobody has read for a while
+are moved from the primary storage to a cold tier (by default a compressed
+archive directory, see ``CompressedBackend`` in object_store.py) and moved
+back when they are read again. File keys, share tokens and URLs do not
+change; downloads stream from whichever tier holds the content.
+
+A file is cold once it has been idle (since its last access, or its upload
+if it was never read) for ``cold_after_days``, stretched for popular
+files: a file downloaded ``n`` times gets ``cold_after_days * (1 +
+log2(1 + n))`` days. Content shared by several files (deduplication) is
+only cold when all of them are.
+
+``Throttle`` keeps background migration below a bandwidth budget: moves
+read through a ``scrubber.ThrottledReader`` charged to it, so a large
+file is copied at the budgeted rate too, on an OS thread of their own
+(see threads.py).
+"""
+import math
+import threading
+import time
+from datetime import datetime
+
+
+def last_access(metadata):
+    """Timestamp of a file's last read (or its upload)"""
+    value = metadata.get("last_accessed") or metadata.get("upload_date")
+    return datetime.fromisoformat(value).timestamp() if value else 0
+
+
+def is_cold(metadata, now, cold_after_days):
+    idle_days = (now - last_access(metadata)) / 86400
+    downloads = metadata.get("downloads", 0)
+    return idle_days >= cold_after_days * (1 + math.log2(1 + downloads))
+
+
+def cold_contents(files, now, cold_after_days):
+    """Content digests whose files are all cold -> their file keys
+
+    ``files`` yields ``(file key, metadata)``; chunked files are skipped
+    since their chunks are shared with other contents.
+    """
+    cold = {}
+    hot = set()
+    for file_key, metadata in files:
+        digest = metadata.get("sha256")
+        if not digest or metadata.get("storage") == "chunked":
+            continue
+        if is_cold(metadata, now, cold_after_days):
+            cold.setdefault(digest, []).append(file_key)
+        else:
+            hot.add(digest)
+    return {digest: keys for digest, keys in cold.items() if digest not in hot}
+
+
+class Throttle:
+    """Sleeps as needed to keep transfers below ``rate`` bytes per second."""
+
+    def __init__(self, rate=None, sleep=time.sleep):
+        self.rate = rate
+        self.sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, size):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now) + size / self.rate
+            delay = self._next - now
+        if delay > 0:
+            self.sleep(delay)
@@ -0,0 +1,229 @@
+"""
+Request tracing for FileShare Pro.
+
+A ``Trace`` is started for every request and the stages of the upload,
+download, listing and share link paths record ``span()``s in it (receiving
+the body, saving the file, hashing, saving metadata, the Socket.IO emit...).
+When the request took longer than the threshold, one JSON line with the
+stage breakdown, the request ID and the payload sizes is written to the
+slow-request log:
+
+    {"event": "slow_request", "request_id": "...", "route": "/api/upload",
+     "duration_ms": 812.4, "request_bytes": 104857600, ...,
+     "stages": [{"name": "receive_body", "start_ms": 0.2,
+                 "duration_ms": 402.1}, ...],
+     "other_ms": 3.1}
+
+``other_ms`` is the time not covered by a top-level stage. Spans nest: a
+stage started inside another one names it as ``parent``.
+
+Traces can also be appended to a file in the OpenTelemetry (OTLP/JSON)
+format, one ``{"resourceSpans": [...]}`` document per line, as written by
+the collector's file exporter and read by its ``otlpjsonfile`` receiver.
+
+Spans outside a traced request cost a function call. A response body is
+sent after the request has been traced, so the time spent streaming a
+download is not part of its trace.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+SERVICE_NAME = "fileshare-pro"
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_ERROR = 2
+
+
+class Trace:
+    """The spans recorded while handling one request."""
+
+    def __init__(self, name, request_id=None):
+        self.name = name
+        self.request_id = request_id or uuid.uuid4().hex
+        self.trace_id = uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.start_ns = time.time_ns()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.attributes = {}
+        self.spans = []
+        self._open = []
+
+    @contextmanager
+    def span(self, name):
+        parent = self._open[-1] if self._open else None
+        span = {
+            "name": name,
+            "span_id": uuid.uuid4().hex[:16],
+            "parent": parent,
+            "start": time.perf_counter() - self.start,
+            "duration": None,
+        }
+        self.spans.append(span)
+        self._open.append(span)
+        try:
+            yield span
+        finally:
+            span["duration"] = time.perf_counter() - self.start - span["start"]
+            self._open.pop()
+
+    def finish(self, **attributes):
+        self.duration = time.perf_counter() - self.start
+        self.attributes.update(attributes)
+        return self.duration
+
+    def to_log(self):
+        """The slow-request log entry of a finished trace"""
+        stages = []
+        covered = 0
+        for span in self.spans:
+            duration = span["duration"] or 0
+            stage = {
+                "name": span["name"],
+                "start_ms": round(span["start"] * 1000, 3),
+                "duration_ms": round(duration * 1000, 3),
+            }
+            if span["parent"] is not None:
+                stage["parent"] = span["parent"]["name"]
+            else:
+                covered += duration
+            stages.append(stage)
+        return {
+            "event": "slow_request",
+            "request_id": self.request_id,
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "timestamp": self.start_ns / 1e9,
+            "duration_ms": round(self.duration * 1000, 3),
+            **self.attributes,
+            "stages": stages,
+            "other_ms": round(max(self.duration - covered, 0) * 1000, 3),
+        }
+
+    def to_otlp(self, service=SERVICE_NAME):
+        """The trace as an OTLP/JSON ``resourceSpans`` document"""
+
+        def timestamp(seconds):
+            return str(self.start_ns + int(seconds * 1e9))
+
+        root = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KIND_SERVER,
+            "startTimeUnixNano": timestamp(0),
+            "endTimeUnixNano": timestamp(self.duration),
+            "attributes": _otlp_attributes(
+                dict(self.attributes, request_id=self.request_id)
+            ),
+        }
+        if self.attributes.get("status", 0) >= 500:
+            root["status"] = {"code": STATUS_ERROR}
+        spans = [root]
+        for span in self.spans:
+            parent = span["parent"]
+            spans.append(
+                {
+                    "traceId": self.trace_id,
+                    "spanId": span["span_id"],
+                    "parentSpanId": parent["span_id"] if parent else self.span_id,
+                    "name": span["name"],
+                    "kind": SPAN_KIND_INTERNAL,
+                    "startTimeUnixNano": timestamp(span["start"]),
+                    "endTimeUnixNano": timestamp(
+                        span["start"] + (span["duration"] or 0)
+                    ),
+                }
+            )
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _otlp_attributes({"service.name": service})
+                    },
+                    "scopeSpans": [
+                        {"scope": {"name": "fileshare.tracing"}, "spans": spans}
+                    ],
+                }
+            ]
+        }
+
+
+def _otlp_attributes(attributes):
+    result = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        result.append({"key": key, "value": typed})
+    return result
+
+
+class Tracer:
+    """Starts traces and writes the slow ones to the log.
+
+    ``current()`` returns the trace of the request being handled (or None);
+    it is set by the application. A ``threshold`` of None disables the
+    slow-request log, and tracing altogether when no ``export_path`` is set.
+    """
+
+    def __init__(self, threshold=None, log_path=None, export_path=None):
+        self.threshold = threshold
+        self.log_path = log_path
+        self.export_path = export_path
+        self.current = lambda: None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.threshold is not None or bool(self.export_path)
+
+    def begin(self, name, request_id=None):
+        return Trace(name, request_id) if self.enabled else None
+
+    @contextmanager
+    def span(self, name):
+        """Record a stage in the current trace (also usable as a decorator)"""
+        trace = self.current()
+        if trace is None:
+            yield None
+            return
+        with trace.span(name) as span:
+            yield span
+
+    def end(self, trace, **attributes):
+        """Finish ``trace``; returns its log entry if it was slow"""
+        duration = trace.finish(**attributes)
+        entry = None
+        if self.threshold is not None and duration >= self.threshold:
+            entry = trace.to_log()
+            self._write(self.log_path, entry)
+        if self.export_path:
+            self._write(self.export_path, trace.to_otlp())
+        return entry
+
+    def _write(self, path, document):
+        line = json.dumps(document, separators=(",", ":"))
+        if not path:
+            print(line)
+            return
+        with self._lock:
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(path, "a") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                print(f"Error writing trace to {path}: {str(e)}")
@@ -0,0 +1,147 @@
+"""
+Chunked tree hashes for FileShare Pro.
+
+A whole-file MD5 or SHA-256 has to be computed serially from the first
+byte to the last, and a mismatch does not say where the content differs.
+A tree hash splits the content into fixed-size leaves and hashes each one
+on its own:
+
+    leaf i = sha256(content[i * leaf_size : (i + 1) * leaf_size])
+    parent = sha256(left + right)   (raw 32-byte digests)
+    root   = the last remaining node
+
+An odd node at the end of a level is carried up unchanged, so the root of
+a one-leaf file is its leaf hash (the SHA-256 of the file). Empty content
+has a single leaf, the hash of no bytes.
+
+Leaves are independent: they are hashed in parallel on OS threads (hashlib
+releases the GIL while hashing large buffers; see threads.py for why these
+are not green threads under eventlet), and a client can check a byte
+range, a resumed download or a multipart part by hashing only the leaves
+it covers and comparing them with the stored leaf hashes.
+
+Uploads are read once: ``TreeHasher`` is fed the content while it is read
+for the whole-file MD5 and SHA-256 (``blob_store.hash_file``).
+"""
+import hashlib
+import os
+
+from threads import parallel_map
+
+LEAF_SIZE = 4 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+WORKERS = min(4, os.cpu_count() or 1)
+
+
+def leaf_count(size, leaf_size=LEAF_SIZE):
+    return max(1, -(-size // leaf_size))
+
+
+def leaves_for_range(start, end, leaf_size=LEAF_SIZE):
+    """Leaf numbers covering the bytes ``start`` to ``end`` (exclusive)"""
+    return range(start // leaf_size, max(-(-end // leaf_size), start // leaf_size + 1))
+
+
+def tree_root(leaves):
+    """Root hash (hex) of a list of leaf hashes (hex)"""
+    level = [bytes.fromhex(leaf) for leaf in leaves] or [hashlib.sha256().digest()]
+    while len(level) > 1:
+        parents = [
+            hashlib.sha256(level[i] + level[i + 1]).digest()
+            for i in range(0, len(level) - 1, 2)
+        ]
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+    return level[0].hex()
+
+
+def _hash_leaf(open_file, number, leaf_size):
+    sha256 = hashlib.sha256()
+    with open_file() as f:
+        f.seek(number * leaf_size)
+        remaining = leaf_size
+        while remaining:
+            data = f.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            sha256.update(data)
+            remaining -= len(data)
+    return sha256.hexdigest()
+
+
+def leaf_hashes(open_file, size, leaf_size=LEAF_SIZE, workers=WORKERS, leaves=None):
+    """SHA-256 (hex) of the leaves of a content, hashed in parallel
+
+    ``open_file()`` opens the content as a seekable binary stream (each
+    thread opens its own). ``leaves`` restricts hashing to those leaf
+    numbers; by default all leaves are hashed.
+    """
+    numbers = list(range(leaf_count(size, leaf_size)) if leaves is None else leaves)
+    return parallel_map(
+        lambda number: _hash_leaf(open_file, number, leaf_size), numbers, workers
+    )
+
+
+class TreeHasher:
+    """Tree hash of a content fed in order with ``update()``
+
+    Full leaves are hashed ``workers`` at a time, so at most that many
+    leaves are buffered.
+    """
+
+    def __init__(self, leaf_size=LEAF_SIZE, workers=WORKERS):
+        self.leaf_size = leaf_size
+        self.workers = max(workers, 1)
+        self._buffer = bytearray()
+        self._full = []
+        self._leaves = []
+
+    def _hash_full(self):
+        self._leaves += parallel_map(
+            lambda leaf: hashlib.sha256(leaf).hexdigest(), self._full, self.workers
+        )
+        self._full = []
+
+    def update(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.leaf_size:
+            self._full.append(bytes(self._buffer[: self.leaf_size]))
+            del self._buffer[: self.leaf_size]
+            if len(self._full) >= self.workers:
+                self._hash_full()
+
+    def tree(self):
+        """``{"leaf_size", "root", "leaves"}`` of the content fed so far"""
+        self._hash_full()
+        leaves = list(self._leaves)
+        if self._buffer or not leaves:
+            leaves.append(hashlib.sha256(self._buffer).hexdigest())
+        return {
+            "leaf_size": self.leaf_size,
+            "root": tree_root(leaves),
+            "leaves": leaves,
+        }
+
+
+def compute_tree(open_file, size, leaf_size=LEAF_SIZE, workers=WORKERS):
+    """Tree hash of a content: ``{"leaf_size", "root", "leaves"}``"""
+    leaves = leaf_hashes(open_file, size, leaf_size, workers)
+    return {"leaf_size": leaf_size, "root": tree_root(leaves), "leaves": leaves}
+
+
+def verify_tree(open_file, size, tree, leaves=None, workers=WORKERS):
+    """Numbers of the leaves that do not match ``tree`` (empty: intact)
+
+    ``leaves`` restricts the check to those leaf numbers. A content whose
+    size no longer matches the tree fails on the leaves that differ.
+    """
+    expected = tree["leaves"]
+    count = max(leaf_count(size, tree["leaf_size"]), len(expected))
+    numbers = list(range(count) if leaves is None else leaves)
+    hashes = leaf_hashes(open_file, size, tree["leaf_size"], workers, numbers)
+    return [
+        number
+        for number, digest in zip(numbers, hashes)
+        if number >= len(expected) or digest != expected[number]
+    ]